@@ -145,3 +145,104 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
+# URL de la Distance Matrix API (se puede cambiar para apuntar a un servidor local de pruebas)
+DISTANCE_MATRIX_URL = os.getenv(
+    "DISTANCE_MATRIX_URL",
+    "https://maps.googleapis.com/maps/api/distancematrix/json",
+)
+
+# URL de la Directions API (trazado de la ruta optimizada por las calles)
+DIRECTIONS_URL = os.getenv(
+    "DIRECTIONS_URL",
+    "https://maps.googleapis.com/maps/api/directions/json",
+)
+
+# Cache de distancias entre pares de coordenadas (tabla DistanciaCache)
+DISTANCIA_CACHE_HABILITADO = os.getenv("DISTANCIA_CACHE_HABILITADO", "True") == "True"
+DISTANCIA_CACHE_TTL_DIAS = int(os.getenv("DISTANCIA_CACHE_TTL_DIAS", "30"))
+DISTANCIA_CACHE_MAX_ENTRADAS = int(os.getenv("DISTANCIA_CACHE_MAX_ENTRADAS", "500000"))
+DISTANCIA_CACHE_PURGA_CADA = int(os.getenv("DISTANCIA_CACHE_PURGA_CADA", "50"))
+
+# Cache de optimizaciones completas (tabla SolucionCache): repetir la misma
+# solicitud reutiliza la solución guardada
+SOLUCION_CACHE_HABILITADO = os.getenv("SOLUCION_CACHE_HABILITADO", "True") == "True"
+SOLUCION_CACHE_TTL_HORAS = float(os.getenv("SOLUCION_CACHE_TTL_HORAS", "24"))
+SOLUCION_CACHE_MAX_ENTRADAS = int(os.getenv("SOLUCION_CACHE_MAX_ENTRADAS", "200"))
+
+# Direcciones geocodificadas que se mantienen en memoria (además de la tabla GeocodificacionCache)
+GEOCODING_LRU_TAMANO = int(os.getenv("GEOCODING_LRU_TAMANO", "1024"))
+
+# ==========================
+# OPTIMIZADOR DE RUTAS
+# ==========================
+
+# Tiempo (segundos) que el optimizador puede usar por defecto en cada solicitud
+OPTIMIZER_MAX_SECONDS = float(os.getenv("OPTIMIZER_MAX_SECONDS", "10"))
+
+# Tope duro: aunque el formulario pida más, nunca se supera este valor
+OPTIMIZER_MAX_SECONDS_LIMITE = float(os.getenv("OPTIMIZER_MAX_SECONDS_LIMITE", "60"))
+
+# Si es True, toda optimización se encola y la ejecuta el comando procesar_trabajos
+OPTIMIZACION_ASINCRONA = os.getenv("OPTIMIZACION_ASINCRONA", "False") == "True"
+# Al iniciar procesar_trabajos, los trabajos 'en proceso' hace más de esto se
+# dan por interrumpidos (el worker anterior se detuvo) y se marcan con error
+TRABAJO_TIMEOUT_SEGUNDOS = int(os.getenv("TRABAJO_TIMEOUT_SEGUNDOS", "3600"))
+
+# Al agregar o borrar un punto, actualizar la última ruta (inserción + búsqueda
+# local en el vecindario) en vez de esperar a una nueva optimización completa
+REOPTIMIZACION_INCREMENTAL = os.getenv("REOPTIMIZACION_INCREMENTAL", "True") == "True"
+
+# Rutas grandes: cantidad de procesos que corren arranques de la búsqueda local
+# en paralelo (1 = un solo proceso) y cantidad de arranques (vacío = uno por proceso)
+SOLVER_PROCESOS = int(os.getenv("SOLVER_PROCESOS", "1"))
+SOLVER_ARRANQUES = int(os.getenv("SOLVER_ARRANQUES", "0")) or None
+
+# Escenarios (/escenarios/): procesos que resuelven en paralelo las rutas de
+# los distintos pares de bodegas origen/destino
+ESCENARIOS_PROCESOS = int(os.getenv("ESCENARIOS_PROCESOS", "2"))
+
+# Desde esta cantidad de puntos (un vehículo, sin ventanas) la ruta se resuelve
+# por zonas: solo se piden las matrices de cada zona y los tramos entre zonas
+# (0 = nunca). DESCOMPOSICION_TAMANO_GRUPO es el máximo de puntos por zona.
+DESCOMPOSICION_MIN_PUNTOS = int(os.getenv("DESCOMPOSICION_MIN_PUNTOS", "1000"))
+DESCOMPOSICION_TAMANO_GRUPO = int(os.getenv("DESCOMPOSICION_TAMANO_GRUPO", "150"))
+
+# API de puntos del mapa (/api/puntos/): puntos por página por defecto y máximo
+PUNTOS_API_POR_PAGINA = int(os.getenv("PUNTOS_API_POR_PAGINA", "500"))
+PUNTOS_API_POR_PAGINA_MAX = int(os.getenv("PUNTOS_API_POR_PAGINA_MAX", "2000"))
+
+# Proveedores de la matriz de distancias, en orden de preferencia; si uno no
+# está disponible o falla se usa el siguiente (google, grafo_local, haversine)
+DISTANCIA_PROVEEDORES = [
+    p.strip() for p in os.getenv("DISTANCIA_PROVEEDORES", "google,haversine").split(",") if p.strip()
+]
+
+# Proveedor 'haversine': línea recta por este factor de desvío y velocidad promedio
+DISTANCIA_FACTOR_DESVIO = float(os.getenv("DISTANCIA_FACTOR_DESVIO", "1.3"))
+DISTANCIA_VELOCIDAD_KMH = float(os.getenv("DISTANCIA_VELOCIDAD_KMH", "30"))
+
+# Proveedor 'grafo_local': carpeta con el grafo vial en .npy (ver rutas/proveedores.py)
+GRAFO_VIAL_DIR = os.getenv("GRAFO_VIAL_DIR", "")
+
+# ==========================
+# MÉTRICAS
+# ==========================
+
+# Tiempos por etapa, llamadas a las APIs y cache en el log (logger 'rutas.metricas')
+# y en /metrics (formato Prometheus). En False no se mide nada.
+METRICAS_HABILITADAS = os.getenv("METRICAS_HABILITADAS", "True") == "True"
+
+# Log de la app (las etapas medidas salen en nivel INFO)
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "rutas": {
+            "handlers": ["console"],
+            "level": os.getenv("RUTAS_LOG_NIVEL", "INFO"),
+        },
+    },
+}
@@ -1,3 +1,22 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import PuntoEntrega, RutaPlan, Vehiculo
+
+
+@admin.register(Vehiculo)
+class VehiculoAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'capacidad_kg', 'rendimiento_km_por_litro', 'activo')
+    list_filter = ('activo',)
+
+
+@admin.register(PuntoEntrega)
+class PuntoEntregaAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'direccion', 'demanda_kg', 'vehiculo', 'orden_optimo')
+    search_fields = ('nombre', 'direccion')
+
+
+@admin.register(RutaPlan)
+class RutaPlanAdmin(admin.ModelAdmin):
+    list_display = ('id', 'creado', 'bodega', 'metodo', 'distancia_km', 'costo_clp')
+    list_filter = ('bodega',)
+    exclude = ('matriz',)
@@ -0,0 +1,309 @@
+# benchmark.py
+"""
+Benchmark reproducible de los optimizadores, sin red.
+
+Genera instancias sintéticas con semilla (puntos uniformes o agrupados en
+barrios alrededor de Concepción o Santiago, con destino igual al origen o en
+otra bodega, como las arma optimizar_ruta), calcula la matriz con el
+proveedor haversine y corre cada modo del optimizador midiendo tiempo,
+memoria máxima, largo de la ruta y brecha contra la mejor solución conocida.
+
+Lo usa el comando `python manage.py benchmark_solver`.
+"""
+
+import csv
+import json
+import math
+import time
+import tracemalloc
+import zlib
+
+import numpy as np
+
+from . import optimizer
+from .matriz import MatrizDistancias
+from .proveedores import ProveedorHaversine
+
+# Centro (lat, lng) y radio de reparto (km) de cada ciudad
+CIUDADES = {
+    'concepcion': (-36.8270, -73.0503, 8.0),
+    'santiago': (-33.4489, -70.6693, 15.0),
+}
+DISTRIBUCIONES = ('uniforme', 'agrupada')
+DESTINOS = ('mismo_origen', 'otra_bodega')
+TAMANOS = (5, 10, 20, 50, 100, 200, 500)
+MODOS = ('held_karp', 'heuristico', 'anytime', 'paralelo', 'incremental', 'cvrp', 'ventanas')
+
+# Los modos de una misma familia resuelven el mismo problema y se comparan entre sí
+FAMILIAS = {
+    'held_karp': 'tsp',
+    'heuristico': 'tsp',
+    'anytime': 'tsp',
+    'paralelo': 'tsp',
+    'incremental': 'tsp',
+    'cvrp': 'cvrp',
+    'ventanas': 'ventanas',
+}
+
+# Parámetros fijos del proveedor, para que el benchmark no dependa de settings
+FACTOR_DESVIO = 1.3
+VELOCIDAD_KMH = 30
+
+# Procesos del modo 'paralelo' (la memoria de los workers no entra en memoria_pico_kb)
+PROCESOS_PARALELO = 2
+
+KM_POR_GRADO = 111.32
+
+COLUMNAS_CSV = (
+    'instancia', 'n', 'ciudad', 'distribucion', 'destino', 'semilla', 'modo',
+    'metodo', 'distancia_km', 'mejor_conocido_km', 'brecha_pct', 'tiempo_s',
+    'memoria_pico_kb', 'optimo_probado',
+)
+
+
+def _desplazar(lat, lng, norte_km, este_km):
+    """Coordenadas a (norte_km, este_km) de (lat, lng) (aproximación plana)."""
+    return (
+        lat + norte_km / KM_POR_GRADO,
+        lng + este_km / (KM_POR_GRADO * math.cos(math.radians(lat))),
+    )
+
+
+def generar_instancia(n, ciudad='concepcion', distribucion='uniforme',
+                      destino='mismo_origen', semilla=0):
+    """
+    Instancia sintética reproducible: la misma combinación de parámetros
+    siempre genera los mismos puntos.
+
+    Devuelve un dict con 'nombre', 'n', 'coordenadas' (origen, n puntos y
+    destino, como la matriz de optimizar_ruta), 'demandas' (kg) y las ventanas
+    horarias en segundos desde la salida ('ventana_inicio', 'ventana_fin',
+    'servicio', indexadas como la matriz).
+    """
+    nombre = f"{ciudad}-{distribucion}-{destino}-n{n}-s{semilla}"
+    rng = np.random.default_rng(zlib.crc32(nombre.encode()))
+    lat0, lng0, radio = CIUDADES[ciudad]
+
+    if distribucion == 'agrupada':
+        num_grupos = max(2, n // 25)
+        angulos = rng.uniform(0, 2 * np.pi, num_grupos)
+        distancias = radio * np.sqrt(rng.uniform(0.05, 1.0, num_grupos))
+        centros = np.column_stack((distancias * np.sin(angulos), distancias * np.cos(angulos)))
+        desplazamientos = centros[rng.integers(0, num_grupos, n)] + rng.normal(0, radio / 15, (n, 2))
+    else:
+        angulos = rng.uniform(0, 2 * np.pi, n)
+        distancias = radio * np.sqrt(rng.uniform(0, 1, n))
+        desplazamientos = np.column_stack((distancias * np.sin(angulos), distancias * np.cos(angulos)))
+
+    # la bodega de origen queda en el borde de la zona de reparto
+    origen = _desplazar(lat0, lng0, -radio * 0.6, -radio * 0.3)
+    if destino == 'mismo_origen':
+        fin = origen
+    else:
+        fin = _desplazar(lat0, lng0, radio * 0.5, radio * 0.4)
+
+    coordenadas = [origen] + [_desplazar(lat0, lng0, norte, este) for norte, este in desplazamientos] + [fin]
+
+    # ventana de 2 horas a la mitad de los puntos, 5 minutos de servicio en cada uno
+    num_nodos = n + 2
+    ventana_inicio = np.zeros(num_nodos)
+    ventana_fin = np.full(num_nodos, np.inf)
+    servicio = np.zeros(num_nodos)
+    con_ventana = np.flatnonzero(rng.random(n) < 0.5) + 1
+    ventana_inicio[con_ventana] = rng.uniform(0, 4 * 3600, len(con_ventana)).round(-2)
+    ventana_fin[con_ventana] = ventana_inicio[con_ventana] + 2 * 3600
+    servicio[1:n + 1] = 5 * 60
+
+    return {
+        'nombre': nombre,
+        'n': n,
+        'ciudad': ciudad,
+        'distribucion': distribucion,
+        'destino': destino,
+        'semilla': semilla,
+        'coordenadas': [{'latitud': lat, 'longitud': lng} for lat, lng in coordenadas],
+        'demandas': rng.integers(5, 60, n).astype(float).tolist(),
+        'ventana_inicio': ventana_inicio,
+        'ventana_fin': ventana_fin,
+        'servicio': servicio,
+    }
+
+
+def matrices_instancia(instancia):
+    """(distancias_km, duraciones_s) de la instancia, como MatrizDistancias."""
+    proveedor = ProveedorHaversine(factor_desvio=FACTOR_DESVIO, velocidad_kmh=VELOCIDAD_KMH)
+    distancias, duraciones = proveedor._matriz_coordenadas(instancia['coordenadas'])
+    return MatrizDistancias(distancias), MatrizDistancias(duraciones)
+
+
+def _vehiculos(instancia):
+    """Tres vehículos de distinto rendimiento con capacidad de sobra para la demanda."""
+    capacidad = max(math.ceil(sum(instancia['demandas']) / 2), max(instancia['demandas']))
+    return [
+        {'capacidad': capacidad, 'rendimiento_km_por_litro': rendimiento}
+        for rendimiento in (8, 10, 12)
+    ]
+
+
+def _ruta_base(instancia, distancias):
+    """Ruta con los primeros n - 1 puntos, para medir cuánto cuesta agregar el último."""
+    n = instancia['n']
+    indices = list(range(n)) + [n + 1]
+    base = optimizer.resolver_ruta(distancias.submatriz(indices), n - 1, 0, n, metodo='heuristico')
+    return [indices[i] for i in base['ruta']]
+
+
+def _resolver(modo, instancia, distancias, duraciones, max_seconds, ruta_base=None):
+    """Corre un modo y devuelve (distancia_km, método, óptimo probado)."""
+    n = instancia['n']
+    fin = n + 1
+
+    if modo == 'held_karp':
+        resultado = optimizer.resolver_ruta(distancias, n, 0, fin, metodo='held_karp')
+    elif modo == 'heuristico':
+        resultado = optimizer.resolver_ruta(distancias, n, 0, fin, metodo='heuristico')
+    elif modo == 'anytime':
+        resultado = optimizer.resolver_ruta(distancias, n, 0, fin, max_seconds=max_seconds)
+    elif modo == 'paralelo':
+        resultado = optimizer.resolver_ruta_paralelo(
+            distancias, n, 0, fin, max_seconds=max_seconds, procesos=PROCESOS_PARALELO,
+        )
+    elif modo == 'incremental':
+        resultado = optimizer.insertar_punto(distancias, ruta_base, n)
+    elif modo == 'cvrp':
+        flota = optimizer.solve_cvrp(
+            distancias, n, instancia['demandas'], _vehiculos(instancia),
+            0, fin, max_seconds=max_seconds,
+        )
+        return flota['distancia_km'], 'cvrp', False
+    elif modo == 'ventanas':
+        resultado = optimizer.solve_tsptw(
+            distancias, duraciones, n,
+            instancia['ventana_inicio'], instancia['ventana_fin'], instancia['servicio'],
+            0, fin, max_seconds=max_seconds,
+        )
+    else:
+        raise ValueError(f"Modo desconocido: {modo}")
+    return resultado['distancia_km'], resultado['metodo'], resultado['optimo_probado']
+
+
+def ejecutar_modo(modo, instancia, distancias, duraciones, max_seconds=1.0):
+    """
+    Corre un modo sobre una instancia midiendo tiempo y memoria máxima
+    (tracemalloc, que también registra los arrays de NumPy). Devuelve una fila
+    de resultados (sin la brecha, que se calcula al final con calcular_brechas).
+    En el modo 'incremental' solo se mide la inserción del último punto.
+    """
+    ruta_base = _ruta_base(instancia, distancias) if modo == 'incremental' else None
+
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        distancia_km, metodo, optimo_probado = _resolver(
+            modo, instancia, distancias, duraciones, max_seconds, ruta_base
+        )
+    finally:
+        tiempo_s = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'instancia': instancia['nombre'],
+        'n': instancia['n'],
+        'ciudad': instancia['ciudad'],
+        'distribucion': instancia['distribucion'],
+        'destino': instancia['destino'],
+        'semilla': instancia['semilla'],
+        'modo': modo,
+        'metodo': metodo,
+        'distancia_km': round(distancia_km, 4),
+        'mejor_conocido_km': None,
+        'brecha_pct': None,
+        'tiempo_s': round(tiempo_s, 4),
+        'memoria_pico_kb': round(pico / 1024, 1),
+        'optimo_probado': optimo_probado,
+    }
+
+
+def modo_aplicable(modo, n):
+    """Held-Karp solo hasta HELD_KARP_MAX_PUNTOS; incremental necesita al menos 2 puntos y paralelo 3."""
+    if modo == 'held_karp':
+        return n <= optimizer.HELD_KARP_MAX_PUNTOS
+    if modo == 'incremental':
+        return n >= 2
+    if modo == 'paralelo':
+        return n >= 3
+    return True
+
+
+def correr_benchmark(tamanos=TAMANOS, modos=MODOS, ciudades=tuple(CIUDADES),
+                     distribuciones=DISTRIBUCIONES, destinos=DESTINOS, semillas=(0,),
+                     max_seconds=1.0, mejores=None, progreso=None):
+    """
+    Corre todos los modos sobre todas las combinaciones de instancias.
+    'mejores' son las mejores distancias conocidas de corridas anteriores
+    ({"instancia|familia": km}); se actualiza con las de esta corrida.
+    'progreso(fila)' se llama después de cada modo.
+
+    Devuelve (filas, mejores).
+    """
+    filas = []
+    for n in tamanos:
+        for ciudad in ciudades:
+            for distribucion in distribuciones:
+                for destino in destinos:
+                    for semilla in semillas:
+                        instancia = generar_instancia(n, ciudad, distribucion, destino, semilla)
+                        distancias, duraciones = matrices_instancia(instancia)
+                        for modo in modos:
+                            if not modo_aplicable(modo, n):
+                                continue
+                            fila = ejecutar_modo(modo, instancia, distancias, duraciones, max_seconds)
+                            filas.append(fila)
+                            if progreso is not None:
+                                progreso(fila)
+    return filas, calcular_brechas(filas, mejores)
+
+
+def calcular_brechas(filas, mejores=None):
+    """
+    Completa 'mejor_conocido_km' y 'brecha_pct' de cada fila comparando con la
+    mejor distancia de su familia (tsp, cvrp, ventanas) en esta corrida o en
+    'mejores'. Devuelve el dict de mejores actualizado.
+    """
+    mejores = dict(mejores or {})
+    for fila in filas:
+        clave = f"{fila['instancia']}|{FAMILIAS[fila['modo']]}"
+        if clave not in mejores or fila['distancia_km'] < mejores[clave]:
+            mejores[clave] = fila['distancia_km']
+    for fila in filas:
+        mejor = mejores[f"{fila['instancia']}|{FAMILIAS[fila['modo']]}"]
+        fila['mejor_conocido_km'] = mejor
+        fila['brecha_pct'] = round((fila['distancia_km'] - mejor) / mejor * 100, 3) if mejor > 0 else 0.0
+    return mejores
+
+
+def escribir_json(filas, archivo):
+    json.dump(filas, archivo, ensure_ascii=False, indent=2)
+
+
+def escribir_csv(filas, archivo):
+    escritor = csv.DictWriter(archivo, fieldnames=COLUMNAS_CSV)
+    escritor.writeheader()
+    escritor.writerows(filas)
+
+
+def resumen(filas):
+    """Por modo: instancias, tiempo total, brecha promedio y máxima."""
+    por_modo = {}
+    for fila in filas:
+        por_modo.setdefault(fila['modo'], []).append(fila)
+    return {
+        modo: {
+            'instancias': len(grupo),
+            'tiempo_total_s': round(sum(f['tiempo_s'] for f in grupo), 3),
+            'brecha_promedio_pct': round(sum(f['brecha_pct'] for f in grupo) / len(grupo), 3),
+            'brecha_maxima_pct': max(f['brecha_pct'] for f in grupo),
+        }
+        for modo, grupo in por_modo.items()
+    }
@@ -0,0 +1,109 @@
+# cache_distancias.py
+"""
+Cache persistente (en la BD) de distancias/duraciones entre pares de coordenadas,
+para no volver a pedir a la API tramos que ya se consultaron.
+"""
+
+import itertools
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DistanciaCache
+
+# Decimales con que se redondean las coordenadas (5 decimales ≈ 1 metro)
+DECIMALES_CLAVE = 5
+
+# Cantidad de valores por consulta "IN" (SQLite limita los parámetros por consulta)
+TAMANO_CONSULTA = 400
+
+# Escrituras desde que arrancó el proceso (para recortar la cache cada tanto)
+_escrituras = itertools.count(1)
+
+
+def clave_coordenadas(latitud, longitud):
+    """Clave de cache "lat,lng" con las coordenadas redondeadas."""
+    return f"{float(latitud):.{DECIMALES_CLAVE}f},{float(longitud):.{DECIMALES_CLAVE}f}"
+
+
+def _habilitado():
+    return getattr(settings, 'DISTANCIA_CACHE_HABILITADO', True)
+
+
+def _limite_vigencia():
+    dias = getattr(settings, 'DISTANCIA_CACHE_TTL_DIAS', 30)
+    return timezone.now() - timedelta(days=dias)
+
+
+def buscar(origenes, destinos, modo='driving'):
+    """
+    Busca en cache los tramos origenes x destinos (listas de claves) vigentes.
+    Devuelve {(origen, destino): (distancia_km, duracion_s)}.
+    """
+    if not _habilitado() or not origenes or not destinos:
+        return {}
+
+    limite = _limite_vigencia()
+    encontrados = {}
+    for i in range(0, len(origenes), TAMANO_CONSULTA):
+        for j in range(0, len(destinos), TAMANO_CONSULTA):
+            filas = DistanciaCache.objects.filter(
+                modo=modo,
+                origen__in=origenes[i:i + TAMANO_CONSULTA],
+                destino__in=destinos[j:j + TAMANO_CONSULTA],
+                creado__gte=limite,
+            ).values_list('origen', 'destino', 'distancia_km', 'duracion_s')
+            for origen, destino, distancia_km, duracion_s in filas:
+                encontrados[(origen, destino)] = (distancia_km, duracion_s)
+    return encontrados
+
+
+def guardar(tramos, modo='driving'):
+    """
+    Guarda (o actualiza) tramos {(origen, destino): (distancia_km, duracion_s)}
+    y, cada DISTANCIA_CACHE_PURGA_CADA escrituras, recorta la cache si supera
+    el tamaño máximo.
+    """
+    if not _habilitado() or not tramos:
+        return
+
+    ahora = timezone.now()
+    DistanciaCache.objects.bulk_create(
+        [
+            DistanciaCache(
+                origen=origen,
+                destino=destino,
+                modo=modo,
+                distancia_km=distancia_km,
+                duracion_s=duracion_s,
+                creado=ahora,
+            )
+            for (origen, destino), (distancia_km, duracion_s) in tramos.items()
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['origen', 'destino', 'modo'],
+        update_fields=['distancia_km', 'duracion_s', 'creado'],
+    )
+    # el recorte revisa toda la tabla: se hace solo cada tanto
+    if next(_escrituras) % getattr(settings, 'DISTANCIA_CACHE_PURGA_CADA', 50) == 0:
+        purgar()
+
+
+def purgar():
+    """Borra los tramos vencidos y, si aún sobran, los más antiguos (por creado e id)."""
+    DistanciaCache.objects.filter(creado__lt=_limite_vigencia()).delete()
+
+    maximo = getattr(settings, 'DISTANCIA_CACHE_MAX_ENTRADAS', 500_000)
+    corte = (
+        DistanciaCache.objects.order_by('-creado', '-id')
+        .values_list('creado', 'id')[maximo:maximo + 1]
+    )
+    if corte:
+        # un bulk_create deja el mismo 'creado' en todas sus filas: el id desempata
+        creado, id_corte = corte[0]
+        DistanciaCache.objects.filter(
+            Q(creado__lt=creado) | Q(creado=creado, id__lte=id_corte)
+        ).delete()
@@ -0,0 +1,139 @@
+# cache_soluciones.py
+"""
+Cache persistente (en la BD) de optimizaciones completas: si se vuelve a
+optimizar exactamente lo mismo (mismos puntos, origen, destino, vehículos y
+parámetros del solver) se reutiliza la solución guardada sin geocodificar,
+pedir la matriz ni resolver.
+
+La clave es un sha256 del contenido de la solicitud. Los puntos entran
+ordenados por su contenido (no por id), así que también hay acierto si se
+borraron y se volvieron a importar los mismos puntos; por eso las rutas y la
+matriz se guardan en ese orden canónico. El precio de la bencina y el
+rendimiento del vehículo no forman parte de la clave: consumo y costo se
+recalculan con la distancia guardada.
+
+Las entradas vencen a las SOLUCION_CACHE_TTL_HORAS y, si hay más de
+SOLUCION_CACHE_MAX_ENTRADAS, se descartan las usadas hace más tiempo.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .geocoding import normalizar_direccion
+from .models import SolucionCache
+
+# Cambiar si cambia lo que entra en la clave o lo que se guarda
+VERSION_CLAVE = 2
+
+
+def _habilitado():
+    return getattr(settings, 'SOLUCION_CACHE_HABILITADO', True)
+
+
+def _limite_vigencia():
+    horas = getattr(settings, 'SOLUCION_CACHE_TTL_HORAS', 24)
+    return timezone.now() - timedelta(hours=horas)
+
+
+def _contenido_punto(punto):
+    return (
+        f"{float(punto.latitud):.6f}",
+        f"{float(punto.longitud):.6f}",
+        punto.nombre,
+        float(punto.demanda_kg),
+        punto.ventana_inicio.strftime('%H:%M') if punto.ventana_inicio else '',
+        punto.ventana_fin.strftime('%H:%M') if punto.ventana_fin else '',
+        float(punto.tiempo_servicio_min),
+    )
+
+
+def clave_solicitud(parametros, puntos, vehiculos):
+    """
+    Clave de la solicitud y el orden canónico de los puntos: 'orden[c]' es la
+    posición en 'puntos' del c-ésimo punto canónico.
+    """
+    contenidos = [_contenido_punto(p) for p in puntos]
+    orden = sorted(range(len(puntos)), key=contenidos.__getitem__)
+    solicitud = {
+        'version': VERSION_CLAVE,
+        'puntos': [contenidos[i] for i in orden],
+        'origen': normalizar_direccion(parametros['direccion_origen']),
+        'destino': normalizar_direccion(parametros['direccion_destino']),
+        'vehiculos': [
+            (v.id, v.nombre, float(v.capacidad_kg), float(v.rendimiento_km_por_litro))
+            for v in vehiculos
+        ],
+        'hora_salida': parametros.get('hora_salida') or '',
+        'max_seconds': parametros['max_seconds'],
+        'proveedores': list(getattr(settings, 'DISTANCIA_PROVEEDORES', [])),
+        'solver_procesos': getattr(settings, 'SOLVER_PROCESOS', 1),
+        'solver_arranques': getattr(settings, 'SOLVER_ARRANQUES', None),
+    }
+    if parametros.get('pares_bodegas'):
+        # bodega más conveniente: cuentan los pares candidatos, no el elegido
+        solicitud['pares_bodegas'] = [
+            [normalizar_direccion(origen), normalizar_direccion(destino)]
+            for origen, destino in parametros['pares_bodegas']
+        ]
+    texto = json.dumps(solicitud, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest(), orden
+
+
+def indices_canonicos(orden):
+    """Índices de la matriz original en orden canónico (origen y destino no se mueven)."""
+    return [0] + [i + 1 for i in orden] + [len(orden) + 1]
+
+
+def a_canonico(ruta, orden):
+    """Traduce una ruta (índices de la matriz original) al orden canónico."""
+    posicion = {original: c for c, original in enumerate(indices_canonicos(orden))}
+    return [posicion[i] for i in ruta]
+
+
+def buscar(clave):
+    """La solución vigente con esa clave (marcándola como usada), o None."""
+    if not _habilitado():
+        return None
+    solucion = SolucionCache.objects.filter(clave=clave, creado__gte=_limite_vigencia()).first()
+    if solucion is not None:
+        solucion.usado = timezone.now()
+        solucion.save(update_fields=['usado'])
+    return solucion
+
+
+def guardar(clave, rutas, resultado, matriz=None):
+    """
+    Guarda (o reemplaza) la solución de 'clave'. 'rutas' y 'matriz' (bytes
+    .npy) ya deben estar en orden canónico. Luego recorta la cache.
+    """
+    if not _habilitado():
+        return
+    ahora = timezone.now()
+    SolucionCache.objects.update_or_create(
+        clave=clave,
+        defaults={
+            'rutas': rutas,
+            'matriz': matriz,
+            'resultado': resultado,
+            'creado': ahora,
+            'usado': ahora,
+        },
+    )
+    purgar()
+
+
+def purgar():
+    """Borra las soluciones vencidas y, si aún sobran, las usadas hace más tiempo."""
+    SolucionCache.objects.filter(creado__lt=_limite_vigencia()).delete()
+
+    maximo = getattr(settings, 'SOLUCION_CACHE_MAX_ENTRADAS', 200)
+    corte = (
+        SolucionCache.objects.order_by('-usado')
+        .values_list('usado', flat=True)[maximo:maximo + 1]
+    )
+    if corte:
+        SolucionCache.objects.filter(usado__lte=corte[0]).delete()
@@ -0,0 +1,236 @@
+# descomposicion.py
+"""
+Descomposición geográfica para rutas muy grandes (miles de puntos), donde ni
+la matriz completa n x n (cuota de la API y memoria) ni la búsqueda local sobre
+ella son viables:
+
+1. Los puntos se agrupan por zona con k-means (grupos de a lo más
+   tamano_grupo puntos; los que quedan más grandes se vuelven a partir).
+2. Se ordenan los grupos con un TSP sobre sus centros (en línea recta) y en
+   cada grupo se eligen un punto de entrada (el más cercano a la salida del
+   grupo anterior) y uno de salida (el más cercano al grupo siguiente).
+3. Se pide solo la matriz de cada grupo (entrada + puntos + salida) y la
+   distancia de cada conector (salida de un grupo -> entrada del siguiente),
+   así que la cantidad de tramos crece casi linealmente con n.
+4. Los grupos se resuelven como caminos entrada -> salida, en paralelo si hay
+   más de un proceso, y se unen en una sola ruta.
+"""
+
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from . import espacial, optimizer
+from . import proveedores
+
+ITERACIONES_KMEANS = 25
+
+
+def _plano(coordenadas):
+    """Lat/lng en radianes (n, 2) a un plano aproximado en km (para k-means)."""
+    lat0 = float(np.mean(coordenadas[:, 0]))
+    return np.column_stack((
+        coordenadas[:, 0] * espacial.RADIO_TIERRA_KM,
+        coordenadas[:, 1] * espacial.RADIO_TIERRA_KM * math.cos(lat0),
+    ))
+
+
+def _kmeans(xy, k, rng):
+    """Etiqueta de grupo (0..k-1) de cada punto. Inicio k-means++ y luego Lloyd."""
+    n = len(xy)
+    centros = [xy[rng.integers(n)]]
+    d2 = ((xy - centros[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = d2.sum()
+        i = rng.choice(n, p=d2 / total) if total > 0 else rng.integers(n)
+        centros.append(xy[i])
+        d2 = np.minimum(d2, ((xy - xy[i]) ** 2).sum(axis=1))
+    centros = np.array(centros)
+
+    etiquetas = np.zeros(n, dtype=np.int64)
+    for _ in range(ITERACIONES_KMEANS):
+        distancias = ((xy[:, None, :] - centros[None, :, :]) ** 2).sum(axis=2)
+        etiquetas = np.argmin(distancias, axis=1)
+        nuevos = centros.copy()
+        for g in range(k):
+            miembros = xy[etiquetas == g]
+            if len(miembros):
+                nuevos[g] = miembros.mean(axis=0)
+        if np.allclose(nuevos, centros):
+            break
+        centros = nuevos
+    return etiquetas
+
+
+def agrupar(coordenadas, tamano_grupo, semilla=0):
+    """
+    Reparte los puntos (array (n, 2) de lat/lng en radianes) en grupos de a lo
+    más 'tamano_grupo'. Devuelve una lista de arrays de índices.
+    """
+    rng = np.random.default_rng(semilla)
+    xy = _plano(coordenadas)
+    pendientes = [np.arange(len(xy))]
+    grupos = []
+    while pendientes:
+        indices = pendientes.pop()
+        if len(indices) <= tamano_grupo:
+            grupos.append(indices)
+            continue
+        k = max(2, math.ceil(len(indices) / tamano_grupo))
+        etiquetas = _kmeans(xy[indices], k, rng)
+        partes = [indices[etiquetas == g] for g in range(k) if np.any(etiquetas == g)]
+        if len(partes) == 1:
+            # puntos repetidos: se cortan en trozos del tamaño máximo
+            partes = np.array_split(indices, k)
+        pendientes.extend(partes)
+    return grupos
+
+
+def _ordenar_grupos(grupos, coordenadas, origen, destino):
+    """Orden de visita de los grupos: TSP (línea recta) entre sus centros."""
+    centros = np.array([coordenadas[g].mean(axis=0) for g in grupos])
+    nodos = np.vstack((origen, centros, destino))
+    d = proveedores.distancias_haversine(nodos, nodos)
+    resultado = optimizer.resolver_ruta(d, len(grupos), 0, len(grupos) + 1)
+    return [grupos[i - 1] for i in resultado['ruta'][1:-1]]
+
+
+def _entradas_y_salidas(grupos, coordenadas, origen, destino):
+    """
+    Para cada grupo (ya ordenados), el índice del punto de entrada y el de
+    salida: entra por el más cercano a la salida anterior y sale por el más
+    cercano al centro del grupo siguiente (o al destino).
+    """
+    extremos = []
+    anterior = origen
+    for i, grupo in enumerate(grupos):
+        puntos = coordenadas[grupo]
+        entrada = int(np.argmin(proveedores.distancias_haversine(anterior[None, :], puntos)[0]))
+        siguiente = destino if i == len(grupos) - 1 else coordenadas[grupos[i + 1]].mean(axis=0)
+        hacia_siguiente = proveedores.distancias_haversine(siguiente[None, :], puntos)[0]
+        if len(grupo) > 1:
+            hacia_siguiente[entrada] = np.inf
+        salida = int(np.argmin(hacia_siguiente))
+        extremos.append((entrada, salida))
+        anterior = puntos[salida]
+    return extremos
+
+
+def _resolver_grupo(matriz, num_interiores, max_seconds):
+    """
+    Camino entrada (0) -> interiores -> salida (último).
+    Devuelve (ruta local, km, iteraciones, movimientos).
+    """
+    if num_interiores == 0:
+        return [0, 1], float(np.asarray(matriz)[0, 1]), 0, 0
+    resultado = optimizer.resolver_ruta(
+        matriz, num_interiores, 0, num_interiores + 1, max_seconds=max_seconds
+    )
+    return resultado['ruta'], resultado['distancia_km'], resultado['iteraciones'], resultado['movimientos']
+
+
+def resolver(puntos, origen_coords, destino_coords, tamano_grupo, max_seconds=None, procesos=1):
+    """
+    Ruta origen -> todos los 'puntos' (PuntoEntrega) -> destino por
+    descomposición. Devuelve (resultado, proveedor) con 'resultado' como el de
+    optimizer.resolver_ruta (índices: 0 = origen, 1..n = puntos, n + 1 =
+    destino; metodo 'descomposicion', más 'grupos' y 'tramos_consultados'),
+    o (None, None) si algún proveedor no respondió.
+    """
+    inicio = time.monotonic()
+    n = len(puntos)
+    coordenadas = proveedores.latlng_radianes(
+        [{'latitud': p.latitud, 'longitud': p.longitud} for p in puntos]
+    )
+    origen = proveedores.latlng_radianes([origen_coords])[0]
+    destino = proveedores.latlng_radianes([destino_coords])[0]
+
+    grupos = _ordenar_grupos(agrupar(coordenadas, tamano_grupo), coordenadas, origen, destino)
+    extremos = _entradas_y_salidas(grupos, coordenadas, origen, destino)
+
+    # matrices de cada grupo: [entrada] + interiores + [salida]
+    nodos_grupos = []
+    matrices = []
+    nombres = set()
+    tramos = 0
+    for grupo, (entrada, salida) in zip(grupos, extremos):
+        if len(grupo) == 1:
+            nodos_grupos.append([int(grupo[0])] * 2)
+            matrices.append(np.zeros((2, 2), dtype=np.float32))
+            continue
+        interiores = [int(i) for k, i in enumerate(grupo) if k not in (entrada, salida)]
+        nodos = [int(grupo[entrada])] + interiores + [int(grupo[salida])]
+        matriz, nombre = proveedores.matriz_distancias(
+            [puntos[i] for i in interiores],
+            {'latitud': puntos[nodos[0]].latitud, 'longitud': puntos[nodos[0]].longitud},
+            dest_coords={'latitud': puntos[nodos[-1]].latitud, 'longitud': puntos[nodos[-1]].longitud},
+        )
+        if matriz is None:
+            return None, None
+        nodos_grupos.append(nodos)
+        matrices.append(np.asarray(matriz))
+        nombres.add(nombre)
+        tramos += len(nodos) ** 2
+
+    # conectores: origen -> primer grupo, salida de cada grupo -> entrada del siguiente, último -> destino
+    coords = [origen_coords] + [
+        {'latitud': puntos[i].latitud, 'longitud': puntos[i].longitud}
+        for nodos in nodos_grupos for i in (nodos[0], nodos[-1])
+    ] + [destino_coords]
+    conectores = 0.0
+    for a, b in zip(coords[0::2], coords[1::2]):
+        distancias, nombre = proveedores.distancias_punto(a, [b])
+        if distancias is None:
+            return None, None
+        conectores += distancias[0][0]
+        nombres.add(nombre)
+        tramos += 2
+
+    # cada grupo recibe una parte del tiempo (más si se resuelven en paralelo)
+    segundos = None
+    if max_seconds:
+        segundos = max_seconds * min(procesos, len(grupos)) / len(grupos)
+    argumentos = [(m, len(nodos) - 2 if len(set(nodos)) > 1 else 0, segundos)
+                  for m, nodos in zip(matrices, nodos_grupos)]
+    soluciones = None
+    if procesos > 1 and len(grupos) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(procesos, len(grupos))) as pool:
+                soluciones = list(pool.map(_resolver_grupo, *zip(*argumentos)))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Error al resolver los grupos en paralelo, se resuelven en un solo proceso: {e}")
+    if soluciones is None:
+        soluciones = [_resolver_grupo(*a) for a in argumentos]
+
+    # unir: origen, cada grupo en su orden, destino
+    ruta = [0]
+    total = conectores
+    iteraciones = movimientos = 0
+    for nodos, (ruta_local, km, iteraciones_grupo, movimientos_grupo) in zip(nodos_grupos, soluciones):
+        if len(set(nodos)) == 1:
+            ruta.append(nodos[0] + 1)
+            continue
+        if not ruta_local:
+            return None, None
+        ruta.extend(nodos[i] + 1 for i in ruta_local)
+        total += km
+        iteraciones += iteraciones_grupo
+        movimientos += movimientos_grupo
+    ruta.append(n + 1)
+
+    resultado = {
+        'ruta': ruta,
+        'distancia_km': total,
+        'metodo': 'descomposicion',
+        'iteraciones': iteraciones,
+        'movimientos': movimientos,
+        'curva_mejora': [],
+        'optimo_probado': False,
+        'tiempo_s': round(time.monotonic() - inicio, 4),
+        'grupos': len(grupos),
+        'tramos_consultados': tramos,
+    }
+    return resultado, '+'.join(sorted(nombres))
@@ -0,0 +1,140 @@
+# escenarios.py
+"""
+Evaluación de escenarios "qué pasa si" en un solo trabajo: una grilla de
+bodegas de origen/destino, precios de la bencina y rendimientos del vehículo,
+sin tocar el orden guardado de los puntos.
+
+- Las bodegas se geocodifican juntas y se pide una sola matriz de distancias
+  con todas las bodegas y los puntos; cada par origen/destino usa su submatriz.
+- El precio y el rendimiento no cambian la ruta: solo se resuelve un TSP por
+  par origen/destino distinto (en paralelo si hay más de un proceso).
+- Los litros y costos de todas las combinaciones se calculan de una vez con
+  optimizer.calculate_fuel_cost sobre arrays (distancias x rendimientos x precios).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from django.conf import settings
+
+from . import metricas
+from . import optimizer
+from .models import PuntoEntrega
+from .pipeline import OptimizacionError, matriz_con_bodegas
+
+# Tope de valores por lista de la grilla (precios, rendimientos)
+MAX_VALORES = 20
+
+
+def _sin_progreso(fraccion, etapa):
+    pass
+
+
+def _resolver(matriz, num_puntos, max_seconds):
+    """Ruta origen -> puntos -> destino de un par de bodegas (corre en el pool)."""
+    resultado = optimizer.resolver_ruta(matriz, num_puntos, 0, num_puntos + 1, max_seconds=max_seconds)
+    return {
+        'distancia_km': resultado['distancia_km'],
+        'metodo': resultado['metodo'],
+        'optimo_probado': resultado['optimo_probado'],
+        'tiempo_s': resultado['tiempo_s'],
+    }
+
+
+def evaluar(parametros, progreso=None):
+    """
+    'parametros': origenes y destinos (listas de direcciones; destino
+    'same_origin' = volver a la bodega de origen), precios, rendimientos y
+    max_seconds (tiempo total para resolver todos los pares).
+
+    Devuelve un dict con 'problemas' (un TSP por par origen/destino), 'filas'
+    (cada combinación con distancia, litros y costo, de la más barata a la más
+    cara), el proveedor de distancias y las duraciones por etapa.
+    Lanza OptimizacionError si algo falla.
+    """
+    progreso = progreso or _sin_progreso
+    duraciones = {}
+
+    puntos = list(PuntoEntrega.objects.order_by('id'))
+    if not puntos:
+        raise OptimizacionError('No hay puntos de entrega para evaluar escenarios.')
+    if any(p.ventana_inicio or p.ventana_fin or p.tiempo_servicio_min for p in puntos):
+        raise OptimizacionError(
+            'Los escenarios no consideran ventanas horarias ni tiempos de servicio; '
+            'optimiza esa ruta desde el mapa.'
+        )
+    minimo_descomposicion = getattr(settings, 'DESCOMPOSICION_MIN_PUNTOS', 0)
+    if minimo_descomposicion and len(puntos) >= minimo_descomposicion:
+        raise OptimizacionError('Hay demasiados puntos para evaluar escenarios en un solo trabajo.')
+
+    pares = list(dict.fromkeys(
+        (origen, origen if destino == 'same_origin' else destino)
+        for origen in parametros['origenes'] for destino in parametros['destinos']
+    ))
+    bodegas = list(dict.fromkeys(direccion for par in pares for direccion in par))
+
+    # 1) y 2) BODEGAS GEOCODIFICADAS EN UN LOTE Y UNA SOLA MATRIZ:
+    # nodos = bodegas (0..k-1) y luego los puntos (k..k+n-1)
+    progreso(0.05, 'Geocodificando bodegas y obteniendo la matriz de distancias')
+    _, matriz, proveedor = matriz_con_bodegas(bodegas, puntos, duraciones)
+    k, n = len(bodegas), len(puntos)
+
+    # 3) UN TSP POR PAR ORIGEN/DESTINO DISTINTO
+    progreso(0.4, f'Resolviendo {len(pares)} rutas')
+    procesos = min(getattr(settings, 'ESCENARIOS_PROCESOS', 2), len(pares))
+    segundos = parametros['max_seconds'] * procesos / len(pares)
+    interiores = list(range(k, k + n))
+    submatrices = [
+        np.asarray(matriz.submatriz([bodegas.index(o)] + interiores + [bodegas.index(d)]))
+        for o, d in pares
+    ]
+    with metricas.span('optimizacion', duraciones=duraciones, metodo='escenarios') as datos:
+        soluciones = None
+        if procesos > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=procesos) as pool:
+                    soluciones = list(pool.map(
+                        _resolver, submatrices, [n] * len(pares), [segundos] * len(pares)
+                    ))
+            except (OSError, BrokenProcessPool) as e:
+                print(f"Error al resolver los escenarios en paralelo, se resuelven en un solo proceso: {e}")
+        if soluciones is None:
+            soluciones = [_resolver(m, n, segundos) for m in submatrices]
+        datos['rutas'] = len(pares)
+        datos['procesos'] = procesos
+
+    # 4) LITROS Y COSTO DE TODAS LAS COMBINACIONES (distancias x rendimientos x precios)
+    progreso(0.9, 'Calculando costos')
+    distancias = np.array([s['distancia_km'] for s in soluciones])
+    rendimientos = np.array(parametros['rendimientos'], dtype=float)
+    precios = np.array(parametros['precios'], dtype=float)
+    litros = optimizer.calculate_fuel_cost(distancias[:, None], rendimientos[None, :])
+    costos = litros[:, :, None] * precios[None, None, :]
+
+    filas = [
+        {
+            'origen': pares[i][0],
+            'destino': pares[i][1],
+            'rendimiento': float(rendimientos[j]),
+            'precio': float(precios[m]),
+            'distancia_km': round(float(distancias[i]), 2),
+            'litros': round(float(litros[i, j]), 2),
+            'costo_clp': round(float(costos[i, j, m]), 0),
+        }
+        for i, j, m in np.ndindex(costos.shape)
+    ]
+    filas.sort(key=lambda f: f['costo_clp'])
+
+    progreso(1.0, 'Terminado')
+    return {
+        'escenarios': True,
+        'problemas': [
+            {'origen': o, 'destino': d, **{**s, 'distancia_km': round(s['distancia_km'], 2)}}
+            for (o, d), s in zip(pares, soluciones)
+        ],
+        'filas': filas,
+        'puntos': n,
+        'proveedor_distancias': proveedor,
+        'duraciones': {etapa: round(s, 4) for etapa, s in duraciones.items()},
+    }
@@ -0,0 +1,154 @@
+# espacial.py
+"""
+Consultas espaciales sobre los puntos de entrega sin recorrerlos todos:
+
+- en_rectangulo(queryset, sur, oeste, norte, este): filtra en la BD usando el
+  índice de latitud/longitud ("puntos en la zona visible del mapa").
+- IndiceEspacial: grilla en memoria sobre un conjunto de coordenadas, para
+  consultas repetidas (puntos en un rectángulo, k vecinos más cercanos, listas
+  de vecinos de cada punto). La usan la inserción incremental de un punto,
+  para probar solo los tramos junto a sus vecinos más cercanos, y la búsqueda
+  local de las rutas grandes, que solo prueba movimientos hacia vecinos.
+"""
+
+import math
+
+import numpy as np
+
+RADIO_TIERRA_KM = 6371.0088
+
+# Puntos por celda que se buscan al elegir el tamaño de la grilla
+PUNTOS_POR_CELDA = 4
+
+
+def en_rectangulo(queryset, sur, oeste, norte, este):
+    """Puntos del queryset dentro del rectángulo (usa el índice latitud/longitud)."""
+    return queryset.filter(
+        latitud__gte=sur, latitud__lte=norte,
+        longitud__gte=oeste, longitud__lte=este,
+    )
+
+
+def leer_rectangulo(texto):
+    """
+    "sur,oeste,norte,este" -> (sur, oeste, norte, este) en grados.
+    Lanza ValueError si no son cuatro números o el rectángulo está al revés.
+    """
+    partes = [float(x) for x in texto.split(',')]
+    if len(partes) != 4 or not all(math.isfinite(x) for x in partes):
+        raise ValueError(f"Rectángulo inválido: {texto!r}")
+    sur, oeste, norte, este = partes
+    if sur > norte or oeste > este:
+        raise ValueError(f"Rectángulo inválido: {texto!r}")
+    return sur, oeste, norte, este
+
+
+class IndiceEspacial:
+    """
+    Grilla uniforme (en km, con la longitud corregida por la latitud media)
+    sobre un conjunto fijo de coordenadas. Construirla es O(n); las consultas
+    solo revisan las celdas que tocan.
+
+    'coordenadas' es una secuencia de (latitud, longitud) en grados; los
+    resultados son índices de esa secuencia.
+    """
+
+    def __init__(self, coordenadas, celda_km=None):
+        grados = np.asarray(coordenadas, dtype=float).reshape(-1, 2)
+        self.grados = grados
+        self.n = len(grados)
+        lat0 = math.radians(float(grados[:, 0].mean())) if self.n else 0.0
+        self._km_por_grado_lat = math.radians(1) * RADIO_TIERRA_KM
+        self._km_por_grado_lng = self._km_por_grado_lat * math.cos(lat0)
+        self.xy = np.column_stack((
+            grados[:, 1] * self._km_por_grado_lng,
+            grados[:, 0] * self._km_por_grado_lat,
+        ))
+
+        if celda_km is None:
+            if self.n > 1:
+                ancho, alto = np.ptp(self.xy, axis=0)
+                area = max(ancho * alto, 1e-6)
+                celda_km = math.sqrt(area * PUNTOS_POR_CELDA / self.n)
+            celda_km = max(celda_km or 1.0, 0.01)
+        self.celda_km = celda_km
+
+        # índices de los puntos agrupados por celda (ordenando una sola vez)
+        self._celdas = {}
+        if self.n:
+            celdas = np.floor(self.xy / self.celda_km).astype(np.int64)
+            unicas, celda_de = np.unique(celdas, axis=0, return_inverse=True)
+            celda_de = celda_de.reshape(-1)
+            orden = np.argsort(celda_de, kind='stable')
+            cortes = np.cumsum(np.bincount(celda_de, minlength=len(unicas)))[:-1]
+            self._celdas = {
+                (cx, cy): grupo for (cx, cy), grupo in zip(unicas.tolist(), np.split(orden, cortes))
+            }
+
+    def _celda(self, xy):
+        return np.floor(np.asarray(xy) / self.celda_km).astype(np.int64).tolist()
+
+    def _xy(self, latitud, longitud):
+        return np.array([longitud * self._km_por_grado_lng, latitud * self._km_por_grado_lat])
+
+    def en_rectangulo(self, sur, oeste, norte, este):
+        """Índices de los puntos dentro del rectángulo (grados)."""
+        (x0, y0), (x1, y1) = self._celda([self._xy(sur, oeste), self._xy(norte, este)])
+        candidatos = [
+            self._celdas[(cx, cy)]
+            for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)
+            if (cx, cy) in self._celdas
+        ] if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self._celdas) else list(self._celdas.values())
+        if not candidatos:
+            return np.array([], dtype=np.int64)
+        indices = np.sort(np.concatenate(candidatos))
+        lat, lng = self.grados[indices, 0], self.grados[indices, 1]
+        dentro = (lat >= sur) & (lat <= norte) & (lng >= oeste) & (lng <= este)
+        return indices[dentro]
+
+    def k_cercanos(self, latitud, longitud, k, excluir=None):
+        """
+        Índices de los k puntos más cercanos (en línea recta) a la coordenada,
+        del más cercano al más lejano. 'excluir' es un índice a omitir (p. ej.
+        el mismo punto).
+        """
+        objetivo = self._xy(latitud, longitud)
+        cx, cy = self._celda([objetivo])[0]
+        disponibles = self.n - (excluir is not None)
+        k = min(k, disponibles)
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+
+        encontrados = []
+        radio = 0
+        while (2 * radio + 1) ** 2 <= len(self._celdas):
+            # anillo de celdas a distancia 'radio' (en celdas) de la del objetivo
+            for dx in range(-radio, radio + 1):
+                for dy in range(-radio, radio + 1):
+                    if max(abs(dx), abs(dy)) == radio and (cx + dx, cy + dy) in self._celdas:
+                        encontrados.append(self._celdas[(cx + dx, cy + dy)])
+            indices = np.concatenate(encontrados) if encontrados else np.array([], dtype=np.int64)
+            if excluir is not None:
+                indices = indices[indices != excluir]
+            # todo lo que está a menos de radio * celda ya se revisó
+            if len(indices) >= k:
+                distancias = np.hypot(*(self.xy[indices] - objetivo).T)
+                orden = np.argsort(distancias, kind='stable')[:k]
+                if distancias[orden[-1]] <= radio * self.celda_km or len(indices) == disponibles:
+                    return indices[orden]
+            radio += 1
+
+        # el objetivo está lejos de los puntos (o son pocas celdas): se revisan todos
+        indices = np.arange(self.n)
+        if excluir is not None:
+            indices = indices[indices != excluir]
+        distancias = np.hypot(*(self.xy[indices] - objetivo).T)
+        return indices[np.argsort(distancias, kind='stable')[:k]]
+
+    def listas_vecinos(self, k):
+        """Array (n, k) con los k vecinos más cercanos de cada punto (sin él mismo)."""
+        k = min(k, self.n - 1)
+        vecinos = np.empty((self.n, max(k, 0)), dtype=np.int64)
+        for i, (latitud, longitud) in enumerate(self.grados):
+            vecinos[i] = self.k_cercanos(latitud, longitud, k, excluir=i)
+        return vecinos
@@ -0,0 +1,159 @@
+# geocoding.py
+"""
+Servicio de geocodificación compartido por las vistas.
+
+Cada dirección se normaliza y se busca primero en una cache en memoria (LRU),
+luego en la tabla GeocodificacionCache y recién al final en la API de Google
+(con la sesión y los reintentos de google_api). geocodificar_lote resuelve
+varias direcciones en paralelo.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import google_api, metricas
+from .models import GeocodificacionCache
+
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+
+
+class GeocodingError(Exception):
+    """No se pudo geocodificar una dirección."""
+
+
+class _LRU:
+    """Cache LRU simple y segura entre hilos: dirección normalizada -> (lat, lng)."""
+
+    def __init__(self, tamano):
+        self.tamano = tamano
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            if clave not in self._datos:
+                return None
+            self._datos.move_to_end(clave)
+            return self._datos[clave]
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.tamano:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+_lru = _LRU(getattr(settings, 'GEOCODING_LRU_TAMANO', 1024))
+
+def normalizar_direccion(direccion):
+    """Minúsculas, sin espacios repetidos ni espacios antes de las comas."""
+    texto = " ".join((direccion or "").casefold().split())
+    return texto.replace(" ,", ",").strip(" ,.")
+
+
+def _consultar_api(direccion, api_key):
+    """Llama a la API de geocodificación. Devuelve (lat, lng) o lanza GeocodingError."""
+    params = {
+        "address": direccion,
+        "key": api_key
+    }
+    try:
+        data = google_api.pedir_json(GEOCODE_URL, params, api='geocoding', timeout=15)
+    except google_api.ApiError as e:
+        raise GeocodingError(str(e))
+
+    if data.get('status') == 'OK' and data.get('results'):
+        location = data['results'][0]['geometry']['location']
+        return float(location['lat']), float(location['lng'])
+    raise GeocodingError(
+        f"No se pudo geocodificar la dirección: {direccion}. "
+        f"Estado: {data.get('status')}"
+    )
+
+
+def geocodificar_lote(direcciones, api_key=None):
+    """
+    Geocodifica varias direcciones. Las que no están en cache se piden a la API
+    en paralelo. Devuelve (resultados, errores):
+        resultados = {direccion: (lat, lng)}
+        errores    = {direccion: mensaje}
+    """
+    if api_key is None:
+        api_key = settings.GOOGLE_MAPS_API_KEY
+
+    coords_por_clave, error_por_clave = {}, {}
+    pendientes = {}  # normalizada -> dirección original (para la API)
+    for direccion in direcciones:
+        clave = normalizar_direccion(direccion)
+        if not clave:
+            error_por_clave[clave] = "La dirección no puede estar vacía."
+            continue
+        coords = _lru.get(clave)
+        if coords is not None:
+            coords_por_clave[clave] = coords
+        else:
+            pendientes.setdefault(clave, direccion)
+    en_lru = len(coords_por_clave)
+    metricas.incrementar('rutas_cache_aciertos_total', en_lru, cache='geocodificacion_lru')
+
+    # tabla persistente (una sola consulta para todo el lote)
+    if pendientes:
+        for fila in GeocodificacionCache.objects.filter(direccion_normalizada__in=list(pendientes)):
+            coords = (float(fila.latitud), float(fila.longitud))
+            _lru.set(fila.direccion_normalizada, coords)
+            coords_por_clave[fila.direccion_normalizada] = coords
+            del pendientes[fila.direccion_normalizada]
+        metricas.incrementar('rutas_cache_aciertos_total', len(coords_por_clave) - en_lru,
+                             cache='geocodificacion_bd')
+
+    # API, en paralelo; la BD se escribe desde este hilo
+    if pendientes:
+        def consultar(direccion):
+            try:
+                return _consultar_api(direccion, api_key)
+            except GeocodingError as e:
+                return e
+
+        claves = list(pendientes)
+        metricas.incrementar('rutas_cache_fallos_total', len(claves), cache='geocodificacion')
+        with ThreadPoolExecutor(max_workers=min(google_api.MAX_SOLICITUDES_PARALELAS, len(claves))) as pool:
+            respuestas = list(pool.map(consultar, [pendientes[c] for c in claves]))
+
+        nuevos = []
+        for clave, respuesta in zip(claves, respuestas):
+            if isinstance(respuesta, GeocodingError):
+                error_por_clave[clave] = str(respuesta)
+                continue
+            _lru.set(clave, respuesta)
+            coords_por_clave[clave] = respuesta
+            nuevos.append(GeocodificacionCache(
+                direccion_normalizada=clave,
+                latitud=round(respuesta[0], 6),
+                longitud=round(respuesta[1], 6),
+            ))
+        GeocodificacionCache.objects.bulk_create(nuevos, ignore_conflicts=True)
+
+    resultados, errores = {}, {}
+    for direccion in direcciones:
+        clave = normalizar_direccion(direccion)
+        if clave in coords_por_clave:
+            resultados[direccion] = coords_por_clave[clave]
+        else:
+            errores[direccion] = error_por_clave[clave]
+    return resultados, errores
+
+
+def geocodificar(direccion, api_key=None):
+    """Geocodifica una dirección. Devuelve (lat, lng) o lanza GeocodingError."""
+    resultados, errores = geocodificar_lote([direccion], api_key=api_key)
+    if direccion in resultados:
+        return resultados[direccion]
+    raise GeocodingError(errores[direccion])
@@ -0,0 +1,245 @@
+# geometria.py
+"""
+Trazado de la ruta optimizada por las calles, calculado una vez en el backend
+(Directions API) y guardado como polilínea codificada junto al resultado, para
+que el mapa lo dibuje sin llamar a la API en cada carga de la página.
+
+La Directions API acepta a lo más MAX_WAYPOINTS paradas intermedias por
+solicitud, así que la ruta se pide en tramos consecutivos que comparten su
+primera/última parada, en paralelo, y se unen. Si no hay clave API o un tramo
+falla, ese tramo queda en línea recta entre sus paradas.
+
+Cada tramo queda identificado por sus paradas: al actualizar una ruta de forma
+incremental solo se vuelven a pedir los tramos que cambiaron.
+"""
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import google_api
+
+DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+
+# Paradas intermedias por solicitud (más el origen y el destino del tramo)
+MAX_WAYPOINTS = 25
+
+
+class DirectionsError(Exception):
+    """Error al pedir el trazado de un tramo."""
+
+
+# --- Polilíneas codificadas (formato de Google, precisión 1e-5) ---
+
+def codificar_polilinea(coordenadas):
+    """Lista de (lat, lng) -> texto de polilínea codificada."""
+    partes = []
+    lat_anterior = lng_anterior = 0
+    for latitud, longitud in coordenadas:
+        lat, lng = round(float(latitud) * 1e5), round(float(longitud) * 1e5)
+        for delta in (lat - lat_anterior, lng - lng_anterior):
+            valor = ~(delta << 1) if delta < 0 else delta << 1
+            while valor >= 0x20:
+                partes.append(chr((0x20 | (valor & 0x1f)) + 63))
+                valor >>= 5
+            partes.append(chr(valor + 63))
+        lat_anterior, lng_anterior = lat, lng
+    return ''.join(partes)
+
+
+def decodificar_polilinea(texto):
+    """Texto de polilínea codificada -> lista de (lat, lng)."""
+    coordenadas = []
+    i = lat = lng = 0
+    while i < len(texto):
+        deltas = []
+        for _ in range(2):
+            resultado = desplazamiento = 0
+            while True:
+                byte = ord(texto[i]) - 63
+                i += 1
+                resultado |= (byte & 0x1f) << desplazamiento
+                desplazamiento += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(resultado >> 1) if resultado & 1 else resultado >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordenadas.append((lat / 1e5, lng / 1e5))
+    return coordenadas
+
+
+# --- Directions API ---
+
+def tramos(num_paradas, max_waypoints=MAX_WAYPOINTS):
+    """
+    Divide las paradas 0..num_paradas-1 en tramos (inicio, fin) inclusivos de a
+    lo más max_waypoints + 2 paradas; cada tramo empieza donde terminó el anterior.
+    """
+    paso = max_waypoints + 1
+    return [(i, min(i + paso, num_paradas - 1)) for i in range(0, num_paradas - 1, paso)]
+
+
+def _texto(coordenada):
+    return f"{float(coordenada[0])},{float(coordenada[1])}"
+
+
+def _pedir_tramo(url, paradas, api_key):
+    """Trazado (lista de (lat, lng)) de un tramo. Lanza DirectionsError si falla."""
+    params = {
+        "origin": _texto(paradas[0]),
+        "destination": _texto(paradas[-1]),
+        "mode": "driving",
+        "key": api_key,
+    }
+    if len(paradas) > 2:
+        params["waypoints"] = "|".join(_texto(p) for p in paradas[1:-1])
+    try:
+        data = google_api.pedir_json(url, params, api='directions')
+    except google_api.ApiError as e:
+        raise DirectionsError(str(e))
+    if data['status'] != 'OK' or not data.get('routes'):
+        raise DirectionsError(
+            f"Error en Directions API: {data['status']} - {data.get('error_message', '')}"
+        )
+    return decodificar_polilinea(data['routes'][0]['overview_polyline']['points'])
+
+
+def _clave_tramo(paradas):
+    """Identifica un tramo por sus paradas en orden (mismas paradas = mismo trazado)."""
+    texto = ";".join(f"{float(lat):.6f},{float(lng):.6f}" for lat, lng in paradas)
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()[:16]
+
+
+def _tramos_anteriores(anterior):
+    """
+    Tramos trazados por las calles de un trazado anterior ({'polilinea',
+    'tramos'}): {(clave, paradas): lista de (lat, lng) del tramo completo}.
+    """
+    if not anterior or not anterior.get('tramos'):
+        return {}
+    puntos = decodificar_polilinea(anterior['polilinea'])
+    tramos_previos = {}
+    inicio = 0
+    for tramo in anterior['tramos']:
+        # cada tramo después del primero empieza en el último punto del anterior
+        desde = inicio - 1 if inicio else 0
+        if tramo['calles']:
+            tramos_previos[(tramo['clave'], tramo['paradas'])] = puntos[desde:inicio + tramo['puntos']]
+        inicio += tramo['puntos']
+    return tramos_previos
+
+
+def _planificar(paradas, previos, max_waypoints=MAX_WAYPOINTS):
+    """
+    Tramos (inicio, fin, puntos reutilizados o None) que cubren las paradas:
+    donde empieza un tramo anterior con las mismas paradas se reutiliza, y lo
+    que queda entre medio se divide con tramos() para pedirlo de nuevo.
+    """
+    largos = sorted({largo for _, largo in previos}, reverse=True)
+    plan = []
+    pendiente = None  # primera parada del trozo que hay que pedir
+
+    def cerrar(hasta):
+        if pendiente is not None:
+            plan.extend(
+                (pendiente + a, pendiente + b, None)
+                for a, b in tramos(hasta - pendiente + 1, max_waypoints)
+            )
+
+    i = 0
+    while i < len(paradas) - 1:
+        reutilizado = None
+        for largo in largos:
+            if i + largo <= len(paradas):
+                reutilizado = previos.get((_clave_tramo(paradas[i:i + largo]), largo))
+                if reutilizado is not None:
+                    break
+        if reutilizado is None:
+            if pendiente is None:
+                pendiente = i
+            i += 1
+            continue
+        cerrar(i)
+        pendiente = None
+        plan.append((i, i + largo - 1, reutilizado))
+        i += largo - 1
+    cerrar(len(paradas) - 1)
+    return plan
+
+
+def trazar_rutas(rutas, api_key=None, url=None, anteriores=None):
+    """
+    Trazado de varias rutas, cada una una lista de (lat, lng) de sus paradas en
+    orden (origen, puntos, destino). Todos los tramos se piden en paralelo.
+
+    'anteriores' (opcional, uno por ruta o None) son trazados ya calculados de
+    esas rutas ({'polilinea', 'tramos'}, como los que se devuelven): los tramos
+    cuyas paradas no cambiaron se reutilizan y solo se piden los que cambiaron
+    (al agregar o quitar un punto, los de alrededor de ese punto).
+
+    Devuelve (trazados en el orden de 'rutas', fuente). Cada trazado es
+    {'polilinea': polilínea codificada, 'tramos': [{'clave', 'paradas', 'puntos',
+    'calles'}, ...]} ('puntos' = puntos que aporta el tramo a la polilínea);
+    fuente es 'google' si todos los tramos vienen de la API, 'linea_recta' si
+    ninguno y 'parcial' si algunos.
+    """
+    api_key = api_key if api_key is not None else settings.GOOGLE_MAPS_API_KEY
+    url = url or getattr(settings, 'DIRECTIONS_URL', DIRECTIONS_URL)
+    anteriores = anteriores or [None] * len(rutas)
+
+    planes = [
+        _planificar(paradas, _tramos_anteriores(anterior))
+        for paradas, anterior in zip(rutas, anteriores)
+    ]
+    pedidos = [
+        (r, inicio, fin)
+        for r, plan in enumerate(planes)
+        for inicio, fin, reutilizado in plan
+        if reutilizado is None
+    ]
+    trazados = {}
+
+    def pedir(pedido):
+        r, inicio, fin = pedido
+        try:
+            trazados[pedido] = _pedir_tramo(url, rutas[r][inicio:fin + 1], api_key)
+        except DirectionsError as e:
+            print(f"No se pudo trazar un tramo de la ruta, queda en línea recta: {e}")
+
+    if api_key and pedidos:
+        with ThreadPoolExecutor(max_workers=min(google_api.MAX_SOLICITUDES_PARALELAS, len(pedidos))) as pool:
+            list(pool.map(pedir, pedidos))
+
+    resultado = []
+    calles_total = tramos_total = 0
+    for r, plan in enumerate(planes):
+        puntos_ruta = []
+        tramos_ruta = []
+        for inicio, fin, reutilizado in plan:
+            paradas = rutas[r][inicio:fin + 1]
+            trazado = reutilizado if reutilizado is not None else trazados.get((r, inicio, fin))
+            calles = trazado is not None
+            if trazado is None:
+                trazado = [tuple(map(float, p)) for p in paradas]
+            # cada tramo empieza donde terminó el anterior: no se repite ese punto
+            aporte = trazado[1:] if puntos_ruta else trazado
+            puntos_ruta.extend(aporte)
+            tramos_ruta.append({
+                'clave': _clave_tramo(paradas),
+                'paradas': len(paradas),
+                'puntos': len(aporte),
+                'calles': calles,
+            })
+            calles_total += calles
+            tramos_total += 1
+        resultado.append({'polilinea': codificar_polilinea(puntos_ruta), 'tramos': tramos_ruta})
+
+    if tramos_total and calles_total == tramos_total:
+        fuente = 'google'
+    elif calles_total:
+        fuente = 'parcial'
+    else:
+        fuente = 'linea_recta'
+    return resultado, fuente
@@ -0,0 +1,91 @@
+# google_api.py
+"""
+Solicitudes HTTP compartidas por los clientes de las APIs web de Google Maps
+(Distance Matrix en optimizer, Directions en geometria): una sesión con pool
+de conexiones para las solicitudes paralelas y los reintentos con espera
+exponencial cuando la API responde que se excedió la cuota o hay un error
+temporal. Las métricas quedan etiquetadas con el nombre de la API pedida.
+"""
+
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metricas
+
+# Concurrencia y reintentos de las solicitudes
+MAX_SOLICITUDES_PARALELAS = 8
+MAX_REINTENTOS = 5
+ESPERA_BASE_REINTENTO = 0.5  # segundos, se duplica en cada intento
+
+# Estados (HTTP y de la API) que indican limitación temporal: se reintentan
+HTTP_REINTENTABLES = {429, 500, 502, 503, 504}
+ESTADOS_REINTENTABLES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+
+
+class ApiError(Exception):
+    """La API no respondió después de los reintentos, o respondió algo que no es JSON."""
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Sesión HTTP compartida, con pool de conexiones para las solicitudes paralelas."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=MAX_SOLICITUDES_PARALELAS,
+                pool_maxsize=MAX_SOLICITUDES_PARALELAS,
+            )
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def esperar_reintento(intento, api):
+    """Espera exponencial con algo de azar para no reintentar todos a la vez."""
+    metricas.incrementar('rutas_api_reintentos_total', api=api)
+    time.sleep(ESPERA_BASE_REINTENTO * (2 ** intento) * (1 + random.random()))
+
+
+def pedir_json(url, params, api, timeout=30):
+    """
+    GET a 'url' con reintentos. 'api' es el nombre para las métricas (p. ej.
+    'distance_matrix', 'directions').
+
+    Devuelve la respuesta JSON (dict); si su 'status' sigue siendo
+    reintentable en el último intento, se devuelve igual y el llamador decide.
+    Lanza ApiError si no hubo respuesta HTTP válida o no es JSON.
+    """
+    session = get_session()
+    for intento in range(MAX_REINTENTOS + 1):
+        ultimo_intento = intento == MAX_REINTENTOS
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+            metricas.incrementar('rutas_api_solicitudes_total', api=api)
+            metricas.incrementar('rutas_api_bytes_total', len(response.content), api=api)
+            if response.status_code in HTTP_REINTENTABLES and not ultimo_intento:
+                esperar_reintento(intento, api)
+                continue
+            response.raise_for_status()
+            data = response.json()
+        except ValueError as e:
+            # (va primero: el JSONDecodeError de requests también es un RequestException)
+            raise ApiError(f"Error al decodificar la respuesta JSON de la API ({api}): {e}")
+        except requests.exceptions.RequestException as e:
+            if ultimo_intento:
+                raise ApiError(f"Error de conexión con la API de Google Maps ({api}): {e}")
+            esperar_reintento(intento, api)
+            continue
+
+        if data.get('status') in ESTADOS_REINTENTABLES and not ultimo_intento:
+            esperar_reintento(intento, api)
+            continue
+        return data
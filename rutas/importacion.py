@@ -0,0 +1,238 @@
+# importacion.py
+"""
+Importación masiva de puntos de entrega desde CSV o Excel (.xlsx).
+
+El archivo se lee fila a fila (sin cargarlo entero en memoria) y se procesa por
+lotes: se descartan direcciones repetidas, se geocodifican en paralelo solo las
+filas sin latitud/longitud y se insertan con bulk_create. Cada fila se valida
+antes (rangos de coordenadas, largo de los textos, valores no negativos) y, si
+aun así el lote no se puede insertar, se inserta fila a fila para informar solo
+las filas que fallan. Los errores de cada fila se informan sin detener la carga.
+"""
+
+import csv
+import io
+import logging
+import math
+from datetime import datetime, time
+from itertools import islice
+
+from django.db import DatabaseError, transaction
+
+from .geocoding import geocodificar_lote, normalizar_direccion
+from .models import PuntoEntrega
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 500
+
+# Nombres de columna aceptados (en minúsculas) para cada campo
+_COLUMNAS = {
+    'nombre': {'nombre', 'name'},
+    'direccion': {'direccion', 'dirección', 'address'},
+    'latitud': {'latitud', 'lat'},
+    'longitud': {'longitud', 'lng', 'lon'},
+    'demanda_kg': {'demanda_kg', 'demanda', 'peso', 'kg'},
+    'ventana_inicio': {'ventana_inicio', 'desde'},
+    'ventana_fin': {'ventana_fin', 'hasta'},
+    'tiempo_servicio_min': {'tiempo_servicio_min', 'servicio_min', 'servicio'},
+}
+
+
+_LARGO_NOMBRE = PuntoEntrega._meta.get_field('nombre').max_length
+_LARGO_DIRECCION = PuntoEntrega._meta.get_field('direccion').max_length
+
+
+class ImportacionError(Exception):
+    """El archivo no se puede leer (formato o columnas)."""
+
+
+def _mapear_encabezados(encabezados):
+    """Devuelve {campo: posición de la columna} a partir de la fila de encabezados."""
+    posiciones = {}
+    for i, encabezado in enumerate(encabezados):
+        nombre = str(encabezado or '').strip().casefold()
+        for campo, alias in _COLUMNAS.items():
+            if nombre in alias and campo not in posiciones:
+                posiciones[campo] = i
+    faltantes = {'nombre', 'direccion'} - set(posiciones)
+    if faltantes:
+        raise ImportacionError(
+            f"Faltan columnas obligatorias: {', '.join(sorted(faltantes))}."
+        )
+    return posiciones
+
+
+def _leer_hora(valor):
+    """Hora de una celda: datetime.time (Excel) o texto "HH:MM". None si está vacía."""
+    if valor in (None, ''):
+        return None
+    if isinstance(valor, time):
+        return valor
+    return datetime.strptime(str(valor).strip()[:5], '%H:%M').time()
+
+
+def _filas_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    primera = texto.readline()
+    # los CSV exportados desde Excel en español suelen venir separados por ';'
+    delimitador = ';' if primera.count(';') > primera.count(',') else ','
+    yield next(csv.reader([primera], delimiter=delimitador), [])
+    yield from csv.reader(texto, delimiter=delimitador)
+
+
+def _filas_excel(archivo):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportacionError("Para importar archivos Excel hay que instalar 'openpyxl'.")
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        yield from libro.active.iter_rows(values_only=True)
+    finally:
+        libro.close()
+
+
+def leer_filas(archivo, nombre_archivo):
+    """
+    Lee el archivo de forma incremental. Genera (número de fila, dict con
+    nombre/direccion/latitud/longitud), contando la fila de encabezados como 1.
+    """
+    if nombre_archivo.lower().endswith(('.xlsx', '.xlsm')):
+        filas = _filas_excel(archivo)
+    else:
+        filas = _filas_csv(archivo)
+
+    encabezados = next(filas, None)
+    if not encabezados:
+        raise ImportacionError("El archivo está vacío.")
+    posiciones = _mapear_encabezados(encabezados)
+
+    for numero, fila in enumerate(filas, start=2):
+        if not any(valor not in (None, '') for valor in fila):
+            continue  # fila vacía
+        yield numero, {
+            campo: (fila[i] if i < len(fila) else None)
+            for campo, i in posiciones.items()
+        }
+
+
+def importar_puntos(archivo, nombre_archivo, tamano_lote=TAMANO_LOTE, api_key=None):
+    """
+    Importa los puntos del archivo. Devuelve un resumen:
+        {'creados': int, 'duplicados': int, 'errores': [(fila, mensaje), ...]}
+    """
+    resumen = {'creados': 0, 'duplicados': 0, 'errores': []}
+
+    # direcciones ya cargadas (para no duplicar puntos existentes)
+    vistas = {
+        normalizar_direccion(d)
+        for d in PuntoEntrega.objects.values_list('direccion', flat=True).iterator()
+    }
+
+    filas = leer_filas(archivo, nombre_archivo)
+    while True:
+        lote = list(islice(filas, tamano_lote))
+        if not lote:
+            break
+        _importar_lote(lote, vistas, resumen, api_key)
+
+    resumen['errores'].sort()
+    return resumen
+
+
+def _importar_lote(lote, vistas, resumen, api_key):
+    validas = []  # (fila, nombre, direccion, latitud, longitud, extras)
+    for numero, datos in lote:
+        nombre = str(datos.get('nombre') or '').strip()
+        direccion = str(datos.get('direccion') or '').strip()
+        if not nombre or not direccion:
+            resumen['errores'].append((numero, 'Nombre y dirección son obligatorios.'))
+            continue
+        if len(nombre) > _LARGO_NOMBRE or len(direccion) > _LARGO_DIRECCION:
+            resumen['errores'].append((
+                numero,
+                f'El nombre admite hasta {_LARGO_NOMBRE} caracteres y la dirección hasta {_LARGO_DIRECCION}.',
+            ))
+            continue
+
+        # las direcciones se marcan como vistas recién al crear el punto: si
+        # esta fila falla, otra fila con la misma dirección todavía puede cargarse
+        if normalizar_direccion(direccion) in vistas:
+            resumen['duplicados'] += 1
+            continue
+
+        latitud, longitud = datos.get('latitud'), datos.get('longitud')
+        if latitud in (None, '') or longitud in (None, ''):
+            latitud = longitud = None
+        else:
+            try:
+                latitud = float(str(latitud).replace(',', '.'))
+                longitud = float(str(longitud).replace(',', '.'))
+            except ValueError:
+                resumen['errores'].append((numero, 'Latitud o Longitud con formato incorrecto.'))
+                continue
+            if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):  # también descarta NaN
+                resumen['errores'].append((numero, 'Latitud debe estar entre -90 y 90 y Longitud entre -180 y 180.'))
+                continue
+
+        extras = {}
+        try:
+            for campo in ('demanda_kg', 'tiempo_servicio_min'):
+                valor = datos.get(campo)
+                extras[campo] = float(str(valor).replace(',', '.')) if valor not in (None, '') else 0.0
+            extras['ventana_inicio'] = _leer_hora(datos.get('ventana_inicio'))
+            extras['ventana_fin'] = _leer_hora(datos.get('ventana_fin'))
+        except ValueError:
+            resumen['errores'].append((numero, 'Demanda, servicio o ventana horaria con formato incorrecto.'))
+            continue
+        if not all(math.isfinite(extras[c]) and extras[c] >= 0 for c in ('demanda_kg', 'tiempo_servicio_min')):
+            resumen['errores'].append((numero, 'Demanda y tiempo de servicio deben ser números no negativos.'))
+            continue
+        validas.append((numero, nombre, direccion, latitud, longitud, extras))
+
+    # geocodificar en paralelo solo las filas sin coordenadas
+    sin_coordenadas = [fila[2] for fila in validas if fila[3] is None]
+    coordenadas, errores = geocodificar_lote(sin_coordenadas, api_key=api_key) if sin_coordenadas else ({}, {})
+
+    puntos, filas, en_lote = [], [], set()
+    for numero, nombre, direccion, latitud, longitud, extras in validas:
+        if latitud is None:
+            if direccion in errores:
+                resumen['errores'].append((numero, errores[direccion]))
+                continue
+            latitud, longitud = coordenadas[direccion]
+        clave = normalizar_direccion(direccion)
+        if clave in en_lote:
+            resumen['duplicados'] += 1
+            continue
+        en_lote.add(clave)
+        puntos.append(PuntoEntrega(
+            nombre=nombre,
+            direccion=direccion,
+            latitud=round(latitud, 6),
+            longitud=round(longitud, 6),
+            **extras,
+        ))
+        filas.append(numero)
+
+    try:
+        with transaction.atomic():
+            PuntoEntrega.objects.bulk_create(puntos)
+    except DatabaseError:
+        logger.exception("Falló la inserción de un lote de %s puntos; se insertan fila a fila", len(puntos))
+    else:
+        resumen['creados'] += len(puntos)
+        vistas.update(normalizar_direccion(p.direccion) for p in puntos)
+        return
+
+    # el lote falló entero: se inserta fila a fila para informar solo las filas con problemas
+    for numero, punto in zip(filas, puntos):
+        try:
+            with transaction.atomic():
+                punto.save()
+        except DatabaseError as e:
+            resumen['errores'].append((numero, f"Error al guardar: {e}"))
+        else:
+            resumen['creados'] += 1
+            vistas.add(normalizar_direccion(punto.direccion))
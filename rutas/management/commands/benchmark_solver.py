@@ -0,0 +1,92 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rutas import benchmark
+
+
+def _lista(texto, tipo=str):
+    return tuple(tipo(valor.strip()) for valor in texto.split(',') if valor.strip())
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark reproducible de los optimizadores sobre instancias sintéticas "
+        "(sin red). Escribe los resultados en JSON y CSV."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', default=','.join(map(str, benchmark.TAMANOS)),
+                            help="Cantidades de puntos, separadas por coma")
+        parser.add_argument('--modos', default=','.join(benchmark.MODOS),
+                            help="Modos del optimizador, separados por coma")
+        parser.add_argument('--ciudades', default=','.join(benchmark.CIUDADES),
+                            help="Ciudades, separadas por coma")
+        parser.add_argument('--distribuciones', default=','.join(benchmark.DISTRIBUCIONES),
+                            help="uniforme y/o agrupada")
+        parser.add_argument('--destinos', default=','.join(benchmark.DESTINOS),
+                            help="mismo_origen y/o otra_bodega")
+        parser.add_argument('--semillas', default='0', help="Semillas, separadas por coma")
+        parser.add_argument('--segundos', type=float, default=1.0,
+                            help="Tiempo máximo de los modos con límite (anytime, cvrp, ventanas)")
+        parser.add_argument('--json', default='benchmark_solver.json', help="Archivo de salida JSON")
+        parser.add_argument('--csv', default='benchmark_solver.csv', help="Archivo de salida CSV")
+        parser.add_argument('--mejores', default='',
+                            help="JSON con las mejores distancias conocidas (se actualiza)")
+
+    def handle(self, *args, **options):
+        try:
+            tamanos = _lista(options['tamanos'], int)
+            semillas = _lista(options['semillas'], int)
+        except ValueError:
+            raise CommandError("--tamanos y --semillas deben ser enteros separados por coma")
+        modos = _lista(options['modos'])
+        ciudades = _lista(options['ciudades'])
+        for modo in modos:
+            if modo not in benchmark.MODOS:
+                raise CommandError(f"Modo desconocido: {modo}")
+        for ciudad in ciudades:
+            if ciudad not in benchmark.CIUDADES:
+                raise CommandError(f"Ciudad desconocida: {ciudad}")
+
+        mejores = {}
+        if options['mejores'] and os.path.exists(options['mejores']):
+            with open(options['mejores'], encoding='utf-8') as archivo:
+                mejores = json.load(archivo)
+
+        def progreso(fila):
+            self.stdout.write(
+                f"{fila['instancia']:<45} {fila['modo']:<12} "
+                f"{fila['distancia_km']:>10.2f} km {fila['tiempo_s']:>8.3f} s "
+                f"{fila['memoria_pico_kb']:>10.1f} KB"
+            )
+
+        filas, mejores = benchmark.correr_benchmark(
+            tamanos=tamanos,
+            modos=modos,
+            ciudades=ciudades,
+            distribuciones=_lista(options['distribuciones']),
+            destinos=_lista(options['destinos']),
+            semillas=semillas,
+            max_seconds=options['segundos'],
+            mejores=mejores,
+            progreso=progreso,
+        )
+
+        with open(options['json'], 'w', encoding='utf-8') as archivo:
+            benchmark.escribir_json(filas, archivo)
+        with open(options['csv'], 'w', encoding='utf-8', newline='') as archivo:
+            benchmark.escribir_csv(filas, archivo)
+        if options['mejores']:
+            with open(options['mejores'], 'w', encoding='utf-8') as archivo:
+                json.dump(mejores, archivo, indent=2, sort_keys=True)
+
+        for modo, datos in benchmark.resumen(filas).items():
+            self.stdout.write(
+                f"{modo:<12} {datos['instancias']:>4} instancias, {datos['tiempo_total_s']:>9.3f} s, "
+                f"brecha promedio {datos['brecha_promedio_pct']:.2f}% (máx. {datos['brecha_maxima_pct']:.2f}%)"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Resultados en {options['json']} y {options['csv']}"
+        ))
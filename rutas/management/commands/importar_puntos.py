@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rutas.importacion import TAMANO_LOTE, ImportacionError, importar_puntos
+
+
+class Command(BaseCommand):
+    help = "Importa puntos de entrega desde un archivo CSV o Excel (.xlsx)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Ruta del archivo CSV o .xlsx")
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE,
+                            help="Filas por lote de geocodificación/inserción")
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        try:
+            with open(ruta, 'rb') as archivo:
+                resumen = importar_puntos(archivo, ruta, tamano_lote=options['lote'])
+        except OSError as e:
+            raise CommandError(f"No se pudo abrir el archivo: {e}")
+        except ImportacionError as e:
+            raise CommandError(str(e))
+
+        for fila, mensaje in resumen['errores']:
+            self.stderr.write(f"Fila {fila}: {mensaje}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Puntos creados: {resumen['creados']}, "
+            f"duplicados omitidos: {resumen['duplicados']}, "
+            f"filas con error: {len(resumen['errores'])}"
+        ))
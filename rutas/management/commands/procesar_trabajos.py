@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from rutas.trabajos import procesar_cola
+
+
+class Command(BaseCommand):
+    help = "Ejecuta los trabajos de optimización encolados, en un pool de procesos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=2,
+                            help="Trabajos que se ejecutan en paralelo")
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help="Segundos entre revisiones de la cola")
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Terminar cuando no queden trabajos pendientes")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Procesando trabajos con {options['procesos']} procesos...")
+        procesar_cola(
+            procesos=options['procesos'],
+            intervalo=options['intervalo'],
+            una_vez=options['una_vez'],
+        )
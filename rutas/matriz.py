@@ -0,0 +1,143 @@
+# matriz.py
+"""
+Matriz de distancias (o duraciones) compacta: un array NumPy contiguo en vez
+de una lista de listas de floats de Python.
+
+Por defecto guarda float32 (4 bytes por elemento, con np.inf donde no hay
+ruta). Opcionalmente guarda enteros int32 en una unidad más chica (metros en
+vez de km, segundos), con SIN_RUTA como marca de "sin ruta".
+
+Los optimizadores la reciben igual que una lista de listas o un array:
+np.asarray(matriz) funciona sin copiar, len(matriz) es la cantidad de nodos
+y matriz[a][b] sigue funcionando.
+"""
+
+import io
+
+import numpy as np
+
+# Marca de "sin ruta" en la codificación entera
+SIN_RUTA = np.iinfo(np.int32).max
+
+# Unidades enteras por unidad real: metros por km (distancias)
+ESCALA_METROS = 1000
+# segundos por segundo (duraciones)
+ESCALA_SEGUNDOS = 1
+
+
+class MatrizDistancias:
+    """
+    Matriz cuadrada n x n respaldada por un array contiguo.
+
+    'escala' None = valores float32 tal cual. Con escala (p. ej. ESCALA_METROS)
+    los valores se guardan como int32 redondeados a 1/escala y se decodifican
+    al leerlos.
+    """
+
+    def __init__(self, valores, escala=None):
+        if isinstance(valores, MatrizDistancias):
+            valores = valores.valores()
+        datos = np.asarray(valores)
+        if escala is None:
+            datos = np.ascontiguousarray(datos, dtype=np.float32)
+        elif datos.dtype != np.int32:
+            reales = np.asarray(datos, dtype=np.float64) * escala
+            datos = np.where(np.isfinite(reales), np.rint(reales), SIN_RUTA).astype(np.int32)
+        if datos.ndim != 2 or datos.shape[0] != datos.shape[1]:
+            raise ValueError(f"La matriz debe ser cuadrada, no {datos.shape}")
+        self.datos = datos
+        self.escala = escala
+
+    # --- Acceso ---
+
+    def valores(self):
+        """Valores reales (float32). Sin copia si la matriz no está codificada en enteros."""
+        if self.escala is None:
+            return self.datos
+        valores = self.datos.astype(np.float32) / np.float32(self.escala)
+        valores[self.datos == SIN_RUTA] = np.inf
+        return valores
+
+    def __array__(self, dtype=None, copy=None):
+        valores = self.valores()
+        if dtype is not None and valores.dtype != dtype:
+            return valores.astype(dtype)
+        return valores.copy() if copy else valores
+
+    def __len__(self):
+        return self.datos.shape[0]
+
+    @property
+    def shape(self):
+        return self.datos.shape
+
+    @property
+    def nbytes(self):
+        return self.datos.nbytes
+
+    def __getitem__(self, clave):
+        """
+        matriz[a] es la fila a y matriz[a, b] un valor. Un par de rangos
+        (matriz[i:j, i:j]) devuelve otra MatrizDistancias que comparte memoria.
+        """
+        if (
+            isinstance(clave, tuple) and len(clave) == 2
+            and all(isinstance(c, slice) for c in clave)
+        ):
+            return MatrizDistancias._vista(self.datos[clave], self.escala)
+        if self.escala is None:
+            return self.datos[clave]
+        parte = self.datos[clave]
+        if np.ndim(parte) == 0:
+            return float('inf') if parte == SIN_RUTA else float(parte) / self.escala
+        valores = parte.astype(np.float32) / np.float32(self.escala)
+        valores[parte == SIN_RUTA] = np.inf
+        return valores
+
+    @classmethod
+    def _vista(cls, datos, escala):
+        matriz = cls.__new__(cls)
+        matriz.datos = datos
+        matriz.escala = escala
+        return matriz
+
+    def vista(self, inicio, fin):
+        """Bloque [inicio:fin, inicio:fin] sin copiar (para subproblemas contiguos)."""
+        return self[inicio:fin, inicio:fin]
+
+    def submatriz(self, indices):
+        """Matriz entre los nodos 'indices' (en ese orden). Copia solo ese bloque."""
+        return MatrizDistancias._vista(self.datos[np.ix_(indices, indices)], self.escala)
+
+    def tolist(self):
+        return self.valores().tolist()
+
+    def __repr__(self):
+        codificacion = 'float32' if self.escala is None else f'int32/{self.escala}'
+        return f"<MatrizDistancias {len(self)}x{len(self)} {codificacion}>"
+
+    # --- Serialización (.npy) ---
+
+    def guardar(self, archivo):
+        """Guarda los datos tal cual (float32 o int32) en formato .npy."""
+        np.save(archivo, self.datos)
+
+    @classmethod
+    def cargar(cls, archivo, escala=None, mmap=False):
+        """
+        Lee una matriz guardada con guardar(). Si está en int32 hay que indicar
+        su escala. Con mmap=True se abre con memory-map (solo lectura).
+        """
+        datos = np.load(archivo, mmap_mode='r' if mmap else None)
+        if datos.dtype == np.int32 and escala is None:
+            raise ValueError("Una matriz entera necesita su escala (p. ej. ESCALA_METROS)")
+        return cls._vista(datos, escala if datos.dtype == np.int32 else None)
+
+    def a_bytes(self):
+        buffer = io.BytesIO()
+        self.guardar(buffer)
+        return buffer.getvalue()
+
+    @classmethod
+    def desde_bytes(cls, datos, escala=None):
+        return cls.cargar(io.BytesIO(bytes(datos)), escala=escala)
@@ -0,0 +1,160 @@
+# metricas.py
+"""
+Métricas del proceso de optimización: contadores (llamadas a las APIs, bytes,
+aciertos de cache, iteraciones del solver) e histogramas de latencia por etapa.
+
+- span('etapa') mide una etapa, la registra en el log (logger 'rutas.metricas')
+  y la agrega al histograma rutas_etapa_segundos.
+- incrementar / observar actualizan contadores e histogramas.
+- exportar_prometheus() arma el texto que sirve la vista /metrics.
+
+Los valores viven en memoria del proceso (cada worker de procesar_trabajos
+tiene los suyos). Con settings.METRICAS_HABILITADAS = False todas las
+funciones vuelven de inmediato.
+"""
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets de los histogramas de latencia
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+_lock = threading.Lock()
+_contadores = {}  # (nombre, etiquetas) -> valor
+_histogramas = {}  # (nombre, etiquetas) -> [cuentas por bucket, suma, cantidad]
+
+
+def habilitadas():
+    return getattr(settings, 'METRICAS_HABILITADAS', True)
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    """Suma 'valor' al contador 'nombre' (con esas etiquetas)."""
+    if not habilitadas():
+        return
+    clave = (nombre, _etiquetas(etiquetas))
+    with _lock:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def observar(nombre, valor, **etiquetas):
+    """Agrega una observación (en segundos) al histograma 'nombre'."""
+    if not habilitadas():
+        return
+    clave = (nombre, _etiquetas(etiquetas))
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = [[0] * len(BUCKETS_SEGUNDOS), 0.0, 0]
+        for i, limite in enumerate(BUCKETS_SEGUNDOS):
+            if valor <= limite:
+                histograma[0][i] += 1
+                break
+        histograma[1] += valor
+        histograma[2] += 1
+
+
+@contextmanager
+def span(etapa, duraciones=None, **etiquetas):
+    """
+    Mide la etapa del bloque. Lo que se agregue al dict que entrega (p. ej.
+    datos['iteraciones'] = 120) sale en la línea de log de la etapa.
+    Si se pasa 'duraciones' (dict), también suma ahí los segundos de la etapa,
+    aunque las métricas estén deshabilitadas (así los guarda el plan de ruta).
+
+        with metricas.span('matriz') as datos:
+            ...
+            datos['proveedor'] = 'google'
+    """
+    datos = {}
+    if not habilitadas() and duraciones is None:
+        yield datos
+        return
+
+    inicio = time.perf_counter()
+    resultado = 'ok'
+    try:
+        yield datos
+    except BaseException:
+        resultado = 'error'
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        if duraciones is not None:
+            duraciones[etapa] = duraciones.get(etapa, 0.0) + duracion
+        if habilitadas():
+            observar('rutas_etapa_segundos', duracion, etapa=etapa, **etiquetas)
+            if resultado == 'error':
+                incrementar('rutas_etapa_errores_total', etapa=etapa, **etiquetas)
+            logger.info(
+                "etapa=%s resultado=%s duracion_ms=%.1f%s",
+                etapa, resultado, duracion * 1000,
+                ''.join(f" {k}={v}" for k, v in {**etiquetas, **datos}.items()),
+                extra={'metricas': {'etapa': etapa, 'resultado': resultado, 'duracion_s': duracion,
+                                    **etiquetas, **datos}},
+            )
+
+
+def _formato_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ''
+    texto = ','.join(
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pares
+    )
+    return '{' + texto + '}'
+
+
+def _numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exportar_prometheus():
+    """Contadores e histogramas en el formato de texto de Prometheus."""
+    with _lock:
+        contadores = sorted(_contadores.items())
+        histogramas = sorted(
+            (clave, ([*cuentas], suma, cantidad)) for clave, (cuentas, suma, cantidad) in _histogramas.items()
+        )
+
+    lineas = []
+    tipo_declarado = set()
+    for (nombre, etiquetas), valor in contadores:
+        if nombre not in tipo_declarado:
+            lineas.append(f"# TYPE {nombre} counter")
+            tipo_declarado.add(nombre)
+        lineas.append(f"{nombre}{_formato_etiquetas(etiquetas)} {_numero(valor)}")
+
+    for (nombre, etiquetas), (cuentas, suma, cantidad) in histogramas:
+        if nombre not in tipo_declarado:
+            lineas.append(f"# TYPE {nombre} histogram")
+            tipo_declarado.add(nombre)
+        acumulado = 0
+        for limite, cuenta in zip(BUCKETS_SEGUNDOS, cuentas):
+            acumulado += cuenta
+            le = (('le', _numero(limite)),)
+            lineas.append(f"{nombre}_bucket{_formato_etiquetas(etiquetas, le)} {acumulado}")
+        lineas.append(f"{nombre}_sum{_formato_etiquetas(etiquetas)} {_numero(suma)}")
+        lineas.append(f"{nombre}_count{_formato_etiquetas(etiquetas)} {cantidad}")
+    return '\n'.join(lineas) + '\n'
+
+
+def reiniciar():
+    """Borra todos los valores (para pruebas)."""
+    with _lock:
+        _contadores.clear()
+        _histogramas.clear()
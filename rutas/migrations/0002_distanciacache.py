@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistanciaCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origen', models.CharField(max_length=32)),
+                ('destino', models.CharField(max_length=32)),
+                ('modo', models.CharField(default='driving', max_length=16)),
+                ('distancia_km', models.FloatField()),
+                ('duracion_s', models.FloatField(blank=True, null=True)),
+                ('creado', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('origen', 'destino', 'modo'), name='distancia_cache_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0003_geocodificacioncache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoOptimizacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('terminado', 'Terminado'), ('error', 'Error')], default='pendiente', max_length=16)),
+                ('progreso', models.FloatField(default=0.0)),
+                ('etapa', models.CharField(blank=True, max_length=100)),
+                ('parametros', models.JSONField()),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'creado'], name='rutas_traba_estado_f50040_idx')],
+            },
+        ),
+    ]
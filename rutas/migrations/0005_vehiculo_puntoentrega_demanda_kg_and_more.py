@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0004_trabajooptimizacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vehiculo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('capacidad_kg', models.FloatField()),
+                ('rendimiento_km_por_litro', models.FloatField(default=12)),
+                ('activo', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='puntoentrega',
+            name='demanda_kg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='puntoentrega',
+            name='vehiculo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='puntos', to='rutas.vehiculo'),
+        ),
+    ]
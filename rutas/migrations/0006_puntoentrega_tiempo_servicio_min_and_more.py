@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0005_vehiculo_puntoentrega_demanda_kg_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puntoentrega',
+            name='tiempo_servicio_min',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='puntoentrega',
+            name='ventana_fin',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='puntoentrega',
+            name='ventana_inicio',
+            field=models.TimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0006_puntoentrega_tiempo_servicio_min_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoRuta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puntos', models.JSONField()),
+                ('ruta', models.JSONField()),
+                ('matriz', models.BinaryField()),
+                ('resultado', models.JSONField()),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
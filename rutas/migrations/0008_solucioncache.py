@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0007_estadoruta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SolucionCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('rutas', models.JSONField()),
+                ('matriz', models.BinaryField(blank=True, null=True)),
+                ('resultado', models.JSONField()),
+                ('creado', models.DateTimeField(db_index=True)),
+                ('usado', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0008_solucioncache'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='puntoentrega',
+            index=models.Index(fields=['latitud', 'longitud'], name='punto_latitud_longitud'),
+        ),
+    ]
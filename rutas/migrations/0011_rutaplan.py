@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rutas', '0010_puntoentrega_actualizado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RutaPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bodega', models.CharField(max_length=255)),
+                ('destino', models.CharField(max_length=255)),
+                ('paradas', models.JSONField()),
+                ('rutas', models.JSONField()),
+                ('matriz', models.BinaryField(blank=True, null=True)),
+                ('clave_solucion', models.CharField(blank=True, max_length=64)),
+                ('distancia_km', models.FloatField()),
+                ('litros', models.FloatField()),
+                ('costo_clp', models.FloatField()),
+                ('metodo', models.CharField(max_length=32)),
+                ('resultado', models.JSONField()),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bodega', '-creado'], name='plan_bodega_creado'), models.Index(fields=['-creado'], name='plan_creado')],
+            },
+        ),
+    ]
@@ -1,11 +1,172 @@
 from django.db import models
 
+
+class Vehiculo(models.Model):
+    """Vehículo de la flota, con su capacidad de carga y su rendimiento."""
+    nombre = models.CharField(max_length=100)
+    capacidad_kg = models.FloatField()
+    rendimiento_km_por_litro = models.FloatField(default=12)
+    activo = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.nombre
+
+
 class PuntoEntrega(models.Model):
     nombre = models.CharField(max_length=255)
     direccion = models.CharField(max_length=255)
     latitud = models.DecimalField(max_digits=9, decimal_places=6)
     longitud = models.DecimalField(max_digits=9, decimal_places=6)
     orden_optimo = models.IntegerField(null=True, blank=True)  # Orden después de optimización
+    demanda_kg = models.FloatField(default=0)  # Carga a entregar en el punto
+    vehiculo = models.ForeignKey(  # Vehículo asignado al optimizar con varios vehículos
+        Vehiculo, null=True, blank=True, on_delete=models.SET_NULL, related_name='puntos'
+    )
+    ventana_inicio = models.TimeField(null=True, blank=True)  # No entregar antes de esta hora
+    ventana_fin = models.TimeField(null=True, blank=True)  # Entregar a más tardar a esta hora
+    tiempo_servicio_min = models.FloatField(default=0)  # Minutos de detención en el punto
+    actualizado = models.DateTimeField(auto_now=True, db_index=True)  # para ETag/Last-Modified de la API
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitud', 'longitud'], name='punto_latitud_longitud'),
+        ]
 
     def __str__(self):
         return self.nombre
+
+
+class DistanciaCache(models.Model):
+    """
+    Distancia y duración de un tramo dirigido (origen -> destino) ya consultado
+    a la API. Las coordenadas se guardan redondeadas como texto "lat,lng".
+    """
+    origen = models.CharField(max_length=32)
+    destino = models.CharField(max_length=32)
+    modo = models.CharField(max_length=16, default='driving')
+    distancia_km = models.FloatField()
+    duracion_s = models.FloatField(null=True, blank=True)
+    creado = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['origen', 'destino', 'modo'], name='distancia_cache_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.origen} -> {self.destino} ({self.modo}): {self.distancia_km} km"
+
+
+class GeocodificacionCache(models.Model):
+    """
+    Coordenadas ya obtenidas para una dirección (normalizada), para no volver
+    a llamar a la API de geocodificación con la misma dirección.
+    """
+    direccion_normalizada = models.CharField(max_length=255, unique=True)
+    latitud = models.DecimalField(max_digits=9, decimal_places=6)
+    longitud = models.DecimalField(max_digits=9, decimal_places=6)
+    creado = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.direccion_normalizada
+
+
+class TrabajoOptimizacion(models.Model):
+    """
+    Optimización encolada para ejecutarse en segundo plano (ver rutas/trabajos.py).
+    El resultado queda guardado aquí en vez de pasar por la sesión.
+    """
+    PENDIENTE = 'pendiente'
+    EN_PROCESO = 'en_proceso'
+    TERMINADO = 'terminado'
+    ERROR = 'error'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_PROCESO, 'En proceso'),
+        (TERMINADO, 'Terminado'),
+        (ERROR, 'Error'),
+    ]
+
+    estado = models.CharField(max_length=16, choices=ESTADOS, default=PENDIENTE)
+    progreso = models.FloatField(default=0.0)  # 0 a 1
+    etapa = models.CharField(max_length=100, blank=True)
+    parametros = models.JSONField()
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'creado']),
+        ]
+
+    def __str__(self):
+        return f"Trabajo {self.id} ({self.estado})"
+
+
+class EstadoRuta(models.Model):
+    """
+    Última ruta optimizada (de un solo vehículo y sin ventanas horarias), con su
+    matriz de distancias, para reoptimizarla de forma incremental al agregar o
+    borrar un punto (ver pipeline.reoptimizar_agregado / reoptimizar_quitado).
+    Hay a lo más una fila.
+    """
+    puntos = models.JSONField()  # ids de PuntoEntrega en el orden de la matriz (índices 1..n)
+    ruta = models.JSONField()  # índices de la matriz: 0 = origen, n + 1 = destino
+    matriz = models.BinaryField()  # distancias en km, formato .npy (n + 2) x (n + 2)
+    resultado = models.JSONField()  # lo que se mostró en el mapa (parámetros, origen, destino, ...)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ruta de {len(self.puntos)} puntos ({self.actualizado:%Y-%m-%d %H:%M})"
+
+
+class SolucionCache(models.Model):
+    """
+    Resultado de una optimización, por hash del contenido de la solicitud
+    (puntos, origen/destino, vehículos y parámetros del solver). Repetir la
+    misma solicitud lo reutiliza sin geocodificar, pedir la matriz ni resolver
+    (ver rutas/cache_soluciones.py). Las rutas y la matriz están en el orden
+    canónico de los puntos, no en el de sus ids.
+    """
+    clave = models.CharField(max_length=64, unique=True)  # sha256 en hexadecimal
+    rutas = models.JSONField()  # [[vehiculo_id o null, [índices de la matriz]], ...]
+    matriz = models.BinaryField(null=True, blank=True)  # solo un vehículo sin ventanas (.npy float32)
+    resultado = models.JSONField()  # lo que se mostró en el mapa
+    creado = models.DateTimeField(db_index=True)
+    usado = models.DateTimeField(db_index=True)  # último acierto (para descartar las menos usadas)
+
+    def __str__(self):
+        return f"{self.clave[:12]}… ({self.resultado.get('total_distance_km')} km)"
+
+
+class RutaPlan(models.Model):
+    """
+    Resultado guardado de una optimización (o de una actualización incremental
+    de la ruta): se puede volver a abrir, compartir (mapa/?plan=<id>) y comparar
+    con otros sin resolver de nuevo. Las paradas son una copia de los puntos al
+    momento de optimizar, así el plan no cambia si después se borran puntos.
+    """
+    bodega = models.CharField(max_length=255)  # dirección de origen
+    destino = models.CharField(max_length=255)
+    paradas = models.JSONField()  # [{id, nombre, direccion, latitud, longitud, orden_optimo, vehiculo_id}, ...]
+    rutas = models.JSONField()  # [[vehiculo_id o null, [índices de la matriz]], ...]
+    matriz = models.BinaryField(null=True, blank=True)  # solo un vehículo sin ventanas (.npy float32)
+    clave_solucion = models.CharField(max_length=64, blank=True)  # SolucionCache de la misma solicitud
+    distancia_km = models.FloatField()
+    litros = models.FloatField()
+    costo_clp = models.FloatField()
+    metodo = models.CharField(max_length=32)  # método del optimizador
+    resultado = models.JSONField()  # lo que muestra el mapa (solver_info, duraciones, geometría, ...)
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bodega', '-creado'], name='plan_bodega_creado'),
+            models.Index(fields=['-creado'], name='plan_creado'),
+        ]
+
+    def __str__(self):
+        return f"Plan {self.id}: {self.bodega} ({self.distancia_km} km, {self.creado:%Y-%m-%d %H:%M})"
@@ -1,10 +1,84 @@
-import requests
-import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 from django.conf import settings
-import itertools
+import numpy as np
+
+from . import cache_distancias
+from . import google_api
+from . import metricas
+from .matriz import MatrizDistancias
 
 # --- PARTE 1: Obtener Distancias/Tiempos de Google Maps ---
-def get_distance_matrix(points, origin_coords, api_key, dest_coords=None):
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+# Límites por solicitud de la Distance Matrix API
+MAX_ORIGENES_POR_SOLICITUD = 25
+MAX_DESTINOS_POR_SOLICITUD = 25
+MAX_ELEMENTOS_POR_SOLICITUD = 100
+
+# Bloques de la matriz que se piden en paralelo (los reintentos están en google_api)
+MAX_SOLICITUDES_PARALELAS = google_api.MAX_SOLICITUDES_PARALELAS
+
+
+class DistanceMatrixError(Exception):
+    """Error al obtener un bloque de la matriz de distancias."""
+
+
+def _bloques(num_origenes, num_destinos):
+    """
+    Divide la matriz num_origenes x num_destinos en bloques que respetan los
+    límites por solicitud. Devuelve tuplas (o_ini, o_fin, d_ini, d_fin).
+    """
+    columnas = min(num_destinos, MAX_DESTINOS_POR_SOLICITUD, MAX_ELEMENTOS_POR_SOLICITUD)
+    filas = min(MAX_ORIGENES_POR_SOLICITUD, max(1, MAX_ELEMENTOS_POR_SOLICITUD // columnas))
+    return [
+        (o, min(o + filas, num_origenes), c, min(c + columnas, num_destinos))
+        for o in range(0, num_origenes, filas)
+        for c in range(0, num_destinos, columnas)
+    ]
+
+
+def _pedir_bloque(url, origenes, destinos, api_key):
+    """
+    Pide un bloque de la matriz. Reintenta con espera exponencial cuando la API
+    responde que se excedió la cuota o hay un error temporal.
+    Devuelve (distancias en km, duraciones en segundos) del bloque,
+    con float('inf') donde no hay ruta.
+    """
+    params = {
+        "origins": "|".join(origenes),
+        "destinations": "|".join(destinos),
+        "mode": "driving",
+        "key": api_key
+    }
+    try:
+        data = google_api.pedir_json(url, params, api='distance_matrix')
+    except google_api.ApiError as e:
+        raise DistanceMatrixError(str(e))
+    if data['status'] != 'OK':
+        raise DistanceMatrixError(
+            f"Error en Distance Matrix API: {data['status']} - {data.get('error_message', '')}"
+        )
+
+    distancias, duraciones = [], []
+    for row_data in data['rows']:
+        row_distances, row_durations = [], []
+        for element in row_data['elements']:
+            if element['status'] == 'OK':
+                row_distances.append(element['distance']['value'] / 1000)  # a km
+                row_durations.append(float(element['duration']['value']))  # segundos
+            else:
+                row_distances.append(float('inf'))
+                row_durations.append(float('inf'))
+        distancias.append(row_distances)
+        duraciones.append(row_durations)
+    return distancias, duraciones
+
+
+def get_distance_matrix(points, origin_coords, api_key, dest_coords=None, url=None,
+                        return_durations=False):
     """
     Obtiene la matriz de distancias entre:
     - origen
@@ -15,96 +89,623 @@ def get_distance_matrix(points, origin_coords, api_key, dest_coords=None):
       0                 : origen
       1 .. num_points   : puntos de entrega
       num_points + 1    : destino (si dest_coords no es None)
+
+    Los tramos ya consultados se leen de la cache (cache_distancias) y a la API
+    solo se piden los que faltan: si la ruta creció en un punto, son O(n)
+    elementos en vez de O(n²). Lo que falta se pide en bloques (límite de
+    orígenes/destinos/elementos por solicitud) que se descargan en paralelo.
+    'url' permite apuntar a otro servidor (por ejemplo uno local de pruebas);
+    por defecto se usa settings.DISTANCE_MATRIX_URL o la API de Google.
+
+    Devuelve una MatrizDistancias (float32, inf donde no hay ruta). Con
+    return_durations=True devuelve (distancias_km, duraciones_s), dos matrices
+    con los mismos índices.
     """
     all_points_coords = [f"{origin_coords['latitud']},{origin_coords['longitud']}"]
+    claves = [cache_distancias.clave_coordenadas(origin_coords['latitud'], origin_coords['longitud'])]
 
     # puntos de entrega
     for p in points:
         all_points_coords.append(f"{p.latitud},{p.longitud}")
+        claves.append(cache_distancias.clave_coordenadas(p.latitud, p.longitud))
 
     # punto destino opcional
     if dest_coords is not None:
         all_points_coords.append(f"{dest_coords['latitud']},{dest_coords['longitud']}")
+        claves.append(cache_distancias.clave_coordenadas(dest_coords['latitud'], dest_coords['longitud']))
 
-    origins_str = "|".join(all_points_coords)
-    destinations_str = origins_str
+    if url is None:
+        url = getattr(settings, 'DISTANCE_MATRIX_URL', None) or DISTANCE_MATRIX_URL
 
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-    params = {
-        "origins": origins_str,
-        "destinations": destinations_str,
-        "mode": "driving",
-        "key": api_key
-    }
+    # coordenadas únicas (ej. origen = destino): cada tramo se pide una sola vez
+    coords_por_clave = {}
+    for clave, coords in zip(claves, all_points_coords):
+        coords_por_clave.setdefault(clave, coords)
+    unicas = list(coords_por_clave)
+    posicion = {clave: i for i, clave in enumerate(unicas)}
+    coords_unicas = list(coords_por_clave.values())
+    u = len(unicas)
 
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-
-        if data['status'] == 'OK':
-            distance_matrix = []
-            for row_data in data['rows']:
-                row_distances = []
-                for element in row_data['elements']:
-                    if element['status'] == 'OK':
-                        row_distances.append(element['distance']['value'] / 1000)  # a km
+    distancias = np.full((u, u), np.inf, dtype=np.float32)
+    duraciones = np.full((u, u), np.inf, dtype=np.float32)
+    en_cache = cache_distancias.buscar(unicas, unicas)
+    metricas.incrementar('rutas_cache_aciertos_total', len(en_cache), cache='distancias')
+    metricas.incrementar('rutas_cache_fallos_total', u * u - len(en_cache), cache='distancias')
+    for (origen, destino), (distancia_km, duracion_s) in en_cache.items():
+        distancias[posicion[origen], posicion[destino]] = distancia_km
+        if duracion_s is not None:
+            duraciones[posicion[origen], posicion[destino]] = duracion_s
+
+    # agrupar orígenes con los mismos destinos faltantes: cada grupo es un
+    # rectángulo de la matriz que luego se divide en bloques
+    # (la diagonal también se pide: así una matriz sin cache es un solo grupo)
+    grupos = {}
+    for i, origen in enumerate(unicas):
+        faltantes = tuple(
+            j for j, destino in enumerate(unicas)
+            if (origen, destino) not in en_cache
+        )
+        if faltantes:
+            grupos.setdefault(faltantes, []).append(i)
+
+    tareas = []
+    for destinos, origenes in grupos.items():
+        for o_ini, o_fin, d_ini, d_fin in _bloques(len(origenes), len(destinos)):
+            tareas.append((origenes[o_ini:o_fin], destinos[d_ini:d_fin]))
+
+    def pedir(tarea):
+        origenes, destinos = tarea
+        return _pedir_bloque(
+            url,
+            [coords_unicas[i] for i in origenes],
+            [coords_unicas[j] for j in destinos],
+            api_key,
+        )
+
+    nuevos = {}
+    if tareas:
+        error = None
+        with ThreadPoolExecutor(max_workers=min(MAX_SOLICITUDES_PARALELAS, len(tareas))) as pool:
+            futuros = {pool.submit(pedir, tarea): tarea for tarea in tareas}
+            for futuro in as_completed(futuros):
+                origenes, destinos = futuros[futuro]
+                try:
+                    bloque_km, bloque_s = futuro.result()
+                except DistanceMatrixError as e:
+                    error = e
+                    continue
+                distancias[np.ix_(origenes, destinos)] = bloque_km
+                duraciones[np.ix_(origenes, destinos)] = bloque_s
+                for fila_km, fila_s, i in zip(bloque_km, bloque_s, origenes):
+                    for km, seg, j in zip(fila_km, fila_s, destinos):
+                        if km != float('inf'):
+                            nuevos[(unicas[i], unicas[j])] = (km, seg)
+        # los bloques que sí llegaron quedan en cache aunque otro haya fallado:
+        # el próximo intento solo pide lo que faltó
+        cache_distancias.guardar(nuevos)
+        if error is not None:
+            print(error)
+            return None
+
+    indices = [posicion[clave] for clave in claves]
+    distance_matrix = MatrizDistancias(distancias[np.ix_(indices, indices)])
+    if return_durations:
+        return distance_matrix, MatrizDistancias(duraciones[np.ix_(indices, indices)])
+    return distance_matrix
+
+def get_distancias_punto(punto_coords, otros_coords, api_key, url=None):
+    """
+    Distancias (km) desde un punto nuevo hacia cada uno de 'otros_coords' y
+    desde cada uno de ellos hacia el punto nuevo: la fila y la columna que le
+    faltan a una matriz ya calculada. Las coordenadas son dicts con
+    'latitud'/'longitud'. Solo se piden a la API los tramos que no están en
+    cache (a lo más 2n elementos).
+
+    Devuelve (desde_punto, hacia_punto), dos listas alineadas con otros_coords,
+    o None si falla la API.
+    """
+    if url is None:
+        url = getattr(settings, 'DISTANCE_MATRIX_URL', None) or DISTANCE_MATRIX_URL
+
+    clave = cache_distancias.clave_coordenadas(punto_coords['latitud'], punto_coords['longitud'])
+    coords = f"{punto_coords['latitud']},{punto_coords['longitud']}"
+    claves_otros = [cache_distancias.clave_coordenadas(c['latitud'], c['longitud']) for c in otros_coords]
+    coords_otros = [f"{c['latitud']},{c['longitud']}" for c in otros_coords]
+
+    en_cache = cache_distancias.buscar([clave], claves_otros)
+    en_cache.update(cache_distancias.buscar(claves_otros, [clave]))
+    metricas.incrementar('rutas_cache_aciertos_total', len(en_cache), cache='distancias')
+    metricas.incrementar('rutas_cache_fallos_total', 2 * len(claves_otros) - len(en_cache), cache='distancias')
+
+    desde_punto = [None] * len(otros_coords)
+    hacia_punto = [None] * len(otros_coords)
+    for j, otra in enumerate(claves_otros):
+        if otra == clave:
+            desde_punto[j] = hacia_punto[j] = 0.0
+            continue
+        if (clave, otra) in en_cache:
+            desde_punto[j] = en_cache[(clave, otra)][0]
+        if (otra, clave) in en_cache:
+            hacia_punto[j] = en_cache[(otra, clave)][0]
+
+    faltan_desde = [j for j, km in enumerate(desde_punto) if km is None]
+    faltan_hacia = [j for j, km in enumerate(hacia_punto) if km is None]
+    tareas = []
+    if faltan_desde:
+        tareas += [
+            (True, faltan_desde[d_ini:d_fin])
+            for _, _, d_ini, d_fin in _bloques(1, len(faltan_desde))
+        ]
+    if faltan_hacia:
+        tareas += [
+            (False, faltan_hacia[o_ini:o_fin])
+            for o_ini, o_fin, _, _ in _bloques(len(faltan_hacia), 1)
+        ]
+
+    def pedir(tarea):
+        desde, indices = tarea
+        otros = [coords_otros[j] for j in indices]
+        if desde:
+            return _pedir_bloque(url, [coords], otros, api_key)
+        return _pedir_bloque(url, otros, [coords], api_key)
+
+    nuevos = {}
+    if tareas:
+        error = None
+        with ThreadPoolExecutor(max_workers=min(MAX_SOLICITUDES_PARALELAS, len(tareas))) as pool:
+            futuros = {pool.submit(pedir, tarea): tarea for tarea in tareas}
+            for futuro in as_completed(futuros):
+                desde, indices = futuros[futuro]
+                try:
+                    bloque_km, bloque_s = futuro.result()
+                except DistanceMatrixError as e:
+                    error = e
+                    continue
+                if desde:
+                    tramos = zip(indices, bloque_km[0], bloque_s[0])
+                else:
+                    tramos = zip(indices, (fila[0] for fila in bloque_km), (fila[0] for fila in bloque_s))
+                for j, km, seg in tramos:
+                    if desde:
+                        desde_punto[j] = km
+                        par = (clave, claves_otros[j])
                     else:
-                        row_distances.append(float('inf'))
-                distance_matrix.append(row_distances)
-            return distance_matrix
-        else:
-            print(f"Error en Distance Matrix API: {data['status']} - {data.get('error_message', '')}")
+                        hacia_punto[j] = km
+                        par = (claves_otros[j], clave)
+                    if km != float('inf'):
+                        nuevos[par] = (km, seg)
+        # (como en get_distance_matrix: lo que llegó queda en cache)
+        cache_distancias.guardar(nuevos)
+        if error is not None:
+            print(error)
             return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error de conexión con la API de Google Maps: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Error al decodificar la respuesta JSON de la API: {e}")
-        return None
+
+    return desde_punto, hacia_punto
 
 # --- PARTE 2: Algoritmo de Optimización (TSP Solver) ---
-def solve_tsp(distance_matrix, num_points_entrega, start_index=0, end_index=None):
-    """
-    Resuelve el TSP:
 
-    - Si end_index es None: ciclo
-        start -> puntos -> start
-    - Si end_index NO es None: camino
-        start -> puntos -> end_index
+# Máximo de puntos de entrega que se resuelven de forma exacta con Held-Karp.
+# La tabla de programación dinámica ocupa ~ 2^n * n * 9 bytes (≈ 40 MB con 18).
+HELD_KARP_MAX_PUNTOS = 18
 
-    'num_points_entrega' = cantidad de puntos reales (sin contar origen ni destino).
+
+def solve_tsp_held_karp(distance_matrix, num_points_entrega, start_index=0, end_index=None):
+    """
+    Resuelve el TSP de forma exacta con programación dinámica sobre subconjuntos
+    (Held-Karp), en O(2^n * n^2) en vez de O(n!).
+
+    Mismo contrato que solve_tsp: (lista de índices de la matriz, distancia total).
     """
-    if not distance_matrix or num_points_entrega == 0:
+    if distance_matrix is None or len(distance_matrix) == 0 or num_points_entrega == 0:
         return [], 0.0
 
-    delivery_indices = list(range(1, num_points_entrega + 1))
+    d = np.asarray(distance_matrix, dtype=float)
+    fin = start_index if end_index is None else end_index
+    return _held_karp(d, num_points_entrega, start_index, fin)
 
-    min_distance = float('inf')
-    best_route = []
 
-    for permutation in itertools.permutations(delivery_indices):
-        if end_index is None:
-            current_route_indices = [start_index] + list(permutation) + [start_index]
+def _held_karp(d, n, start_index, fin, deadline=None):
+    """
+    dp[mascara, j] = distancia mínima saliendo de start_index, visitando
+    exactamente los puntos de 'mascara' y terminando en el punto j.
+    Las transiciones se vectorizan con NumPy sobre todas las máscaras
+    que tienen la misma cantidad de puntos.
+
+    Si se pasa 'deadline' (time.monotonic()) y se acaba el tiempo entre
+    capas, devuelve None.
+    """
+    nodos = np.arange(1, n + 1)
+    sub = d[np.ix_(nodos, nodos)]          # sub[i, j] = distancia punto i -> punto j
+    bits = 1 << np.arange(n)
+
+    dp = np.full((1 << n, n), np.inf)
+    padre = np.full((1 << n, n), -1, dtype=np.int8)
+    dp[bits, np.arange(n)] = d[start_index, nodos]
+
+    mascaras = np.arange(1 << n)
+    cantidad = np.zeros(1 << n, dtype=np.int8)
+    for j in range(n):
+        cantidad += (mascaras >> j) & 1
+
+    for k in range(2, n + 1):
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+        capa = mascaras[cantidad == k]
+        for j in range(n):
+            con_j = capa[(capa & bits[j]) != 0]
+            # dp de los puntos que no están en la máscara previa es inf,
+            # así que no hace falta filtrarlos
+            candidatos = dp[con_j ^ bits[j]] + sub[:, j]
+            mejor = np.argmin(candidatos, axis=1)
+            dp[con_j, j] = candidatos[np.arange(len(con_j)), mejor]
+            padre[con_j, j] = mejor
+
+    completa = (1 << n) - 1
+    totales = dp[completa] + d[nodos, fin]
+    ultimo = int(np.argmin(totales))
+    min_distance = float(totales[ultimo])
+    if min_distance == float('inf'):
+        return [], min_distance
+
+    # reconstruir el recorrido hacia atrás
+    orden = []
+    mascara, j = completa, ultimo
+    while j != -1:
+        orden.append(int(nodos[j]))
+        anterior = int(padre[mascara, j])
+        mascara ^= int(bits[j])
+        j = anterior
+    orden.reverse()
+
+    return [start_index] + orden + [fin], min_distance
+
+
+# Penalización para tramos sin ruta (inf) durante la búsqueda local, así los
+# deltas no terminan en inf - inf = nan.
+_DISTANCIA_PENALIZADA = 1e9
+
+# Vecinos más cercanos por nodo con que se restringe la búsqueda local de las
+# rutas grandes (ver espacial.IndiceEspacial.listas_vecinos)
+VECINOS_BUSQUEDA = 10
+
+
+def _costo_ruta(d, ruta):
+    """Suma de los tramos consecutivos de 'ruta' (array de índices de la matriz)."""
+    return float(d[ruta[:-1], ruta[1:]].sum())
+
+
+def _ruta_vecino_mas_cercano(d, num_points_entrega, start_index, fin):
+    """
+    Construye una ruta inicial: desde start_index siempre al punto pendiente
+    más cercano, y al final se cierra en 'fin'.
+    """
+    pendiente = np.zeros(len(d), dtype=bool)
+    pendiente[1:num_points_entrega + 1] = True
+
+    ruta = [start_index]
+    actual = start_index
+    for _ in range(num_points_entrega):
+        fila = np.where(pendiente, d[actual], np.inf)
+        actual = int(np.argmin(fila))
+        pendiente[actual] = False
+        ruta.append(actual)
+    ruta.append(fin)
+    return np.array(ruta, dtype=np.int64)
+
+
+def _mejorar_2opt(d, ruta, eps=1e-9):
+    """
+    Aplica el mejor movimiento 2-opt (invertir ruta[i..j]) encontrado para algún i.
+    Devuelve True si mejoró.
+
+    Los deltas se evalúan en O(1) por par usando sumas acumuladas de los tramos
+    en sentido directo e inverso (la matriz puede ser asimétrica).
+    """
+    L = len(ruta)
+    if L < 4:
+        return False
+    directo = np.concatenate(([0.0], np.cumsum(d[ruta[:-1], ruta[1:]])))
+    inverso = np.concatenate(([0.0], np.cumsum(d[ruta[1:], ruta[:-1]])))
+
+    for i in range(1, L - 2):
+        j = np.arange(i + 1, L - 1)
+        a, ri = ruta[i - 1], ruta[i]
+        rj, b = ruta[j], ruta[j + 1]
+        delta = (
+            d[a, rj] + d[ri, b] - d[a, ri] - d[rj, b]
+            + (inverso[j] - inverso[i]) - (directo[j] - directo[i])
+        )
+        k = int(np.argmin(delta))
+        if delta[k] < -eps:
+            jj = int(j[k])
+            ruta[i:jj + 1] = ruta[i:jj + 1][::-1].copy()
+            return True
+    return False
+
+
+def _posiciones(ruta, n_nodos):
+    """posicion[nodo] = lugar de 'nodo' en la ruta (-1 si no está)."""
+    posicion = np.full(n_nodos, -1, dtype=np.int64)
+    posicion[ruta] = np.arange(len(ruta))
+    return posicion
+
+
+def _mejorar_2opt_vecinos(d, ruta, vecinos, eps=1e-9):
+    """
+    Como _mejorar_2opt, pero solo con los movimientos en que alguno de los dos
+    tramos nuevos, (ruta[i - 1], ruta[j]) o (ruta[i], ruta[j + 1]), llega a un
+    vecino cercano. Son O(n * k) pares y se evalúan todos de una vez; se
+    aplica el mejor. Devuelve True si mejoró.
+    """
+    L = len(ruta)
+    if L < 4:
+        return False
+    directo = np.concatenate(([0.0], np.cumsum(d[ruta[:-1], ruta[1:]])))
+    inverso = np.concatenate(([0.0], np.cumsum(d[ruta[1:], ruta[:-1]])))
+    posicion = _posiciones(ruta, len(d))
+
+    i = np.arange(1, L - 2)
+    j = np.concatenate((posicion[vecinos[ruta[i - 1]]], posicion[vecinos[ruta[i]]] - 1), axis=1)
+    i = np.broadcast_to(i[:, None], j.shape)
+    validos = (j > i) & (j < L - 1)
+    i, j = i[validos], j[validos]
+    if len(j) == 0:
+        return False
+
+    a, ri, rj, b = ruta[i - 1], ruta[i], ruta[j], ruta[j + 1]
+    delta = (
+        d[a, rj] + d[ri, b] - d[a, ri] - d[rj, b]
+        + (inverso[j] - inverso[i]) - (directo[j] - directo[i])
+    )
+    k = int(np.argmin(delta))
+    if delta[k] < -eps:
+        ii, jj = int(i[k]), int(j[k])
+        ruta[ii:jj + 1] = ruta[ii:jj + 1][::-1].copy()
+        return True
+    return False
+
+
+def _mejorar_or_opt_vecinos(d, ruta, vecinos, max_segmento=3, eps=1e-9):
+    """
+    Como _mejorar_or_opt, pero el tramo solo se prueba junto a vecinos cercanos
+    de su primer punto (antes de él) o de su último punto (después de él).
+    Para cada largo de tramo se evalúan todas esas inserciones de una vez y se
+    aplica la mejor. Devuelve (ruta, mejoró).
+    """
+    L = len(ruta)
+    posicion = _posiciones(ruta, len(d))
+    for s in range(1, max_segmento + 1):
+        i = np.arange(1, L - s)
+        if len(i) == 0:
+            break
+        a, primero, ultimo, b = ruta[i - 1], ruta[i], ruta[i + s - 1], ruta[i + s]
+        ahorro = d[a, b] - d[a, primero] - d[ultimo, b]
+
+        # aristas (p, p+1) donde insertar; las que tocan el tramo no sirven
+        p = np.concatenate((posicion[vecinos[primero]], posicion[vecinos[ultimo]] - 1), axis=1)
+        fila = np.broadcast_to(np.arange(len(i))[:, None], p.shape)
+        i_col = i[:, None]
+        validos = (p >= 0) & (p < L - 1) & ((p < i_col - 1) | (p > i_col + s - 1))
+        fila, p = fila[validos], p[validos]
+        if len(p) == 0:
+            continue
+        x, y = ruta[p], ruta[p + 1]
+        delta = ahorro[fila] + d[x, primero[fila]] + d[ultimo[fila], y] - d[x, y]
+        k = int(np.argmin(delta))
+        if delta[k] < -eps:
+            inicio_tramo, destino = int(i[fila[k]]), int(p[k])
+            tramo = ruta[inicio_tramo:inicio_tramo + s].copy()
+            resto = np.delete(ruta, np.arange(inicio_tramo, inicio_tramo + s))
+            pos = destino + 1 if destino < inicio_tramo else destino + 1 - s
+            return np.insert(resto, pos, tramo), True
+    return ruta, False
+
+
+def _mejorar_or_opt(d, ruta, max_segmento=3, eps=1e-9):
+    """
+    Aplica el mejor movimiento Or-opt (mover un tramo de 1..max_segmento puntos,
+    sin invertirlo, a otra posición) encontrado. Devuelve (ruta, mejoró).
+    """
+    L = len(ruta)
+    for s in range(1, max_segmento + 1):
+        for i in range(1, L - 1 - s + 1):
+            a, primero = ruta[i - 1], ruta[i]
+            ultimo, b = ruta[i + s - 1], ruta[i + s]
+            ahorro = d[a, b] - d[a, primero] - d[ultimo, b]
+
+            # aristas (p, p+1) donde insertar; las que tocan el tramo no sirven
+            p = np.arange(0, L - 1)
+            p = p[(p < i - 1) | (p > i + s - 1)]
+            if len(p) == 0:
+                continue
+            x, y = ruta[p], ruta[p + 1]
+            delta = ahorro + d[x, primero] + d[ultimo, y] - d[x, y]
+            k = int(np.argmin(delta))
+            if delta[k] < -eps:
+                destino = int(p[k])
+                tramo = ruta[i:i + s].copy()
+                resto = np.delete(ruta, np.arange(i, i + s))
+                pos = destino + 1 if destino < i else destino + 1 - s
+                return np.insert(resto, pos, tramo), True
+    return ruta, False
+
+
+def _busqueda_local(d, ruta, deadline=None, vecinos=None):
+    """
+    Alterna 2-opt y Or-opt hasta que ninguno mejora (óptimo local) o hasta
+    que se pasa 'deadline'. Con 'vecinos' (array nodos x k) solo se prueban
+    movimientos hacia vecinos cercanos. Devuelve (ruta, cantidad de movimientos
+    aplicados).
+    """
+    movimientos = 0
+    while deadline is None or time.monotonic() < deadline:
+        if vecinos is None:
+            mejoro = _mejorar_2opt(d, ruta)
+        else:
+            mejoro = _mejorar_2opt_vecinos(d, ruta, vecinos)
+        if mejoro:
+            movimientos += 1
+            continue
+        if vecinos is None:
+            ruta, mejoro = _mejorar_or_opt(d, ruta)
         else:
-            current_route_indices = [start_index] + list(permutation) + [end_index]
+            ruta, mejoro = _mejorar_or_opt_vecinos(d, ruta, vecinos)
+        if not mejoro:
+            break
+        movimientos += 1
+    return ruta, movimientos
 
-        current_distance = 0.0
 
-        for i in range(len(current_route_indices) - 1):
-            origin_idx = current_route_indices[i]
-            dest_idx = current_route_indices[i + 1]
-            segment_distance = distance_matrix[origin_idx][dest_idx]
-            if segment_distance == float('inf'):
-                current_distance = float('inf')
-                break
-            current_distance += segment_distance
+def _perturbar(ruta, rng):
+    """
+    Perturbación "double bridge" de los puntos interiores: A B C D -> A C B D.
+    No invierte tramos, así que sirve también con matrices asimétricas.
+    """
+    interior = ruta[1:-1]
+    if len(interior) < 8:
+        i, j = rng.choice(len(interior), size=2, replace=False)
+        interior = interior.copy()
+        interior[[i, j]] = interior[[j, i]]
+    else:
+        c1, c2, c3 = np.sort(rng.choice(np.arange(1, len(interior)), size=3, replace=False))
+        interior = np.concatenate((
+            interior[:c1], interior[c2:c3], interior[c1:c2], interior[c3:]
+        ))
+    return np.concatenate((ruta[:1], interior, ruta[-1:]))
+
+
+def solve_tsp_heuristico(distance_matrix, num_points_entrega, start_index=0, end_index=None):
+    """
+    Resuelve el TSP de forma aproximada para rutas grandes (50–500 puntos):
+    ruta inicial por vecino más cercano y luego búsqueda local 2-opt + Or-opt.
+
+    Mismo contrato que solve_tsp: (lista de índices de la matriz, distancia total).
+    """
+    resultado = resolver_ruta(
+        distance_matrix, num_points_entrega, start_index, end_index, metodo='heuristico'
+    )
+    return resultado['ruta'], resultado['distancia_km']
 
-        if current_distance < min_distance:
-            min_distance = current_distance
-            best_route = current_route_indices
 
-    return best_route, min_distance
+def resolver_ruta(distance_matrix, num_points_entrega, start_index=0, end_index=None,
+                  max_seconds=None, metodo=None, semilla=0, vecinos=None):
+    """
+    Resuelve el TSP con límite de tiempo opcional y devuelve, además de la ruta,
+    información del proceso:
+
+        {
+            'ruta': [...], 'distancia_km': float,
+            'metodo': 'held_karp' | 'heuristico',
+            'iteraciones': rondas de búsqueda local,
+            'movimientos': movimientos 2-opt/Or-opt aplicados,
+            'curva_mejora': [(segundos, km), ...] cada vez que mejora la mejor ruta,
+            'optimo_probado': True si la ruta es óptima (Held-Karp terminó),
+            'tiempo_s': float,
+        }
+
+    Sin max_seconds: Held-Karp hasta HELD_KARP_MAX_PUNTOS puntos, si no una
+    búsqueda local. Con max_seconds: se parte de la heurística y se sigue
+    mejorando (Held-Karp o búsqueda local iterada con perturbaciones) hasta el
+    límite; al vencer se devuelve la mejor ruta encontrada hasta ese momento.
+
+    'vecinos' (opcional): array (nodos de la matriz x k) con los k vecinos más
+    cercanos de cada nodo; la búsqueda local solo prueba movimientos hacia
+    ellos (Held-Karp no lo usa).
+    """
+    inicio = time.monotonic()
+    deadline = inicio + max_seconds if max_seconds else None
+    n = num_points_entrega
+    if metodo is None:
+        metodo = 'held_karp' if n <= HELD_KARP_MAX_PUNTOS else 'heuristico'
+
+    resultado = {
+        'ruta': [],
+        'distancia_km': 0.0,
+        'metodo': metodo,
+        'iteraciones': 0,
+        'movimientos': 0,
+        'curva_mejora': [],
+        'optimo_probado': False,
+        'tiempo_s': 0.0,
+    }
+    if distance_matrix is None or len(distance_matrix) == 0 or n == 0:
+        resultado['optimo_probado'] = True
+        return resultado
+
+    d_real = np.asarray(distance_matrix, dtype=float)
+    fin = start_index if end_index is None else end_index
+
+    def registrar(ruta):
+        total = _costo_ruta(d_real, ruta)
+        if resultado['ruta'] and total >= resultado['distancia_km']:
+            return
+        resultado['ruta'] = [int(i) for i in ruta]
+        resultado['distancia_km'] = total
+        resultado['curva_mejora'].append((round(time.monotonic() - inicio, 4), total))
+
+    if metodo == 'held_karp' and deadline is None:
+        ruta, total = _held_karp(d_real, n, start_index, fin)
+        resultado['ruta'], resultado['distancia_km'] = ruta, total
+        resultado['curva_mejora'].append((round(time.monotonic() - inicio, 4), total))
+        resultado['optimo_probado'] = True
+    else:
+        # ruta inicial + búsqueda local: siempre hay una respuesta disponible
+        d = np.where(np.isfinite(d_real), d_real, _DISTANCIA_PENALIZADA)
+        ruta = _ruta_vecino_mas_cercano(d, n, start_index, fin)
+        registrar(ruta)
+        ruta, movimientos = _busqueda_local(d, ruta, deadline, vecinos)
+        resultado['iteraciones'] = 1
+        resultado['movimientos'] = movimientos
+        registrar(ruta)
+
+        if metodo == 'held_karp':
+            exacto = _held_karp(d_real, n, start_index, fin, deadline)
+            if exacto is not None:
+                resultado['ruta'], resultado['distancia_km'] = exacto
+                resultado['curva_mejora'].append(
+                    (round(time.monotonic() - inicio, 4), exacto[1])
+                )
+                resultado['optimo_probado'] = True
+        elif deadline is not None and n >= 3:
+            # búsqueda local iterada hasta el límite de tiempo
+            rng = np.random.default_rng(semilla)
+            mejor = np.array(resultado['ruta'], dtype=np.int64)
+            mejor_costo = _costo_ruta(d, mejor)
+            while time.monotonic() < deadline:
+                candidata, movimientos = _busqueda_local(d, _perturbar(mejor, rng), deadline, vecinos)
+                resultado['iteraciones'] += 1
+                resultado['movimientos'] += movimientos
+                costo = _costo_ruta(d, candidata)
+                if costo < mejor_costo - 1e-9:
+                    mejor, mejor_costo = candidata, costo
+                    registrar(mejor)
+
+    if resultado['distancia_km'] == float('inf'):
+        resultado['ruta'] = []
+    resultado['tiempo_s'] = round(time.monotonic() - inicio, 4)
+    return resultado
+
+
+def solve_tsp(distance_matrix, num_points_entrega, start_index=0, end_index=None, max_seconds=None):
+    """
+    Resuelve el TSP:
+
+    - Si end_index es None: ciclo
+        start -> puntos -> start
+    - Si end_index NO es None: camino
+        start -> puntos -> end_index
+
+    'num_points_entrega' = cantidad de puntos reales (sin contar origen ni destino).
+
+    Hasta HELD_KARP_MAX_PUNTOS puntos usa el método exacto (Held-Karp);
+    con más puntos usa la heurística de búsqueda local.
+    Con max_seconds devuelve la mejor ruta encontrada dentro de ese tiempo
+    (ver resolver_ruta).
+    """
+    resultado = resolver_ruta(
+        distance_matrix, num_points_entrega, start_index, end_index, max_seconds=max_seconds
+    )
+    return resultado['ruta'], resultado['distancia_km']
 
 # --- PARTE 3: Cálculos de Consumo ---
 AUTO_RENDIMIENTO_KM_POR_LITRO = 12  # valor por defecto
@@ -116,12 +717,18 @@ def calculate_fuel_cost(total_distance_km, rendimiento_km_por_litro=AUTO_RENDIMI
 
     El costo en CLP se calcula en la vista multiplicando:
         litros_consumidos * precio_bencina_CLP_por_L
+
+    También acepta arrays de NumPy, que se combinan con broadcasting (p. ej.
+    distancias (n, 1) y rendimientos (1, m) dan los litros (n, m) de todas las
+    combinaciones, ver escenarios.py). Con escalares devuelve un float.
     """
-    if total_distance_km == float('inf'):
-        return float('inf')
-    if rendimiento_km_por_litro <= 0:
-        return float('inf')  # evita división por cero o negativos
-    return total_distance_km / rendimiento_km_por_litro
+    distancia = np.asarray(total_distance_km, dtype=float)
+    rendimiento = np.asarray(rendimiento_km_por_litro, dtype=float)
+    # rendimiento cero o negativo: consumo infinito (sin dividir por él)
+    valido = rendimiento > 0
+    litros = np.where(valido, distancia / np.where(valido, rendimiento, 1.0), np.inf)
+    litros = np.where(np.isinf(distancia), np.inf, litros)
+    return float(litros) if litros.ndim == 0 else litros
 
 def calculate_fuel_consumption(total_distance_km, rendimiento_km_por_litro=AUTO_RENDIMIENTO_KM_POR_LITRO):
     """
@@ -129,3 +736,622 @@ def calculate_fuel_consumption(total_distance_km, rendimiento_km_por_litro=AUTO_
     si más adelante quieres usarlo con este nombre.
     """
     return calculate_fuel_cost(total_distance_km, rendimiento_km_por_litro)
+
+# --- PARTE 4: Varios vehículos con capacidad (CVRP) ---
+
+def _ahorros_clarke_wright(d, demandas, capacidad, num_vehiculos, start_index, fin):
+    """
+    Construcción por ahorros (Clarke-Wright) para rutas start -> ... -> fin.
+
+    ahorro(i, j) = d[i, fin] + d[start, j] - d[i, j]: lo que se gana al unir
+    una ruta que termina en i con otra que empieza en j. Se une mientras el
+    ahorro sea positivo y, si todavía hay más rutas que vehículos, también con
+    ahorros negativos. Devuelve listas de puntos (índices 1..n de la matriz).
+    """
+    n = len(demandas)
+    nodos = np.arange(1, n + 1)
+    ahorros = d[nodos, fin][:, None] + d[start_index, nodos][None, :] - d[np.ix_(nodos, nodos)]
+    np.fill_diagonal(ahorros, -np.inf)
+
+    rutas = {i: [i] for i in range(1, n + 1)}
+    carga = {i: demandas[i - 1] for i in range(1, n + 1)}
+    ruta_de = {i: i for i in range(1, n + 1)}
+
+    for plano in np.argsort(-ahorros, axis=None, kind='stable'):
+        fila, columna = divmod(int(plano), n)
+        ahorro = ahorros[fila, columna]
+        if ahorro == -np.inf or (ahorro <= 0 and len(rutas) <= num_vehiculos):
+            break
+        i, j = fila + 1, columna + 1
+        ri, rj = ruta_de[i], ruta_de[j]
+        if ri == rj or rutas[ri][-1] != i or rutas[rj][0] != j:
+            continue
+        if carga[ri] + carga[rj] > capacidad:
+            continue
+        rutas[ri].extend(rutas[rj])
+        carga[ri] += carga[rj]
+        for k in rutas[rj]:
+            ruta_de[k] = ri
+        del rutas[rj], carga[rj]
+
+    return list(rutas.values())
+
+
+def _reubicar_entre_rutas(d, rutas, cargas, demandas, vehiculos, deadline=None, eps=1e-9):
+    """
+    Mueve puntos de una ruta a otra (respetando capacidades) mientras baje el
+    total de litros: cada ruta pesa según el rendimiento de su vehículo.
+    Los deltas se evalúan en O(1) por posición de inserción.
+    """
+    rendimientos = [v['rendimiento_km_por_litro'] for v in vehiculos]
+    mejoro = True
+    while mejoro and (deadline is None or time.monotonic() < deadline):
+        mejoro = False
+        for a, ruta_a in enumerate(rutas):
+            i = 1
+            while i < len(ruta_a) - 1:
+                p, x, s = ruta_a[i - 1], ruta_a[i], ruta_a[i + 1]
+                quitar = (d[p, s] - d[p, x] - d[x, s]) / rendimientos[a]
+                mejor = (-eps, None, None)
+                for b, ruta_b in enumerate(rutas):
+                    if b == a or cargas[b] + demandas[x - 1] > vehiculos[b]['capacidad']:
+                        continue
+                    rb = np.array(ruta_b)
+                    u, v = rb[:-1], rb[1:]
+                    delta = quitar + (d[u, x] + d[x, v] - d[u, v]) / rendimientos[b]
+                    k = int(np.argmin(delta))
+                    if delta[k] < mejor[0]:
+                        mejor = (delta[k], b, k + 1)
+                _, b, pos = mejor
+                if b is None:
+                    i += 1
+                    continue
+                del ruta_a[i]
+                rutas[b].insert(pos, x)
+                cargas[a] -= demandas[x - 1]
+                cargas[b] += demandas[x - 1]
+                mejoro = True
+    return rutas
+
+
+def _optimizar_subruta(d, puntos, start_index, fin, cerrada, max_seconds=None, tiempos=None):
+    """
+    Ordena los 'puntos' de una ruta resolviendo el TSP (o el TSPTW si hay
+    'tiempos') sobre la submatriz. Devuelve el dict del solver con la ruta
+    traducida a índices de la matriz completa.
+    """
+    indices = [start_index] + list(puntos) + ([] if cerrada else [fin])
+    sub = d[np.ix_(indices, indices)]
+    end_index = None if cerrada else len(puntos) + 1
+    if tiempos is None:
+        resultado = resolver_ruta(sub, len(puntos), 0, end_index, max_seconds=max_seconds)
+    else:
+        resultado = solve_tsptw(
+            sub,
+            MatrizDistancias(tiempos['duraciones']).submatriz(indices),
+            len(puntos),
+            np.asarray(tiempos['inicio'], dtype=float)[indices],
+            np.asarray(tiempos['fin'], dtype=float)[indices],
+            np.asarray(tiempos['servicio'], dtype=float)[indices],
+            0, end_index, max_seconds=max_seconds,
+        )
+        resultado['atrasados'] = [indices[k] for k in resultado['atrasados']]
+    resultado['ruta'] = [indices[k] for k in resultado['ruta']]
+    return resultado
+
+
+def solve_cvrp(distance_matrix, num_points_entrega, demandas, vehiculos,
+               start_index=0, end_index=None, max_seconds=None, tiempos=None):
+    """
+    Reparte los puntos entre varios vehículos con capacidad (CVRP).
+
+    'demandas': demanda (kg) de cada punto, en el orden de la matriz (1..n).
+    'vehiculos': lista de dicts {'capacidad': kg, 'rendimiento_km_por_litro': km/L}.
+
+    Construye rutas por ahorros (Clarke-Wright), las asigna a los vehículos
+    donde caben, reubica puntos entre rutas para bajar los litros totales
+    (cada vehículo con su rendimiento) y ordena cada ruta con resolver_ruta.
+
+    Con 'tiempos' ({'duraciones', 'inicio', 'fin', 'servicio'}, ver
+    solve_tsptw) cada ruta se ordena respetando las ventanas horarias y se
+    agregan 'llegadas' y 'atrasados' a cada ruta.
+
+    Devuelve {'rutas': [{'vehiculo': índice en 'vehiculos', 'ruta': [...],
+    'distancia_km', 'carga', 'litros'}], 'distancia_km', 'litros', 'tiempo_s'}
+    o None si la flota no alcanza para la demanda.
+    """
+    inicio = time.monotonic()
+    deadline = inicio + max_seconds if max_seconds else None
+    if distance_matrix is None or len(distance_matrix) == 0 or num_points_entrega == 0 or not vehiculos:
+        return None
+
+    d_real = np.asarray(distance_matrix, dtype=float)
+    d = np.where(np.isfinite(d_real), d_real, _DISTANCIA_PENALIZADA)
+    fin = start_index if end_index is None else end_index
+    demandas = [float(x or 0) for x in demandas]
+    capacidad_max = max(v['capacidad'] for v in vehiculos)
+
+    if max(demandas) > capacidad_max:
+        print("Hay puntos con demanda mayor que la capacidad de cualquier vehículo.")
+        return None
+
+    grupos = _ahorros_clarke_wright(d, demandas, capacidad_max, len(vehiculos), start_index, fin)
+
+    # asignar cada ruta (de mayor a menor carga) al vehículo más chico donde quepa;
+    # los puntos de las rutas que no caben en ninguno se insertan después
+    rutas = [[start_index, fin] for _ in vehiculos]
+    cargas = [0.0 for _ in vehiculos]
+    libres = list(range(len(vehiculos)))
+    sueltos = []
+    for grupo in sorted(grupos, key=lambda g: -sum(demandas[i - 1] for i in g)):
+        carga = sum(demandas[i - 1] for i in grupo)
+        caben = [k for k in libres if carga <= vehiculos[k]['capacidad']]
+        if not caben:
+            sueltos.extend(grupo)
+            continue
+        k = min(caben, key=lambda k: (vehiculos[k]['capacidad'], -vehiculos[k]['rendimiento_km_por_litro']))
+        rutas[k] = [start_index] + grupo + [fin]
+        cargas[k] = carga
+        libres.remove(k)
+
+    for x in sorted(sueltos, key=lambda i: -demandas[i - 1]):
+        mejor = (np.inf, None, None)
+        for k, ruta in enumerate(rutas):
+            if cargas[k] + demandas[x - 1] > vehiculos[k]['capacidad']:
+                continue
+            r = np.array(ruta)
+            delta = (d[r[:-1], x] + d[x, r[1:]] - d[r[:-1], r[1:]]) / vehiculos[k]['rendimiento_km_por_litro']
+            pos = int(np.argmin(delta))
+            if delta[pos] < mejor[0]:
+                mejor = (delta[pos], k, pos + 1)
+        _, k, pos = mejor
+        if k is None:
+            print("La capacidad de la flota no alcanza para la demanda de los puntos.")
+            return None
+        rutas[k].insert(pos, x)
+        cargas[k] += demandas[x - 1]
+
+    rutas = _reubicar_entre_rutas(d, rutas, cargas, demandas, vehiculos, deadline)
+
+    # ordenar cada ruta por separado, repartiendo el tiempo que queda
+    usadas = [k for k, ruta in enumerate(rutas) if len(ruta) > 2]
+    resultado = {'rutas': [], 'distancia_km': 0.0, 'litros': 0.0}
+    for k in usadas:
+        restante = None
+        if deadline is not None:
+            restante = max(0.1, (deadline - time.monotonic()) / len(usadas))
+        orden = _optimizar_subruta(
+            d_real, rutas[k][1:-1], start_index, fin, end_index is None, restante, tiempos
+        )
+        ruta = orden['ruta']
+        if not ruta:
+            return None
+        distancia = _costo_ruta(d_real, np.array(ruta))
+        litros = calculate_fuel_cost(distancia, vehiculos[k]['rendimiento_km_por_litro'])
+        resultado['rutas'].append({
+            'vehiculo': k,
+            'ruta': ruta,
+            'distancia_km': distancia,
+            'carga': cargas[k],
+            'litros': litros,
+            'llegadas': orden.get('llegadas', []),
+            'atrasados': orden.get('atrasados', []),
+        })
+        resultado['distancia_km'] += distancia
+        resultado['litros'] += litros
+    resultado['tiempo_s'] = round(time.monotonic() - inicio, 4)
+    return resultado
+
+# --- PARTE 5: Ventanas horarias (TSPTW) ---
+
+def _programar(ruta, t, ventana_inicio, servicio):
+    """
+    Horario de una ruta partiendo en el instante 0. Devuelve (llegada, comienzo)
+    por posición: comienzo = max(llegada, inicio de la ventana) (se espera si
+    se llega antes).
+    """
+    llegada = np.zeros(len(ruta))
+    comienzo = np.zeros(len(ruta))
+    for k in range(1, len(ruta)):
+        anterior, actual = ruta[k - 1], ruta[k]
+        llegada[k] = comienzo[k - 1] + servicio[anterior] + t[anterior, actual]
+        comienzo[k] = max(llegada[k], ventana_inicio[actual])
+    return llegada, comienzo
+
+
+def _holguras(ruta, llegada, comienzo, ventana_fin):
+    """
+    Holgura hacia adelante (forward time slack) de cada posición: cuánto se
+    puede atrasar el comienzo en esa posición sin que ningún punto posterior
+    quede fuera de su ventana. Con ella, revisar si una inserción es factible
+    cuesta O(1) en vez de volver a simular toda la ruta.
+    """
+    holgura = np.empty(len(ruta))
+    holgura[-1] = ventana_fin[ruta[-1]] - comienzo[-1]
+    for k in range(len(ruta) - 2, -1, -1):
+        espera = comienzo[k + 1] - llegada[k + 1]
+        holgura[k] = min(ventana_fin[ruta[k]] - comienzo[k], espera + holgura[k + 1])
+    return holgura
+
+
+def _inserciones(d, t, ruta, candidatos, ventana_inicio, ventana_fin, servicio):
+    """
+    Costo (km) y factibilidad de insertar cada candidato en cada tramo de la
+    ruta. Devuelve dos arrays (candidatos x tramos): costo y factible.
+    """
+    r = np.asarray(ruta)
+    u = np.asarray(candidatos)[:, None]
+    i, j = r[:-1][None, :], r[1:][None, :]
+    llegada, comienzo = _programar(r, t, ventana_inicio, servicio)
+    holgura = _holguras(r, llegada, comienzo, ventana_fin)
+
+    llegada_u = comienzo[:-1][None, :] + servicio[i] + t[i, u]
+    comienzo_u = np.maximum(llegada_u, ventana_inicio[u])
+    nueva_llegada_j = comienzo_u + servicio[u] + t[u, j]
+    empuje = np.maximum(0.0, nueva_llegada_j - comienzo[1:][None, :])
+
+    factible = (llegada_u <= ventana_fin[u]) & (empuje <= holgura[1:][None, :])
+    costo = d[i, u] + d[u, j] - d[i, j]
+    return costo, factible
+
+
+def _construir_con_ventanas(d, t, num_points_entrega, start_index, fin,
+                            ventana_inicio, ventana_fin, servicio, criterio):
+    """
+    Construye una ruta por inserción. Con criterio 'costo' se inserta siempre
+    la inserción factible más barata; con 'urgencia', el punto factible cuya
+    ventana cierra antes, en su posición más barata.
+
+    Los puntos que no caben en su ventana se insertan al final donde cuesten
+    menos km. Devuelve (ruta, puntos atrasados).
+    """
+    ruta = [start_index, fin]
+    pendientes = list(range(1, num_points_entrega + 1))
+    while pendientes:
+        costo, factible = _inserciones(d, t, ruta, pendientes, ventana_inicio, ventana_fin, servicio)
+        costo = np.where(factible, costo, np.inf)
+        if not factible.any():
+            break
+        if criterio == 'urgencia':
+            con_lugar = factible.any(axis=1)
+            cierre = np.where(con_lugar, ventana_fin[pendientes], np.inf)
+            # a igual cierre, el de inserción más barata
+            c = int(np.lexsort((costo.min(axis=1), cierre))[0])
+            pos = int(np.argmin(costo[c]))
+        else:
+            c, pos = divmod(int(np.argmin(costo)), costo.shape[1])
+        ruta.insert(pos + 1, pendientes.pop(c))
+
+    for u in pendientes:
+        r = np.array(ruta)
+        costo = d[r[:-1], u] + d[u, r[1:]] - d[r[:-1], r[1:]]
+        ruta.insert(int(np.argmin(costo)) + 1, u)
+    return ruta, pendientes
+
+
+def solve_tsptw(distance_matrix, duration_matrix, num_points_entrega,
+                ventanas_inicio, ventanas_fin, tiempos_servicio,
+                start_index=0, end_index=None, max_seconds=None):
+    """
+    Ordena los puntos respetando ventanas horarias.
+
+    Tiempos en segundos desde la salida del origen; los arrays de ventanas y
+    servicio van indexados como la matriz (inf en ventanas_fin = sin límite).
+
+    Construye la ruta por inserción (ver _construir_con_ventanas), revisando
+    la factibilidad de cada inserción con la holgura hacia adelante. Los puntos
+    que no caben en su ventana quedan penalizados (ventana relajada) y se
+    informan como atrasados. Luego se reubican puntos mientras baje la
+    distancia sin romper ventanas.
+
+    Devuelve un dict como resolver_ruta, más 'llegadas' (segundos por posición
+    de la ruta) y 'atrasados' (índices de la matriz que llegan tarde).
+    """
+    inicio = time.monotonic()
+    deadline = inicio + max_seconds if max_seconds else None
+    resultado = {
+        'ruta': [],
+        'distancia_km': 0.0,
+        'metodo': 'ventanas_horarias',
+        'iteraciones': 0,
+        'movimientos': 0,
+        'curva_mejora': [],
+        'optimo_probado': False,
+        'tiempo_s': 0.0,
+        'llegadas': [],
+        'atrasados': [],
+    }
+    if distance_matrix is None or len(distance_matrix) == 0 or num_points_entrega == 0:
+        return resultado
+
+    d_real = np.asarray(distance_matrix, dtype=float)
+    d = np.where(np.isfinite(d_real), d_real, _DISTANCIA_PENALIZADA)
+    t = np.asarray(duration_matrix, dtype=float)
+    t = np.where(np.isfinite(t), t, _DISTANCIA_PENALIZADA)
+    ventana_inicio = np.asarray(ventanas_inicio, dtype=float)
+    ventana_fin_original = np.asarray(ventanas_fin, dtype=float)
+    ventana_fin = ventana_fin_original.copy()
+    servicio = np.asarray(tiempos_servicio, dtype=float)
+    fin = start_index if end_index is None else end_index
+
+    # 1) y 2) construcción: se prueban dos criterios y se queda la ruta con
+    # menos atrasados (y luego menos km)
+    mejor = None
+    for criterio in ('costo', 'urgencia'):
+        ruta, atrasados = _construir_con_ventanas(
+            d, t, num_points_entrega, start_index, fin,
+            ventana_inicio, ventana_fin_original, servicio, criterio,
+        )
+        clave = (len(atrasados), _costo_ruta(d, np.array(ruta)))
+        if mejor is None or clave < mejor[0]:
+            mejor = (clave, ruta, atrasados)
+    _, ruta, atrasados = mejor
+    for u in atrasados:
+        ventana_fin[u] = np.inf
+
+    resultado['curva_mejora'].append((round(time.monotonic() - inicio, 4), _costo_ruta(d_real, np.array(ruta))))
+
+    # 3) reubicar puntos mientras baje la distancia y se respeten las ventanas
+    mejoro = True
+    while mejoro and (deadline is None or time.monotonic() < deadline):
+        mejoro = False
+        resultado['iteraciones'] += 1
+        for k in range(1, len(ruta) - 1):
+            x = ruta[k]
+            ahorro = d[ruta[k - 1], ruta[k + 1]] - d[ruta[k - 1], x] - d[x, ruta[k + 1]]
+            sin_x = ruta[:k] + ruta[k + 1:]
+            costo, factible = _inserciones(d, t, sin_x, [x], ventana_inicio, ventana_fin, servicio)
+            delta = np.where(factible[0], costo[0] + ahorro, np.inf)
+            delta[k - 1] = np.inf  # misma posición
+            pos = int(np.argmin(delta))
+            if delta[pos] < -1e-9:
+                sin_x.insert(pos + 1, x)
+                ruta = sin_x
+                resultado['movimientos'] += 1
+                mejoro = True
+                break
+        if mejoro:
+            resultado['curva_mejora'].append(
+                (round(time.monotonic() - inicio, 4), _costo_ruta(d_real, np.array(ruta)))
+            )
+
+    r = np.array(ruta)
+    llegada, comienzo = _programar(r, t, ventana_inicio, servicio)
+    resultado['ruta'] = [int(i) for i in ruta]
+    resultado['distancia_km'] = _costo_ruta(d_real, r)
+    resultado['llegadas'] = [float(x) for x in llegada]
+    resultado['atrasados'] = [
+        int(i) for i, c in zip(r, comienzo) if c > ventana_fin_original[i] + 1e-6
+    ]
+    if resultado['distancia_km'] == float('inf'):
+        resultado['ruta'] = []
+    resultado['tiempo_s'] = round(time.monotonic() - inicio, 4)
+    return resultado
+
+
+# --- PARTE 6: Reoptimización incremental (agregar o quitar un punto) ---
+VECINDARIO_INCREMENTAL = 8  # posiciones a cada lado del cambio que se reoptimizan
+
+
+def _reparar_vecindario(d_real, ruta, pos, vecindario):
+    """
+    Búsqueda local (2-opt + Or-opt) solo sobre ruta[pos - vecindario .. pos + vecindario],
+    con los extremos del tramo fijos. Trabaja sobre la submatriz de esos puntos,
+    así el costo depende del vecindario y no de n. Devuelve (ruta, movimientos).
+    """
+    ini = max(0, pos - vecindario)
+    fin = min(len(ruta) - 1, pos + vecindario)
+    nodos = ruta[ini:fin + 1]
+    sub = d_real[np.ix_(nodos, nodos)]
+    sub = np.where(np.isfinite(sub), sub, _DISTANCIA_PENALIZADA)
+    local, movimientos = _busqueda_local(sub, np.arange(len(nodos), dtype=np.int64))
+    return np.concatenate((ruta[:ini], nodos[local], ruta[fin + 1:])), movimientos
+
+
+def _resultado_incremental(d_real, ruta, movimientos, inicio):
+    return {
+        'ruta': [int(i) for i in ruta],
+        'distancia_km': _costo_ruta(d_real, ruta),
+        'metodo': 'incremental',
+        'iteraciones': 1,
+        'movimientos': movimientos,
+        'curva_mejora': [],
+        'optimo_probado': False,
+        'tiempo_s': round(time.monotonic() - inicio, 4),
+    }
+
+
+def insertar_punto(distance_matrix, ruta, nuevo, vecindario=VECINDARIO_INCREMENTAL, candidatos=None):
+    """
+    Agrega el índice 'nuevo' a una ruta ya optimizada: inserción más barata
+    (el tramo (a, b) donde d[a, nuevo] + d[nuevo, b] - d[a, b] es mínimo) y luego
+    búsqueda local solo alrededor de la inserción.
+
+    'candidatos' (opcional): índices de la matriz cercanos a 'nuevo'; solo se
+    prueban los tramos que entran o salen de ellos (si no, todos los tramos).
+    'distance_matrix' ya debe incluir la fila y la columna de 'nuevo'.
+    Devuelve un dict como resolver_ruta (metodo 'incremental').
+    """
+    inicio = time.monotonic()
+    d_real = np.asarray(distance_matrix, dtype=float)
+    ruta = np.asarray(ruta, dtype=np.int64)
+
+    tramos = np.arange(len(ruta) - 1)  # tramo t = (ruta[t], ruta[t + 1])
+    if candidatos is not None and len(candidatos):
+        posiciones = np.flatnonzero(np.isin(ruta, candidatos))
+        tramos = np.unique(np.concatenate((posiciones - 1, posiciones)))
+        tramos = tramos[(tramos >= 0) & (tramos < len(ruta) - 1)]
+    a, b = ruta[tramos], ruta[tramos + 1]
+    costo = d_real[a, nuevo] + d_real[nuevo, b] - d_real[a, b]
+    costo = np.where(np.isfinite(costo), costo, _DISTANCIA_PENALIZADA)
+    pos = int(tramos[np.argmin(costo)]) + 1
+    ruta = np.insert(ruta, pos, nuevo)
+    ruta, movimientos = _reparar_vecindario(d_real, ruta, pos, vecindario)
+    return _resultado_incremental(d_real, ruta, movimientos, inicio)
+
+
+def quitar_punto(distance_matrix, ruta, nodo, vecindario=VECINDARIO_INCREMENTAL):
+    """
+    Saca el índice 'nodo' de una ruta ya optimizada (uniendo su anterior con su
+    siguiente) y repara con búsqueda local solo alrededor del hueco.
+
+    Los índices no cambian: quien guarda la matriz debe borrar la fila/columna
+    de 'nodo' y correr los índices mayores. Devuelve un dict como resolver_ruta.
+    """
+    inicio = time.monotonic()
+    d_real = np.asarray(distance_matrix, dtype=float)
+    ruta = np.asarray(ruta, dtype=np.int64)
+
+    pos = int(np.flatnonzero(ruta[1:-1] == nodo)[0]) + 1
+    ruta = np.delete(ruta, pos)
+    ruta, movimientos = _reparar_vecindario(d_real, ruta, pos - 1, vecindario)
+    return _resultado_incremental(d_real, ruta, movimientos, inicio)
+
+
+# --- PARTE 7: Búsqueda en paralelo (varios arranques en varios núcleos) ---
+CANDIDATOS_ARRANQUE = 3  # en cada paso se elige al azar entre los más cercanos
+
+# Matriz compartida del proceso worker (la abre _abrir_matriz_compartida)
+_matriz_worker = None
+
+
+def _ruta_vecino_aleatorio(d, num_points_entrega, start_index, fin, rng):
+    """
+    Como _ruta_vecino_mas_cercano, pero en cada paso elige al azar entre los
+    CANDIDATOS_ARRANQUE puntos pendientes más cercanos: cada semilla parte de
+    una ruta distinta.
+    """
+    pendiente = np.zeros(len(d), dtype=bool)
+    pendiente[1:num_points_entrega + 1] = True
+
+    ruta = [start_index]
+    actual = start_index
+    for quedan in range(num_points_entrega, 0, -1):
+        fila = np.where(pendiente, d[actual], np.inf)
+        k = min(CANDIDATOS_ARRANQUE, quedan)
+        cercanos = np.argpartition(fila, k - 1)[:k]
+        actual = int(rng.choice(cercanos))
+        pendiente[actual] = False
+        ruta.append(actual)
+    ruta.append(fin)
+    return np.array(ruta, dtype=np.int64)
+
+
+def _abrir_matriz_compartida(nombre, n_nodos):
+    """Initializer del pool: cada worker abre la matriz una vez, sin copiarla."""
+    global _matriz_worker
+    memoria = shared_memory.SharedMemory(name=nombre)
+    _matriz_worker = (memoria, np.ndarray((n_nodos, n_nodos), dtype=np.float64, buffer=memoria.buf))
+
+
+def _arranque(num_points_entrega, start_index, fin, semilla, segundos, vecinos=None):
+    """
+    Un arranque (corre en un worker): ruta inicial (vecino más cercano con la
+    semilla 0, aleatorizada con las demás), búsqueda local y, si hay tiempo,
+    búsqueda local iterada hasta 'segundos'.
+    Devuelve (ruta, costo, iteraciones, movimientos, semilla).
+    """
+    d = _matriz_worker[1]
+    deadline = time.monotonic() + segundos if segundos else None
+    rng = np.random.default_rng(semilla)
+
+    if semilla == 0:
+        ruta = _ruta_vecino_mas_cercano(d, num_points_entrega, start_index, fin)
+    else:
+        ruta = _ruta_vecino_aleatorio(d, num_points_entrega, start_index, fin, rng)
+    mejor, movimientos = _busqueda_local(d, ruta, deadline, vecinos)
+    mejor_costo = _costo_ruta(d, mejor)
+    iteraciones = 1
+
+    while deadline is not None and num_points_entrega >= 3 and time.monotonic() < deadline:
+        candidata, nuevos = _busqueda_local(d, _perturbar(mejor, rng), deadline, vecinos)
+        iteraciones += 1
+        movimientos += nuevos
+        costo = _costo_ruta(d, candidata)
+        if costo < mejor_costo - 1e-9:
+            mejor, mejor_costo = candidata, costo
+    return mejor.tolist(), mejor_costo, iteraciones, movimientos, semilla
+
+
+def resolver_ruta_paralelo(distance_matrix, num_points_entrega, start_index=0, end_index=None,
+                           max_seconds=None, procesos=2, arranques=None, semilla=0, vecinos=None):
+    """
+    Corre 'arranques' búsquedas locales independientes (distinta ruta inicial y
+    distintas perturbaciones) en 'procesos' procesos y devuelve la mejor.
+
+    La matriz se copia una sola vez a memoria compartida y los workers la leen
+    desde ahí (no se serializa para cada tarea). Con max_seconds cada arranque
+    usa su parte del tiempo: si hay más arranques que procesos se reparten en
+    rondas. 'vecinos' como en resolver_ruta.
+
+    Devuelve un dict como resolver_ruta (metodo 'paralelo', más 'arranques' y
+    'procesos'). Con un solo proceso, o si el pool no se puede usar, resuelve
+    con resolver_ruta en este proceso.
+    """
+    n = num_points_entrega
+    arranques = arranques or procesos
+    if procesos <= 1 or arranques <= 1 or distance_matrix is None or len(distance_matrix) == 0 or n < 3:
+        return resolver_ruta(distance_matrix, n, start_index, end_index,
+                             max_seconds=max_seconds, metodo='heuristico', semilla=semilla, vecinos=vecinos)
+
+    inicio = time.monotonic()
+    d_real = np.asarray(distance_matrix, dtype=float)
+    fin = start_index if end_index is None else end_index
+    segundos = None
+    if max_seconds:
+        rondas = -(-arranques // procesos)
+        segundos = max_seconds / rondas
+
+    resultado = {
+        'ruta': [],
+        'distancia_km': 0.0,
+        'metodo': 'paralelo',
+        'iteraciones': 0,
+        'movimientos': 0,
+        'curva_mejora': [],
+        'optimo_probado': False,
+        'tiempo_s': 0.0,
+        'arranques': arranques,
+        'procesos': procesos,
+    }
+
+    memoria = shared_memory.SharedMemory(create=True, size=d_real.nbytes)
+    try:
+        compartida = np.ndarray(d_real.shape, dtype=np.float64, buffer=memoria.buf)
+        np.copyto(compartida, np.where(np.isfinite(d_real), d_real, _DISTANCIA_PENALIZADA))
+        del compartida
+
+        mejor = None
+        with ProcessPoolExecutor(
+            max_workers=min(procesos, arranques),
+            initializer=_abrir_matriz_compartida,
+            initargs=(memoria.name, len(d_real)),
+        ) as pool:
+            futuros = [
+                pool.submit(_arranque, n, start_index, fin, semilla + k, segundos, vecinos)
+                for k in range(arranques)
+            ]
+            for futuro in as_completed(futuros):
+                ruta, costo, iteraciones, movimientos, _ = futuro.result()
+                resultado['iteraciones'] += iteraciones
+                resultado['movimientos'] += movimientos
+                if mejor is None or costo < mejor[1] - 1e-9:
+                    mejor = (ruta, costo)
+                    resultado['curva_mejora'].append(
+                        (round(time.monotonic() - inicio, 4), _costo_ruta(d_real, np.array(ruta)))
+                    )
+    except (OSError, BrokenProcessPool) as e:
+        print(f"Error en la búsqueda paralela, se resuelve en un solo proceso: {e}")
+        restante = max(max_seconds - (time.monotonic() - inicio), 0.1) if max_seconds else None
+        return resolver_ruta(distance_matrix, n, start_index, end_index,
+                             max_seconds=restante, metodo='heuristico', semilla=semilla, vecinos=vecinos)
+    finally:
+        memoria.close()
+        memoria.unlink()
+
+    resultado['ruta'] = mejor[0]
+    resultado['distancia_km'] = _costo_ruta(d_real, np.array(mejor[0]))
+    if resultado['distancia_km'] == float('inf'):
+        resultado['ruta'] = []
+    resultado['tiempo_s'] = round(time.monotonic() - inicio, 4)
+    return resultado
@@ -0,0 +1,907 @@
+# pipeline.py
+"""
+Proceso completo de optimización de una ruta: geocodificar origen/destino,
+obtener la matriz de distancias, resolver el TSP, guardar el orden y calcular
+consumo/costo. Lo usan la vista (modo sincrónico) y los trabajos en segundo plano.
+También la actualización incremental de la última ruta al agregar o borrar un punto.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import cache_soluciones
+from . import descomposicion
+from . import espacial
+from . import geometria
+from . import geocoding
+from . import metricas
+from . import optimizer
+from . import proveedores
+from . import seleccion_bodegas
+from .matriz import MatrizDistancias
+from .models import EstadoRuta, PuntoEntrega, RutaPlan, Vehiculo
+
+
+# Paradas más cercanas junto a las que se prueba insertar un punto nuevo
+CANDIDATOS_INSERCION = 8
+
+
+class OptimizacionError(Exception):
+    """Error de la optimización, con un mensaje para mostrar al usuario."""
+
+
+def _sin_progreso(fraccion, etapa):
+    pass
+
+
+def guardar_orden_optimo(puntos, route_indices):
+    """
+    Guarda el orden de visita de 'puntos' según 'route_indices' (índices de la
+    matriz: 0 = origen, 1..n = puntos, el último = destino).
+    """
+    guardar_rutas(puntos, [(None, route_indices)])
+
+
+def guardar_rutas(puntos, rutas):
+    """
+    Guarda el orden de visita (y el vehículo) de cada punto. 'rutas' es una
+    lista de (vehiculo o None, índices de la matriz de esa ruta).
+
+    Todo va en una transacción y en pocos UPDATE (bulk_update); los puntos que
+    no forman parte de ninguna ruta quedan sin orden ni vehículo.
+    """
+    num_puntos = len(puntos)
+    ahora = timezone.now()
+    for punto in puntos:
+        punto.orden_optimo = None
+        punto.vehiculo = None
+        punto.actualizado = ahora  # bulk_update no aplica auto_now
+    for vehiculo, route_indices in rutas:
+        for i, matrix_idx in enumerate(route_indices[1:-1]):  # saltamos start y end
+            if 1 <= matrix_idx <= num_puntos:
+                punto = puntos[matrix_idx - 1]  # lista empieza en 0
+                punto.orden_optimo = i + 1
+                punto.vehiculo = vehiculo
+
+    with transaction.atomic():
+        PuntoEntrega.objects.bulk_update(puntos, ['orden_optimo', 'vehiculo', 'actualizado'], batch_size=500)
+        PuntoEntrega.objects.exclude(id__in=[p.id for p in puntos]).update(
+            orden_optimo=None, vehiculo=None, actualizado=ahora
+        )
+
+
+def _listas_vecinos(origen_coords, puntos, destino_coords):
+    """
+    Vecinos más cercanos (en línea recta) de cada nodo de la matriz (origen,
+    puntos, destino), para restringir la búsqueda local de optimizer.
+    """
+    coordenadas = (
+        [(float(origen_coords['latitud']), float(origen_coords['longitud']))]
+        + [(float(p.latitud), float(p.longitud)) for p in puntos]
+        + [(float(destino_coords['latitud']), float(destino_coords['longitud']))]
+    )
+    return espacial.IndiceEspacial(coordenadas).listas_vecinos(optimizer.VECINOS_BUSQUEDA)
+
+
+def _segundos(hora):
+    """Segundos desde la medianoche de un datetime.time."""
+    return hora.hour * 3600 + hora.minute * 60 + hora.second
+
+
+def _tiempos_ventanas(puntos, hora_salida, num_nodos):
+    """
+    Ventanas horarias y tiempos de servicio, en segundos desde la salida,
+    indexados como la matriz (0 = origen, 1..n = puntos, luego el destino).
+    """
+    salida = _segundos(hora_salida)
+    inicio = np.zeros(num_nodos)
+    fin = np.full(num_nodos, np.inf)
+    servicio = np.zeros(num_nodos)
+    for i, punto in enumerate(puntos, start=1):
+        if punto.ventana_inicio is not None:
+            inicio[i] = _segundos(punto.ventana_inicio) - salida
+        if punto.ventana_fin is not None:
+            fin[i] = _segundos(punto.ventana_fin) - salida
+        servicio[i] = (punto.tiempo_servicio_min or 0) * 60
+    return {'inicio': inicio, 'fin': fin, 'servicio': servicio}
+
+
+def _horario(puntos, ruta, llegadas, atrasados, hora_salida, vehiculo=''):
+    """Filas para la tabla de horario estimado de una ruta."""
+    salida = datetime.combine(datetime.today(), hora_salida)
+    filas = []
+    for orden, (matrix_idx, llegada) in enumerate(zip(ruta[1:-1], llegadas[1:-1]), start=1):
+        punto = puntos[matrix_idx - 1]
+        ventana = ''
+        if punto.ventana_inicio or punto.ventana_fin:
+            desde = punto.ventana_inicio.strftime('%H:%M') if punto.ventana_inicio else ''
+            hasta = punto.ventana_fin.strftime('%H:%M') if punto.ventana_fin else ''
+            ventana = f"{desde}–{hasta}"
+        filas.append({
+            'vehiculo': vehiculo,
+            'orden': orden,
+            'punto': punto.nombre,
+            'llegada': (salida + timedelta(seconds=llegada)).strftime('%H:%M'),
+            'ventana': ventana,
+            'atrasado': matrix_idx in atrasados,
+        })
+    return filas
+
+
+def matriz_con_bodegas(bodegas, puntos, duraciones=None):
+    """
+    Geocodifica las bodegas (en un lote) y pide una sola matriz de distancias
+    con nodos = bodegas (0..k-1) y luego los puntos (k..k+n-1), para resolver
+    varios pares origen/destino con sus submatrices.
+    Devuelve (coordenadas por dirección, matriz, proveedor). Lanza OptimizacionError.
+    """
+    with metricas.span('geocodificacion', duraciones=duraciones):
+        coordenadas, errores = geocoding.geocodificar_lote(bodegas)
+    if errores:
+        direccion, mensaje = next(iter(errores.items()))
+        raise OptimizacionError(f"No se pudo geocodificar la bodega: {direccion} ({mensaje}).")
+
+    # las demás bodegas van como puntos sin guardar, antes de los puntos de entrega
+    otros = [
+        PuntoEntrega(latitud=coordenadas[b][0], longitud=coordenadas[b][1]) for b in bodegas[1:]
+    ] + list(puntos)
+    with metricas.span('matriz', duraciones=duraciones) as datos:
+        primera = {'latitud': coordenadas[bodegas[0]][0], 'longitud': coordenadas[bodegas[0]][1]}
+        matriz, proveedor = proveedores.matriz_distancias(otros, primera)
+        if matriz is None:
+            raise OptimizacionError(
+                'No se pudo obtener la matriz de distancias. '
+                'Revisa la clave API, la conexión o los proveedores configurados.'
+            )
+        datos['proveedor'] = proveedor
+        datos['nodos'] = len(otros) + 1
+    return coordenadas, matriz, proveedor
+
+
+def _elegir_bodegas(puntos, parametros, duraciones, progreso):
+    """
+    Elige el par origen/destino más barato entre parametros['pares_bodegas']
+    (ver seleccion_bodegas). Devuelve un dict con 'origen', 'destino', la
+    'matriz' y el 'resultado' del par elegido, el 'proveedor' y el 'resumen'
+    para el mapa. Lanza OptimizacionError.
+    """
+    if any(p.ventana_inicio or p.ventana_fin or p.tiempo_servicio_min for p in puntos):
+        raise OptimizacionError(
+            'La bodega más conveniente no se puede elegir con ventanas horarias '
+            'o tiempos de servicio; selecciona el origen y el destino.'
+        )
+    minimo_descomposicion = getattr(settings, 'DESCOMPOSICION_MIN_PUNTOS', 0)
+    if minimo_descomposicion and len(puntos) >= minimo_descomposicion:
+        raise OptimizacionError(
+            'Hay demasiados puntos para elegir la bodega automáticamente; '
+            'selecciona el origen y el destino.'
+        )
+
+    pares = list(dict.fromkeys(tuple(par) for par in parametros['pares_bodegas']))
+    bodegas = list(dict.fromkeys(direccion for par in pares for direccion in par))
+
+    progreso(0.05, 'Obteniendo distancias desde las bodegas candidatas')
+    _, matriz, proveedor = matriz_con_bodegas(bodegas, puntos, duraciones)
+
+    progreso(0.3, f'Eligiendo la bodega más conveniente entre {len(pares)} combinaciones')
+    indices = [(bodegas.index(o), bodegas.index(d)) for o, d in pares]
+    with metricas.span('seleccion_bodegas', duraciones=duraciones) as datos:
+        eleccion = seleccion_bodegas.elegir(
+            matriz, len(bodegas), indices, max_seconds=parametros['max_seconds']
+        )
+        if eleccion is None:
+            raise OptimizacionError(
+                'Ningún par de bodegas candidatas alcanza todos los puntos de entrega; '
+                'revisa las bodegas o los puntos.'
+            )
+        datos['pares'] = len(pares)
+        datos['resueltos'] = eleccion['resueltos']
+
+    origen, destino = pares[eleccion['par']]
+    return {
+        'origen': origen,
+        'destino': destino,
+        'matriz': eleccion['matriz'],
+        'resultado': eleccion['resultado'],
+        'proveedor': proveedor,
+        'resumen': {
+            'pares': sorted(
+                (
+                    {
+                        'origen': o,
+                        'destino': d,
+                        'cota_km': round(cota, 2),
+                        'distancia_km': round(km, 2) if km is not None else None,
+                    }
+                    for (o, d), cota, km in zip(pares, eleccion['cotas'], eleccion['distancias'])
+                ),
+                key=lambda f: f['cota_km'],
+            ),
+            'resueltos': eleccion['resueltos'],
+            'descartados': len(pares) - eleccion['resueltos'],
+        },
+    }
+
+
+def ejecutar_optimizacion(parametros, progreso=None):
+    """
+    Ejecuta la optimización completa.
+
+    'parametros': direccion_origen, direccion_destino, rendimiento_vehiculo,
+    precio_bencina, max_seconds, multi_vehiculo, hora_salida ("HH:MM") y zona
+    ([sur, oeste, norte, este] o None: solo los puntos de ese rectángulo)
+    (ver views.optimizar_ruta).
+    Con pares_bodegas (lista de [origen, destino] candidatos) se usa el par
+    más barato en vez de direccion_origen/direccion_destino.
+    Con multi_vehiculo los puntos se reparten entre los vehículos activos.
+    Si algún punto tiene ventana horaria o tiempo de servicio, se usa también
+    la matriz de duraciones para programar las llegadas.
+    'progreso(fraccion, etapa)' se llama al avanzar cada etapa.
+
+    Devuelve un dict con los valores que muestra el mapa (total_distance_km,
+    fuel_cost_clp, solver_info, coordenadas de origen/destino, ...).
+    Lanza OptimizacionError si algo falla.
+    """
+    progreso = progreso or _sin_progreso
+    duraciones = {}  # segundos por etapa (quedan en el plan)
+    direccion_origen = parametros['direccion_origen']
+    direccion_destino = parametros['direccion_destino']
+
+    puntos_entrega = PuntoEntrega.objects.all()
+    if parametros.get('zona'):
+        puntos_entrega = espacial.en_rectangulo(puntos_entrega, *parametros['zona'])
+    puntos_entrega_db = list(puntos_entrega)
+    if not puntos_entrega_db:
+        if parametros.get('zona'):
+            raise OptimizacionError('No hay puntos de entrega en la zona seleccionada.')
+        raise OptimizacionError('No hay puntos de entrega para optimizar.')
+
+    vehiculos_db = []
+    if parametros.get('multi_vehiculo'):
+        vehiculos_db = list(Vehiculo.objects.filter(activo=True).order_by('id'))
+        if not vehiculos_db:
+            raise OptimizacionError('No hay vehículos activos para repartir los puntos.')
+
+    if parametros.get('pares_bodegas') and vehiculos_db:
+        raise OptimizacionError('La bodega más conveniente solo se elige para un vehículo.')
+
+    # si ya se optimizó exactamente lo mismo, se reutiliza esa solución
+    # (con bodegas candidatas la clave usa los pares, antes de elegir ninguno)
+    clave, orden_canonico = cache_soluciones.clave_solicitud(parametros, puntos_entrega_db, vehiculos_db)
+    guardada = cache_soluciones.buscar(clave)
+    if guardada is not None:
+        metricas.incrementar('rutas_cache_aciertos_total', cache='soluciones')
+        progreso(0.9, 'Reutilizando una optimización idéntica')
+        puntos_canonicos = [puntos_entrega_db[i] for i in orden_canonico]
+        with metricas.span('guardado', duraciones=duraciones, cache=True):
+            resultado_mapa = _reutilizar_solucion(guardada, parametros, puntos_canonicos, vehiculos_db)
+        resultado_mapa['duraciones'] = _redondear(duraciones)
+        _guardar_plan(resultado_mapa, puntos_canonicos, guardada.rutas, guardada.matriz, clave)
+        progreso(1.0, 'Terminado')
+        return resultado_mapa
+    metricas.incrementar('rutas_cache_fallos_total', cache='soluciones')
+
+    # 2) BODEGA MÁS CONVENIENTE: con varias bodegas candidatas se elige primero
+    # el par origen/destino (esa ruta ya queda resuelta) y se sigue con él
+    eleccion = None
+    if parametros.get('pares_bodegas'):
+        eleccion = _elegir_bodegas(puntos_entrega_db, parametros, duraciones, progreso)
+        direccion_origen, direccion_destino = eleccion['origen'], eleccion['destino']
+
+    # 3) y 4) GEOCODIFICAR ORIGEN Y DESTINO
+    # (en un solo lote y con cache: las bodegas habituales no llaman a la API)
+    progreso(0.05, 'Geocodificando origen y destino')
+    with metricas.span('geocodificacion', duraciones=duraciones):
+        coordenadas, errores = geocoding.geocodificar_lote([direccion_origen, direccion_destino])
+
+        if direccion_origen in errores:
+            raise OptimizacionError(
+                f"No se pudo geocodificar la dirección de origen: {direccion_origen} "
+                f"({errores[direccion_origen]})."
+            )
+        if direccion_destino in errores:
+            raise OptimizacionError(
+                f"No se pudo geocodificar la dirección destino: {direccion_destino} "
+                f"({errores[direccion_destino]})."
+            )
+
+        lat_inicio, lng_inicio = coordenadas[direccion_origen]
+        punto_inicio_coords = {'latitud': lat_inicio, 'longitud': lng_inicio}
+        lat_dest, lng_dest = coordenadas[direccion_destino]
+        destino_coords = {'latitud': lat_dest, 'longitud': lng_dest}
+
+    usa_ventanas = any(
+        p.ventana_inicio or p.ventana_fin or p.tiempo_servicio_min for p in puntos_entrega_db
+    )
+
+    num_delivery_points = len(puntos_entrega_db)
+    minimo_descomposicion = getattr(settings, 'DESCOMPOSICION_MIN_PUNTOS', 0)
+    descomponer = (
+        not vehiculos_db and not usa_ventanas
+        and minimo_descomposicion and num_delivery_points >= minimo_descomposicion
+    )
+
+    if descomponer:
+        # 5) y 6) RUTAS MUY GRANDES: por zonas, con una matriz por zona y conectores
+        progreso(0.15, 'Agrupando puntos por zona y obteniendo sus distancias')
+        with metricas.span('descomposicion', duraciones=duraciones) as datos:
+            resultado, proveedor = descomposicion.resolver(
+                puntos_entrega_db,
+                punto_inicio_coords,
+                destino_coords,
+                getattr(settings, 'DESCOMPOSICION_TAMANO_GRUPO', 150),
+                max_seconds=parametros['max_seconds'],
+                procesos=getattr(settings, 'SOLVER_PROCESOS', 1),
+            )
+            if resultado is None:
+                raise OptimizacionError(
+                    'No se pudo obtener la matriz de distancias. '
+                    'Revisa la clave API, la conexión o los proveedores configurados.'
+                )
+            datos['proveedor'] = proveedor
+            datos['grupos'] = resultado['grupos']
+            datos['tramos'] = resultado['tramos_consultados']
+        matrices = None
+    elif eleccion is not None:
+        # 5) la matriz del par elegido ya está (submatriz de la de todas las bodegas)
+        matrices, proveedor = eleccion['matriz'], eleccion['proveedor']
+    else:
+        # 5) MATRIZ DE DISTANCIAS (y de duraciones si hay ventanas horarias)
+        progreso(0.15, 'Obteniendo matriz de distancias')
+        # (del primer proveedor configurado que responda: Google, grafo local o línea recta)
+        with metricas.span('matriz', duraciones=duraciones) as datos:
+            matrices, proveedor = proveedores.matriz_distancias(
+                puntos_entrega_db,
+                punto_inicio_coords,
+                dest_coords=destino_coords,
+                return_durations=usa_ventanas,
+            )
+
+            if matrices is None:
+                raise OptimizacionError(
+                    'No se pudo obtener la matriz de distancias. '
+                    'Revisa la clave API, la conexión o los proveedores configurados.'
+                )
+            datos['proveedor'] = proveedor
+            datos['nodos'] = len(puntos_entrega_db) + 2
+
+    end_index = num_delivery_points + 1 if destino_coords is not None else None
+
+    tiempos = None
+    hora_salida = datetime.strptime(parametros.get('hora_salida') or '08:00', '%H:%M').time()
+    if usa_ventanas:
+        distance_matrix, duration_matrix = matrices
+        tiempos = _tiempos_ventanas(puntos_entrega_db, hora_salida, len(distance_matrix))
+        tiempos['duraciones'] = duration_matrix
+    else:
+        distance_matrix = matrices
+
+    rendimiento_vehiculo = parametros['rendimiento_vehiculo']
+    precio_bencina = parametros['precio_bencina']
+
+    if vehiculos_db:
+        # 6) REPARTIR Y OPTIMIZAR LAS RUTAS DE LA FLOTA
+        progreso(0.4, 'Repartiendo puntos entre vehículos')
+        with metricas.span('optimizacion', duraciones=duraciones, metodo='cvrp') as datos:
+            flota = optimizer.solve_cvrp(
+                distance_matrix,
+                num_delivery_points,
+                [p.demanda_kg for p in puntos_entrega_db],
+                [
+                    {'capacidad': v.capacidad_kg, 'rendimiento_km_por_litro': v.rendimiento_km_por_litro}
+                    for v in vehiculos_db
+                ],
+                start_index=0,
+                end_index=end_index,
+                max_seconds=parametros['max_seconds'],
+                tiempos=tiempos,
+            )
+            if flota is None:
+                raise OptimizacionError(
+                    'No se pudo repartir los puntos entre los vehículos. '
+                    'Revisa las capacidades y las demandas.'
+                )
+            datos['vehiculos'] = len(flota['rutas'])
+
+        # 7) GUARDAR ORDEN Y VEHÍCULO DE CADA PUNTO
+        progreso(0.9, 'Guardando orden de visita')
+        with metricas.span('guardado', duraciones=duraciones):
+            guardar_rutas(
+                puntos_entrega_db,
+                [(vehiculos_db[r['vehiculo']], r['ruta']) for r in flota['rutas']],
+            )
+
+        # 8) CONSUMO Y COSTO (cada vehículo con su rendimiento)
+        total_distance_km = flota['distancia_km']
+        fuel_consumed = flota['litros']
+        rutas_vehiculos = [
+            {
+                'vehiculo': vehiculos_db[r['vehiculo']].nombre,
+                'vehiculo_id': vehiculos_db[r['vehiculo']].id,
+                'paradas': len(r['ruta']) - 2,
+                'carga_kg': round(r['carga'], 1),
+                'distancia_km': round(r['distancia_km'], 2),
+                'litros': round(r['litros'], 2),
+                'costo_clp': round(r['litros'] * precio_bencina, 0),
+            }
+            for r in flota['rutas']
+        ]
+        horario = []
+        if tiempos is not None:
+            for r in flota['rutas']:
+                horario.extend(_horario(
+                    puntos_entrega_db, r['ruta'], r['llegadas'], r['atrasados'],
+                    hora_salida, vehiculos_db[r['vehiculo']].nombre,
+                ))
+        solver_info = {
+            'metodo': 'cvrp',
+            'iteraciones': len(flota['rutas']),
+            'optimo_probado': False,
+            'tiempo_s': flota['tiempo_s'],
+            'curva_mejora': [],
+        }
+    else:
+        # 6) OPTIMIZAR RUTA (con tiempo máximo: se devuelve la mejor ruta encontrada)
+        if eleccion is not None:
+            resultado = eleccion['resultado']  # (resuelta al elegir la bodega)
+        elif not descomponer:  # (si se descompuso, ya está resuelta por zonas)
+            progreso(0.4, 'Optimizando ruta')
+            metodo_span = 'ventanas' if tiempos else 'tsp'
+            with metricas.span('optimizacion', duraciones=duraciones, metodo=metodo_span) as datos:
+                procesos = getattr(settings, 'SOLVER_PROCESOS', 1)
+                vecinos = None
+                if tiempos is None and num_delivery_points > optimizer.HELD_KARP_MAX_PUNTOS:
+                    # rutas grandes: la búsqueda local solo prueba movimientos hacia vecinos cercanos
+                    vecinos = _listas_vecinos(punto_inicio_coords, puntos_entrega_db, destino_coords)
+                if tiempos is None and procesos > 1 and num_delivery_points > optimizer.HELD_KARP_MAX_PUNTOS:
+                    # rutas grandes: varios arranques en paralelo, se queda la mejor
+                    resultado = optimizer.resolver_ruta_paralelo(
+                        distance_matrix,
+                        num_delivery_points,
+                        start_index=0,
+                        end_index=end_index,
+                        max_seconds=parametros['max_seconds'],
+                        procesos=procesos,
+                        arranques=getattr(settings, 'SOLVER_ARRANQUES', None),
+                        vecinos=vecinos,
+                    )
+                elif tiempos is None:
+                    resultado = optimizer.resolver_ruta(
+                        distance_matrix,
+                        num_delivery_points,
+                        start_index=0,
+                        end_index=end_index,
+                        max_seconds=parametros['max_seconds'],
+                        vecinos=vecinos,
+                    )
+                else:
+                    resultado = optimizer.solve_tsptw(
+                        distance_matrix,
+                        tiempos['duraciones'],
+                        num_delivery_points,
+                        tiempos['inicio'],
+                        tiempos['fin'],
+                        tiempos['servicio'],
+                        start_index=0,
+                        end_index=end_index,
+                        max_seconds=parametros['max_seconds'],
+                    )
+                datos['iteraciones'] = resultado['iteraciones']
+                datos['movimientos'] = resultado['movimientos']
+        optimized_route_indices = resultado['ruta']
+        total_distance_km = resultado['distancia_km']
+
+        if not optimized_route_indices:
+            raise OptimizacionError(
+                'No se pudo optimizar la ruta. Verifica los puntos o el algoritmo.'
+            )
+
+        # 7) GUARDAR ORDEN ÓPTIMO (índices 1..n en la matriz)
+        progreso(0.9, 'Guardando orden de visita')
+        with metricas.span('guardado', duraciones=duraciones):
+            guardar_orden_optimo(puntos_entrega_db, optimized_route_indices)
+
+        # 8) CONSUMO Y COSTO
+        # calcular litros consumidos usando el rendimiento
+        fuel_consumed = optimizer.calculate_fuel_cost(total_distance_km, rendimiento_vehiculo)
+        rutas_vehiculos = []
+        horario = []
+        if tiempos is not None:
+            horario = _horario(
+                puntos_entrega_db, optimized_route_indices, resultado['llegadas'],
+                resultado['atrasados'], hora_salida,
+            )
+        solver_info = {
+            'metodo': resultado['metodo'],
+            'iteraciones': resultado['iteraciones'],
+            'optimo_probado': resultado['optimo_probado'],
+            'tiempo_s': resultado['tiempo_s'],
+            'curva_mejora': resultado['curva_mejora'],
+        }
+
+    # 9) TRAZADO POR LAS CALLES (una vez por optimización; el mapa lo dibuja sin llamar a la API)
+    progreso(0.95, 'Trazando la ruta en el mapa')
+    if vehiculos_db:
+        rutas_trazado = [(vehiculos_db[r['vehiculo']].id, r['ruta']) for r in flota['rutas']]
+    else:
+        rutas_trazado = [(None, optimized_route_indices)]
+    with metricas.span('geometria', duraciones=duraciones) as datos:
+        geometria_rutas = _trazar(
+            (lat_inicio, lng_inicio), (lat_dest, lng_dest), puntos_entrega_db, rutas_trazado,
+        )
+        datos['fuente'] = geometria_rutas['fuente']
+
+    fuel_cost = fuel_consumed * precio_bencina
+    solver_info['proveedor_distancias'] = proveedor
+    metricas.incrementar('rutas_solver_iteraciones_total', solver_info['iteraciones'],
+                         metodo=solver_info['metodo'])
+    metricas.observar('rutas_solver_segundos', solver_info['tiempo_s'], metodo=solver_info['metodo'])
+
+    resultado_mapa = {
+        'total_distance_km': round(total_distance_km, 2),
+        'fuel_consumed_liters': round(fuel_consumed, 2),
+        'fuel_cost_clp': round(fuel_cost, 0),
+        'precio_bencina': precio_bencina,
+        'rendimiento_vehiculo': rendimiento_vehiculo,
+        'max_seconds': parametros['max_seconds'],
+        'solver_info': solver_info,
+        'rutas_vehiculos': rutas_vehiculos,
+        'horario': horario,
+        'geometria': geometria_rutas,
+        'hora_salida': hora_salida.strftime('%H:%M'),
+        'direccion_origen': direccion_origen,
+        'direccion_destino': direccion_destino,
+        'origen_lat': lat_inicio,
+        'origen_lng': lng_inicio,
+        'destino_lat': lat_dest,
+        'destino_lng': lng_dest,
+    }
+
+    # la ruta de un vehículo sin ventanas queda guardada para actualizarla
+    # de forma incremental al agregar o borrar un punto (si hay matriz completa)
+    estado = None
+    if vehiculos_db or tiempos is not None or distance_matrix is None:
+        EstadoRuta.objects.all().delete()
+    else:
+        estado = _guardar_estado(
+            [p.id for p in puntos_entrega_db], optimized_route_indices,
+            distance_matrix, resultado_mapa,
+        )
+
+    # (solo si respondió el proveedor preferido: una solución con distancias
+    # de respaldo no debe reutilizarse cuando el preferido vuelva)
+    if proveedor == proveedores.proveedor_preferido():
+        if vehiculos_db:
+            rutas = [
+                (vehiculos_db[r['vehiculo']].id, cache_soluciones.a_canonico(r['ruta'], orden_canonico))
+                for r in flota['rutas']
+            ]
+        else:
+            rutas = [(None, cache_soluciones.a_canonico(optimized_route_indices, orden_canonico))]
+        matriz = None
+        if not vehiculos_db and tiempos is None and distance_matrix is not None:
+            indices = cache_soluciones.indices_canonicos(orden_canonico)
+            matriz = MatrizDistancias(distance_matrix).submatriz(indices).a_bytes()
+        cache_soluciones.guardar(clave, rutas, resultado_mapa, matriz)
+    else:
+        clave = ''
+
+    # el plan guarda el resultado para volver a abrirlo sin resolver de nuevo
+    # (el resumen de la elección de bodega solo va en el plan: no en la ruta
+    # vigente ni en la cache, donde quedaría desactualizado)
+    if eleccion is not None:
+        resultado_mapa['seleccion_bodegas'] = eleccion['resumen']
+    resultado_mapa['duraciones'] = _redondear(duraciones)
+    _guardar_plan(
+        resultado_mapa, puntos_entrega_db, rutas_trazado, estado.matriz if estado else None, clave,
+    )
+
+    progreso(1.0, 'Terminado')
+    return resultado_mapa
+
+
+def _redondear(duraciones):
+    return {etapa: round(segundos, 4) for etapa, segundos in duraciones.items()}
+
+
+def _guardar_plan(resultado_mapa, puntos, rutas, matriz=None, clave=''):
+    """
+    Guarda el resultado como RutaPlan y agrega su id al dict ('plan_id').
+    'puntos' son los PuntoEntrega en el orden de la matriz, 'rutas' una lista
+    de (vehiculo_id o None, índices de la matriz) y 'matriz' los bytes .npy.
+    """
+    paradas = [
+        {
+            'id': puntos[i - 1].id,
+            'nombre': puntos[i - 1].nombre,
+            'direccion': puntos[i - 1].direccion,
+            'latitud': float(puntos[i - 1].latitud),
+            'longitud': float(puntos[i - 1].longitud),
+            'orden_optimo': orden,
+            'vehiculo_id': vehiculo_id,
+        }
+        for vehiculo_id, ruta in rutas
+        for orden, i in enumerate(ruta[1:-1], start=1)
+    ]
+    plan = RutaPlan.objects.create(
+        bodega=resultado_mapa['direccion_origen'],
+        destino=resultado_mapa['direccion_destino'],
+        paradas=paradas,
+        rutas=[[vehiculo_id, [int(i) for i in ruta]] for vehiculo_id, ruta in rutas],
+        matriz=matriz,
+        clave_solucion=clave,
+        distancia_km=resultado_mapa['total_distance_km'],
+        litros=resultado_mapa['fuel_consumed_liters'],
+        costo_clp=resultado_mapa['fuel_cost_clp'],
+        metodo=resultado_mapa['solver_info']['metodo'],
+        resultado=resultado_mapa,
+    )
+    resultado_mapa['plan_id'] = plan.id
+    return plan
+
+
+def _trazar(origen, destino, puntos, rutas, anteriores=None):
+    """
+    Trazado por las calles de cada ruta: 'rutas' es una lista de (vehiculo_id o
+    None, índices de la matriz). Devuelve {'fuente': ..., 'rutas': [{'vehiculo_id',
+    'polilinea', 'tramos'}, ...]} (ver geometria.trazar_rutas). 'anteriores' son
+    las rutas de un trazado previo, para pedir solo los tramos que cambiaron.
+    """
+    paradas = [
+        [origen] + [(puntos[i - 1].latitud, puntos[i - 1].longitud) for i in ruta[1:-1]] + [destino]
+        for _, ruta in rutas
+    ]
+    trazados, fuente = geometria.trazar_rutas(paradas, anteriores=anteriores)
+    return {
+        'fuente': fuente,
+        'rutas': [
+            {'vehiculo_id': vehiculo_id, **trazado}
+            for (vehiculo_id, _), trazado in zip(rutas, trazados)
+        ],
+    }
+
+
+def _reutilizar_solucion(guardada, parametros, puntos_canonicos, vehiculos_db):
+    """
+    Aplica una solución de SolucionCache a los puntos actuales ('puntos_canonicos':
+    en el orden canónico de la clave) y recalcula consumo y costo con el precio
+    y el rendimiento de esta solicitud. Devuelve el dict para el mapa.
+    """
+    vehiculos_por_id = {v.id: v for v in vehiculos_db}
+    guardar_rutas(
+        puntos_canonicos,
+        [(vehiculos_por_id.get(vehiculo_id), ruta) for vehiculo_id, ruta in guardada.rutas],
+    )
+
+    precio_bencina = parametros['precio_bencina']
+    rendimiento_vehiculo = parametros['rendimiento_vehiculo']
+    resultado_mapa = dict(guardada.resultado)
+    if resultado_mapa['rutas_vehiculos']:
+        # cada vehículo tiene su propio rendimiento (parte de la clave): solo cambia el precio
+        fuel_consumed = resultado_mapa['fuel_consumed_liters']
+        resultado_mapa['rutas_vehiculos'] = [
+            {**r, 'costo_clp': round(r['litros'] * precio_bencina, 0)}
+            for r in resultado_mapa['rutas_vehiculos']
+        ]
+    else:
+        fuel_consumed = optimizer.calculate_fuel_cost(
+            resultado_mapa['total_distance_km'], rendimiento_vehiculo
+        )
+    resultado_mapa.update({
+        'fuel_consumed_liters': round(fuel_consumed, 2),
+        'fuel_cost_clp': round(fuel_consumed * precio_bencina, 0),
+        'precio_bencina': precio_bencina,
+        'rendimiento_vehiculo': rendimiento_vehiculo,
+        'solver_info': {**resultado_mapa['solver_info'], 'desde_cache': True},
+    })
+
+    if guardada.matriz:
+        _guardar_estado(
+            [p.id for p in puntos_canonicos], guardada.rutas[0][1],
+            MatrizDistancias.desde_bytes(guardada.matriz), resultado_mapa,
+        )
+    else:
+        EstadoRuta.objects.all().delete()
+    return resultado_mapa
+
+
+def _guardar_estado(ids_puntos, ruta, distance_matrix, resultado_mapa, estado=None):
+    """Guarda (o reemplaza) la última ruta con su matriz (float32, formato .npy)."""
+    matriz_bytes = MatrizDistancias(distance_matrix).a_bytes()
+    with transaction.atomic():
+        if estado is None:
+            EstadoRuta.objects.all().delete()
+            estado = EstadoRuta()
+        estado.puntos = ids_puntos
+        estado.ruta = [int(i) for i in ruta]
+        estado.matriz = matriz_bytes
+        estado.resultado = resultado_mapa
+        estado.save()
+    return estado
+
+
+def _cargar_matriz(estado):
+    return MatrizDistancias.desde_bytes(estado.matriz)
+
+
+def _guardar_cambios_orden(ids_puntos, ruta):
+    """
+    Guarda el nuevo orden de visita escribiendo solo lo que cambió: los puntos
+    que se corrieron en la misma cantidad de posiciones (p. ej. todos los que
+    van después de una inserción) se actualizan con un solo UPDATE.
+    """
+    orden_actual = dict(
+        PuntoEntrega.objects.filter(id__in=ids_puntos).values_list('id', 'orden_optimo')
+    )
+    por_desplazamiento = {}
+    nuevos = {}
+    for orden, matrix_idx in enumerate(ruta[1:-1], start=1):
+        punto_id = ids_puntos[matrix_idx - 1]
+        anterior = orden_actual.get(punto_id)
+        if anterior is None:
+            nuevos[punto_id] = orden
+        elif anterior != orden:
+            por_desplazamiento.setdefault(orden - anterior, []).append(punto_id)
+
+    ahora = timezone.now()
+    with transaction.atomic():
+        for desplazamiento, ids in por_desplazamiento.items():
+            PuntoEntrega.objects.filter(id__in=ids).update(
+                orden_optimo=F('orden_optimo') + desplazamiento, actualizado=ahora
+            )
+        for punto_id, orden in nuevos.items():
+            PuntoEntrega.objects.filter(id=punto_id).update(orden_optimo=orden, actualizado=ahora)
+
+
+def _actualizar_estado(estado, ids_puntos, resultado, distance_matrix, duraciones):
+    """
+    Guarda el orden de visita de una ruta actualizada de forma incremental,
+    recalcula distancia, consumo, costo y el trazado, y la guarda como un plan
+    nuevo. Devuelve el dict para el mapa.
+    """
+    # (dentro de la función: la duración tiene que quedar antes de guardar el plan)
+    with metricas.span('guardado', duraciones=duraciones, incremental=True):
+        _guardar_cambios_orden(ids_puntos, resultado['ruta'])
+
+    resultado_mapa = dict(estado.resultado)
+    puntos_por_id = PuntoEntrega.objects.in_bulk(ids_puntos)
+    with metricas.span('geometria', duraciones=duraciones, incremental=True):
+        resultado_mapa['geometria'] = _trazar(
+            (resultado_mapa['origen_lat'], resultado_mapa['origen_lng']),
+            (resultado_mapa['destino_lat'], resultado_mapa['destino_lng']),
+            [puntos_por_id[i] for i in ids_puntos],
+            [(None, resultado['ruta'])],
+            # solo se piden los tramos alrededor de lo que cambió
+            anteriores=(estado.resultado.get('geometria') or {}).get('rutas'),
+        )
+    total_distance_km = resultado['distancia_km']
+    fuel_consumed = optimizer.calculate_fuel_cost(
+        total_distance_km, resultado_mapa['rendimiento_vehiculo']
+    )
+    resultado_mapa.update({
+        'total_distance_km': round(total_distance_km, 2),
+        'fuel_consumed_liters': round(fuel_consumed, 2),
+        'fuel_cost_clp': round(fuel_consumed * resultado_mapa['precio_bencina'], 0),
+        'solver_info': {
+            'metodo': resultado['metodo'],
+            'iteraciones': resultado['iteraciones'],
+            'optimo_probado': resultado['optimo_probado'],
+            'tiempo_s': resultado['tiempo_s'],
+            'curva_mejora': resultado['curva_mejora'],
+            'proveedor_distancias': estado.resultado['solver_info'].get('proveedor_distancias'),
+        },
+        'duraciones': _redondear(duraciones),
+    })
+    _guardar_estado(ids_puntos, resultado['ruta'], distance_matrix, resultado_mapa, estado)
+    _guardar_plan(
+        resultado_mapa, [puntos_por_id[i] for i in ids_puntos], [(None, resultado['ruta'])], estado.matriz,
+    )
+    return resultado_mapa
+
+
+def _estado_vigente(ids_esperados):
+    """
+    La última ruta guardada, si corresponde exactamente a 'ids_esperados'
+    (si no, se descarta: alguien cambió los puntos por otro camino).
+    """
+    estado = EstadoRuta.objects.first()
+    if estado is None:
+        return None
+    if set(estado.puntos) != set(ids_esperados):
+        estado.delete()
+        return None
+    return estado
+
+
+def reoptimizar_agregado(punto):
+    """
+    Agrega 'punto' (recién creado) a la última ruta optimizada: pide solo su
+    fila y columna de distancias, lo inserta donde menos alarga la ruta y
+    reoptimiza el vecindario. Devuelve el dict para el mapa, o None si no hay
+    una ruta vigente que actualizar (o el punto tiene ventana horaria).
+    """
+    if not getattr(settings, 'REOPTIMIZACION_INCREMENTAL', True):
+        return None
+    duraciones = {}
+    ids_actuales = list(PuntoEntrega.objects.exclude(id=punto.id).values_list('id', flat=True))
+    estado = _estado_vigente(ids_actuales)
+    if estado is None:
+        return None
+    if punto.ventana_inicio or punto.ventana_fin or punto.tiempo_servicio_min:
+        estado.delete()
+        return None
+
+    d = _cargar_matriz(estado)
+    n = len(estado.puntos)
+    puntos_por_id = PuntoEntrega.objects.in_bulk(estado.puntos)
+    r = estado.resultado
+    otros = (
+        [{'latitud': r['origen_lat'], 'longitud': r['origen_lng']}]
+        + [
+            {'latitud': puntos_por_id[i].latitud, 'longitud': puntos_por_id[i].longitud}
+            for i in estado.puntos
+        ]
+        + [{'latitud': r['destino_lat'], 'longitud': r['destino_lng']}]
+    )
+    with metricas.span('matriz', duraciones=duraciones, incremental=True) as datos:
+        distancias, proveedor = proveedores.distancias_punto(
+            {'latitud': punto.latitud, 'longitud': punto.longitud},
+            otros,
+        )
+        datos['proveedor'] = proveedor
+        datos['nodos'] = len(otros)
+    # si respondió otro proveedor, la fila nueva no sería comparable con la matriz guardada
+    if distancias is None or proveedor != r['solver_info'].get('proveedor_distancias'):
+        estado.delete()
+        return None
+    desde_punto, hacia_punto = distancias
+
+    # el punto nuevo queda en el índice n + 1 y el destino pasa a n + 2
+    nuevo = n + 1
+    d = np.insert(d, nuevo, hacia_punto, axis=1)
+    d = np.insert(d, nuevo, desde_punto[:nuevo] + [0.0] + desde_punto[nuevo:], axis=0)
+    ruta = [i + 1 if i >= nuevo else i for i in estado.ruta]
+
+    # solo se prueban los tramos junto a las paradas más cercanas (en línea recta)
+    indice = espacial.IndiceEspacial([(float(c['latitud']), float(c['longitud'])) for c in otros])
+    cercanos = indice.k_cercanos(float(punto.latitud), float(punto.longitud), CANDIDATOS_INSERCION)
+    candidatos = [i + 1 if i >= nuevo else int(i) for i in cercanos]
+
+    with metricas.span('optimizacion', duraciones=duraciones, metodo='incremental') as datos:
+        resultado = optimizer.insertar_punto(d, ruta, nuevo, candidatos=candidatos)
+        datos['movimientos'] = resultado['movimientos']
+    return _actualizar_estado(estado, estado.puntos + [punto.id], resultado, d, duraciones)
+
+
+def reoptimizar_quitado(punto_id):
+    """
+    Saca de la última ruta optimizada el punto 'punto_id' (ya borrado) y repara
+    el vecindario. Devuelve el dict para el mapa, o None si no hay una ruta
+    vigente que actualizar.
+    """
+    if not getattr(settings, 'REOPTIMIZACION_INCREMENTAL', True):
+        return None
+    duraciones = {}
+    ids_actuales = list(PuntoEntrega.objects.values_list('id', flat=True))
+    estado = _estado_vigente(ids_actuales + [punto_id])
+    if estado is None:
+        return None
+    if len(estado.puntos) == 1:
+        estado.delete()
+        return None
+
+    d = _cargar_matriz(estado)
+    nodo = estado.puntos.index(punto_id) + 1
+    with metricas.span('optimizacion', duraciones=duraciones, metodo='incremental') as datos:
+        resultado = optimizer.quitar_punto(d, estado.ruta, nodo)
+        datos['movimientos'] = resultado['movimientos']
+
+    d = np.delete(np.delete(d, nodo, axis=0), nodo, axis=1)
+    resultado['ruta'] = [i - 1 if i > nodo else i for i in resultado['ruta']]
+    ids_puntos = [i for i in estado.puntos if i != punto_id]
+    return _actualizar_estado(estado, ids_puntos, resultado, d, duraciones)
@@ -0,0 +1,384 @@
+# proveedores.py
+"""
+Proveedores de la matriz de distancias (y duraciones) entre origen, puntos de
+entrega y destino:
+
+- 'google': Distance Matrix API (optimizer.get_distance_matrix, con cache).
+- 'grafo_local': caminos más cortos (Dijkstra con corte temprano, sin
+  contracción del grafo) sobre un grafo vial precalculado en archivos .npy que
+  se abren con memory-map (ver construir_grafo).
+- 'haversine': distancia en línea recta multiplicada por un factor de desvío,
+  sin red. Sirve de respaldo y para probar el optimizador sin conexión.
+
+settings.DISTANCIA_PROVEEDORES da el orden de preferencia: si un proveedor no
+está disponible o falla, se usa el siguiente.
+"""
+
+import heapq
+import os
+
+import numpy as np
+from django.conf import settings
+
+from . import espacial, optimizer
+from .matriz import MatrizDistancias
+
+# Archivos del grafo vial (en formato CSR: las aristas que salen del nodo i son
+# indices[indptr[i]:indptr[i + 1]], con su largo en km.npy y, si existe, su
+# duración en segundos.npy). Los *_inverso son el grafo con las aristas dadas
+# vuelta (las que llegan a cada nodo), para el Dijkstra hacia un punto; si no
+# están se calculan en memoria la primera vez que se necesitan.
+ARCHIVOS_GRAFO = ('nodos', 'indptr', 'indices', 'km', 'segundos')
+ARCHIVOS_INVERSO = ('indptr_inverso', 'indices_inverso', 'km_inverso', 'segundos_inverso')
+
+# Nodos más cercanos en la grilla entre los que se elige (por haversine) el
+# nodo al que se ajusta cada coordenada
+CANDIDATOS_AJUSTE = 4
+
+
+def latlng_radianes(coordenadas):
+    """Array (n, 2) en radianes a partir de dicts con 'latitud'/'longitud'."""
+    return np.radians(np.array(
+        [[float(c['latitud']), float(c['longitud'])] for c in coordenadas],
+        dtype=float,
+    ).reshape(-1, 2))
+
+
+def distancias_haversine(origenes, destinos):
+    """
+    Distancias en línea recta (km) entre cada origen y cada destino, arrays
+    (n, 2) y (m, 2) de lat/lng en radianes. Devuelve un array (n, m).
+    """
+    lat1, lng1 = origenes[:, :1], origenes[:, 1:]
+    lat2, lng2 = destinos[:, 0], destinos[:, 1]
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * espacial.RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class ProveedorDistancias:
+    """
+    Interfaz común. 'matriz' tiene el mismo contrato que
+    optimizer.get_distance_matrix (sin la clave API; devuelve MatrizDistancias)
+    y 'distancias_punto' el de optimizer.get_distancias_punto. Ambos devuelven
+    None si fallan.
+    """
+    nombre = ''
+
+    def disponible(self):
+        return True
+
+    def matriz(self, points, origin_coords, dest_coords=None, return_durations=False):
+        coordenadas = [origin_coords] + [
+            {'latitud': p.latitud, 'longitud': p.longitud} for p in points
+        ]
+        if dest_coords is not None:
+            coordenadas.append(dest_coords)
+        resultado = self._matriz_coordenadas(coordenadas)
+        if resultado is None:
+            return None
+        distancias, duraciones = resultado
+        if return_durations:
+            return MatrizDistancias(distancias), MatrizDistancias(duraciones)
+        return MatrizDistancias(distancias)
+
+    def distancias_punto(self, punto_coords, otros_coords):
+        resultado = self._matriz_coordenadas([punto_coords] + list(otros_coords))
+        if resultado is None:
+            return None
+        distancias = resultado[0]
+        return distancias[0, 1:].tolist(), distancias[1:, 0].tolist()
+
+    def _matriz_coordenadas(self, coordenadas):
+        """(distancias_km, duraciones_s) como arrays n x n, o None."""
+        raise NotImplementedError
+
+
+class ProveedorGoogle(ProveedorDistancias):
+    """Distance Matrix API de Google (con la cache de tramos de cache_distancias)."""
+    nombre = 'google'
+
+    def __init__(self, api_key=None, url=None):
+        self.api_key = api_key if api_key is not None else settings.GOOGLE_MAPS_API_KEY
+        self.url = url
+
+    def disponible(self):
+        return bool(self.api_key)
+
+    def matriz(self, points, origin_coords, dest_coords=None, return_durations=False):
+        return optimizer.get_distance_matrix(
+            points, origin_coords, self.api_key,
+            dest_coords=dest_coords, url=self.url, return_durations=return_durations,
+        )
+
+    def distancias_punto(self, punto_coords, otros_coords):
+        return optimizer.get_distancias_punto(punto_coords, otros_coords, self.api_key, url=self.url)
+
+
+class ProveedorHaversine(ProveedorDistancias):
+    """
+    Línea recta por un factor de desvío (las calles no van en línea recta) y
+    duración a una velocidad promedio fija. Todo vectorizado con NumPy.
+    """
+    nombre = 'haversine'
+
+    def __init__(self, factor_desvio=None, velocidad_kmh=None):
+        self.factor_desvio = factor_desvio or getattr(settings, 'DISTANCIA_FACTOR_DESVIO', 1.3)
+        self.velocidad_kmh = velocidad_kmh or getattr(settings, 'DISTANCIA_VELOCIDAD_KMH', 30)
+
+    def _matriz_coordenadas(self, coordenadas):
+        latlng = latlng_radianes(coordenadas)
+        distancias = distancias_haversine(latlng, latlng) * self.factor_desvio
+        return distancias, distancias / self.velocidad_kmh * 3600
+
+
+class GrafoVial:
+    """Grafo vial en formato CSR, leído con memory-map (no se carga entero en memoria)."""
+
+    def __init__(self, directorio):
+        def cargar(nombre):
+            ruta = os.path.join(directorio, f'{nombre}.npy')
+            return np.load(ruta, mmap_mode='r') if os.path.exists(ruta) else None
+
+        self.nodos, self.indptr, self.indices, self.km, self.segundos = (
+            cargar(nombre) for nombre in ARCHIVOS_GRAFO
+        )
+        if any(a is None for a in (self.nodos, self.indptr, self.indices, self.km)):
+            raise FileNotFoundError(f"Faltan archivos del grafo vial en {directorio}")
+        self.nodos_rad = np.radians(np.asarray(self.nodos, dtype=float))
+        self._inverso = tuple(cargar(nombre) for nombre in ARCHIVOS_INVERSO)
+        if any(a is None for a in self._inverso[:3]):
+            self._inverso = None
+        self._indice = None
+
+    def inverso(self):
+        """(indptr, indices, km, segundos) del grafo con las aristas dadas vuelta."""
+        if self._inverso is None:
+            self._inverso = _transponer(self.indptr, self.indices, self.km, self.segundos)
+        return self._inverso
+
+    def nodo_mas_cercano(self, latlng):
+        """
+        Para cada coordenada (radianes), (índice del nodo más cercano, distancia km).
+        Cada consulta revisa solo las celdas vecinas de una grilla sobre los
+        nodos (espacial.IndiceEspacial, que se arma la primera vez) y elige por
+        haversine entre los CANDIDATOS_AJUSTE más cercanos de la grilla.
+        """
+        if self._indice is None:
+            self._indice = espacial.IndiceEspacial(np.degrees(self.nodos_rad))
+        nodos, distancias = [], []
+        for fila in latlng:
+            latitud, longitud = np.degrees(fila)
+            cercanos = self._indice.k_cercanos(latitud, longitud, CANDIDATOS_AJUSTE)
+            d = distancias_haversine(fila[None, :], self.nodos_rad[cercanos])[0]
+            k = int(np.argmin(d))
+            nodos.append(int(cercanos[k]))
+            distancias.append(float(d[k]))
+        return nodos, distancias
+
+    def dijkstra(self, fuente, objetivos, segundos_por_km, inverso=False):
+        """
+        Camino más corto (en km) desde 'fuente'; se detiene en cuanto llegó a
+        todos los 'objetivos'. Devuelve ({nodo: km}, {nodo: segundos}) del camino.
+        Con inverso=True son los caminos desde cada nodo hacia 'fuente'.
+        """
+        if inverso:
+            indptr, indices, km_aristas, segundos_aristas = self.inverso()
+        else:
+            indptr, indices, km_aristas, segundos_aristas = self.indptr, self.indices, self.km, self.segundos
+        km = {fuente: 0.0}
+        segundos = {fuente: 0.0}
+        pendientes = set(objetivos) - {fuente}
+        visitados = set()
+        cola = [(0.0, fuente)]
+        while cola and pendientes:
+            km_u, u = heapq.heappop(cola)
+            if u in visitados:
+                continue
+            visitados.add(u)
+            pendientes.discard(u)
+            ini, fin = int(indptr[u]), int(indptr[u + 1])
+            largos = km_aristas[ini:fin].tolist()
+            if segundos_aristas is not None:
+                tiempos = segundos_aristas[ini:fin].tolist()
+            else:
+                tiempos = [largo * segundos_por_km for largo in largos]
+            for v, largo, tiempo in zip(indices[ini:fin].tolist(), largos, tiempos):
+                km_v = km_u + largo
+                if km_v < km.get(v, float('inf')):
+                    km[v] = km_v
+                    segundos[v] = segundos[u] + tiempo
+                    heapq.heappush(cola, (km_v, v))
+        return km, segundos
+
+
+def _transponer(indptr, indices, km, segundos=None):
+    """CSR con las aristas dadas vuelta: (indptr, indices, km, segundos)."""
+    indptr = np.asarray(indptr)
+    origenes = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    destinos = np.asarray(indices)
+    orden = np.argsort(destinos, kind='stable')
+    indptr_inverso = np.zeros_like(indptr)
+    np.cumsum(np.bincount(destinos, minlength=len(indptr) - 1), out=indptr_inverso[1:])
+    return (
+        indptr_inverso,
+        origenes[orden],
+        np.asarray(km)[orden],
+        np.asarray(segundos)[orden] if segundos is not None else None,
+    )
+
+
+_grafos = {}
+
+
+def _grafo(directorio):
+    if directorio not in _grafos:
+        _grafos[directorio] = GrafoVial(directorio)
+    return _grafos[directorio]
+
+
+class ProveedorGrafoLocal(ProveedorDistancias):
+    """
+    Distancias por calles usando un grafo vial local (settings.GRAFO_VIAL_DIR).
+    Cada coordenada se ajusta a su nodo más cercano (sumando ese tramo en línea
+    recta) y desde cada nodo se corre un Dijkstra hasta los demás. Para un
+    punto nuevo bastan dos: uno desde él y otro (sobre el grafo inverso) hacia él.
+    """
+    nombre = 'grafo_local'
+
+    def __init__(self, directorio=None, velocidad_kmh=None):
+        self.directorio = directorio if directorio is not None else getattr(settings, 'GRAFO_VIAL_DIR', '')
+        self.velocidad_kmh = velocidad_kmh or getattr(settings, 'DISTANCIA_VELOCIDAD_KMH', 30)
+
+    def disponible(self):
+        return bool(self.directorio) and os.path.isdir(self.directorio)
+
+    def _abrir(self):
+        try:
+            return _grafo(self.directorio)
+        except (OSError, ValueError) as e:
+            print(f"No se pudo abrir el grafo vial: {e}")
+            return None
+
+    def distancias_punto(self, punto_coords, otros_coords):
+        grafo = self._abrir()
+        if grafo is None:
+            return None
+        segundos_por_km = 3600 / self.velocidad_kmh
+        nodos, ajustes = grafo.nodo_mas_cercano(latlng_radianes([punto_coords] + list(otros_coords)))
+        fuente, otros = nodos[0], nodos[1:]
+        ida, _ = grafo.dijkstra(fuente, otros, segundos_por_km)
+        vuelta, _ = grafo.dijkstra(fuente, otros, segundos_por_km, inverso=True)
+        desde_punto = [ida.get(nodo, np.inf) + ajustes[0] + a for nodo, a in zip(otros, ajustes[1:])]
+        hacia_punto = [vuelta.get(nodo, np.inf) + ajustes[0] + a for nodo, a in zip(otros, ajustes[1:])]
+        return desde_punto, hacia_punto
+
+    def _matriz_coordenadas(self, coordenadas):
+        grafo = self._abrir()
+        if grafo is None:
+            return None
+
+        segundos_por_km = 3600 / self.velocidad_kmh
+        nodos, ajustes = grafo.nodo_mas_cercano(latlng_radianes(coordenadas))
+        ajustes = np.array(ajustes)
+        n = len(coordenadas)
+
+        por_nodo = {}
+        for nodo in set(nodos):
+            por_nodo[nodo] = grafo.dijkstra(nodo, nodos, segundos_por_km)
+
+        distancias = np.full((n, n), np.inf)
+        duraciones = np.full((n, n), np.inf)
+        for i, nodo_i in enumerate(nodos):
+            km, segundos = por_nodo[nodo_i]
+            for j, nodo_j in enumerate(nodos):
+                if nodo_j in km:
+                    distancias[i, j] = km[nodo_j]
+                    duraciones[i, j] = segundos[nodo_j]
+
+        # tramo en línea recta entre cada coordenada y su nodo, a la salida y a la llegada
+        ajuste = ajustes[:, None] + ajustes[None, :]
+        distancias += ajuste
+        duraciones += ajuste * segundos_por_km
+        np.fill_diagonal(distancias, 0.0)
+        np.fill_diagonal(duraciones, 0.0)
+        return distancias, duraciones
+
+
+def construir_grafo(directorio, nodos, origenes, destinos, km, segundos=None):
+    """
+    Escribe un grafo vial en 'directorio' en el formato que lee ProveedorGrafoLocal.
+    'nodos' son pares (lat, lng); cada arista dirigida va de origenes[k] a
+    destinos[k] y mide km[k] (y tarda segundos[k], opcional).
+    Las calles de doble sentido deben venir como dos aristas.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    origenes = np.asarray(origenes, dtype=np.int64)
+    orden = np.argsort(origenes, kind='stable')
+    indptr = np.zeros(len(nodos) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(origenes, minlength=len(nodos)), out=indptr[1:])
+
+    arrays = {
+        'nodos': np.asarray(nodos, dtype=np.float64),
+        'indptr': indptr,
+        'indices': np.asarray(destinos, dtype=np.int64)[orden],
+        'km': np.asarray(km, dtype=np.float64)[orden],
+    }
+    if segundos is not None:
+        arrays['segundos'] = np.asarray(segundos, dtype=np.float64)[orden]
+    inverso = _transponer(indptr, arrays['indices'], arrays['km'], arrays.get('segundos'))
+    for nombre, array in zip(ARCHIVOS_INVERSO, inverso):
+        if array is not None:
+            arrays[nombre] = array
+    for nombre, array in arrays.items():
+        np.save(os.path.join(directorio, f'{nombre}.npy'), array)
+
+
+PROVEEDORES = {
+    'google': ProveedorGoogle,
+    'grafo_local': ProveedorGrafoLocal,
+    'haversine': ProveedorHaversine,
+}
+
+
+def obtener_proveedores():
+    """Instancias de los proveedores configurados, en orden de preferencia."""
+    nombres = getattr(settings, 'DISTANCIA_PROVEEDORES', ['google', 'haversine'])
+    return [PROVEEDORES[nombre]() for nombre in nombres if nombre in PROVEEDORES]
+
+
+def proveedor_preferido():
+    """Nombre del primer proveedor configurado que está disponible (o None)."""
+    return next((p.nombre for p in obtener_proveedores() if p.disponible()), None)
+
+
+def _con_respaldo(llamar):
+    for proveedor in obtener_proveedores():
+        if not proveedor.disponible():
+            continue
+        resultado = llamar(proveedor)
+        if resultado is not None:
+            return resultado, proveedor.nombre
+        print(f"El proveedor de distancias '{proveedor.nombre}' falló; se prueba el siguiente.")
+    return None, None
+
+
+def matriz_distancias(points, origin_coords, dest_coords=None, return_durations=False):
+    """
+    Como optimizer.get_distance_matrix, pero con el primer proveedor configurado
+    que responda. Devuelve (matriz o (distancias, duraciones), nombre del
+    proveedor), o (None, None) si ninguno pudo.
+    """
+    return _con_respaldo(lambda proveedor: proveedor.matriz(
+        points, origin_coords, dest_coords=dest_coords, return_durations=return_durations,
+    ))
+
+
+def distancias_punto(punto_coords, otros_coords):
+    """
+    Como optimizer.get_distancias_punto, con respaldo entre proveedores.
+    Devuelve ((desde_punto, hacia_punto), nombre del proveedor) o (None, None).
+    """
+    return _con_respaldo(lambda proveedor: proveedor.distancias_punto(punto_coords, otros_coords))
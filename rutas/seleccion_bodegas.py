@@ -0,0 +1,119 @@
+# seleccion_bodegas.py
+"""
+Elección automática de la bodega de origen y de destino: entre varios pares
+(origen, destino) candidatos, el que da la ruta más corta por los mismos puntos.
+
+Todos los pares comparten una matriz con los nodos bodegas (0..k-1) y luego los
+puntos (k..k+n-1). Para cada par se calcula primero una cota inferior barata de
+la ruta origen -> todos los puntos -> destino (la mayor de tres):
+
+- árbol de expansión mínima de los puntos (con la distancia más corta de cada
+  par de puntos, en cualquier sentido) + la salida más corta desde el origen +
+  la llegada más corta al destino: los tramos entre puntos de la ruta son un
+  camino que los une a todos;
+- salidas (relajación de asignación): cada punto sale una vez, hacia otro
+  punto o hacia el destino, y el origen sale una vez hacia algún punto;
+- llegadas: lo mismo con el tramo que llega a cada punto.
+
+Los pares se resuelven por completo (optimizer.resolver_ruta) de la menor cota
+a la mayor, y se descartan sin resolver los que tienen una cota que no es
+menor que la mejor distancia ya encontrada.
+"""
+
+import time
+
+import numpy as np
+
+from . import optimizer
+
+
+def arbol_minimo(distancias):
+    """Largo del árbol de expansión mínima (Prim, O(n²)) de una matriz simétrica."""
+    n = len(distancias)
+    if n <= 1:
+        return 0.0
+    en_arbol = np.zeros(n, dtype=bool)
+    en_arbol[0] = True
+    costo = np.array(distancias[0], dtype=float)
+    total = 0.0
+    for _ in range(n - 1):
+        costo[en_arbol] = np.inf
+        j = int(np.argmin(costo))
+        total += costo[j]
+        en_arbol[j] = True
+        costo = np.minimum(costo, distancias[j])
+    return float(total)
+
+
+def cotas_inferiores(matriz, num_bodegas, pares):
+    """
+    Cota inferior del largo de la ruta origen -> todos los puntos -> destino de
+    cada par. 'matriz': nodos bodegas (0..k-1) y luego puntos; 'pares': lista
+    de (índice del origen, índice del destino) entre 0 y k-1. Devuelve un array.
+    """
+    d = np.asarray(matriz, dtype=float)
+    k = num_bodegas
+    entre_puntos = d[k:, k:].copy()
+    np.fill_diagonal(entre_puntos, np.inf)
+    origenes = np.array([o for o, _ in pares], dtype=np.int64)
+    destinos = np.array([t for _, t in pares], dtype=np.int64)
+
+    salida = d[origenes, k:].min(axis=1)   # origen -> primer punto
+    llegada = d[k:, destinos].min(axis=0)  # último punto -> destino
+
+    simetrica = np.minimum(entre_puntos, entre_puntos.T)
+    np.fill_diagonal(simetrica, 0.0)
+    por_arbol = salida + arbol_minimo(simetrica) + llegada
+
+    # cada punto sale hacia otro punto o hacia el destino (y llega desde otro punto o el origen)
+    salidas = np.minimum(entre_puntos.min(axis=1)[:, None], d[k:, destinos]).sum(axis=0)
+    llegadas = np.minimum(entre_puntos.min(axis=0)[:, None], d[origenes, k:].T).sum(axis=0)
+    return np.maximum.reduce([por_arbol, salida + salidas, llegadas + llegada])
+
+
+def elegir(matriz, num_bodegas, pares, max_seconds=None):
+    """
+    El par más barato de 'pares' (ver cotas_inferiores). 'matriz' es una
+    MatrizDistancias; 'max_seconds' es el tiempo total para todos los pares
+    que haya que resolver.
+
+    Devuelve un dict con 'par' (posición en 'pares' del elegido), 'resultado'
+    (el de optimizer.resolver_ruta sobre la submatriz [origen] + puntos +
+    [destino]), 'matriz' (esa submatriz), 'cotas' y 'distancias' (None en los
+    pares descartados) en el orden de 'pares', y 'resueltos'; o None si desde
+    ningún par se alcanzan todos los puntos (todas las cotas son infinitas).
+    """
+    cotas = cotas_inferiores(matriz, num_bodegas, pares)
+    if not np.isfinite(cotas).any():
+        return None
+    n = len(matriz) - num_bodegas
+    interiores = list(range(num_bodegas, num_bodegas + n))
+    limite = time.monotonic() + max_seconds if max_seconds else None
+
+    orden = np.argsort(cotas, kind='stable')
+    distancias = [None] * len(pares)
+    mejor = None
+    for posicion, p in enumerate(orden):
+        tope = distancias[mejor] if mejor is not None else np.inf
+        if cotas[p] >= tope:
+            break  # los que siguen tienen cotas aún mayores
+        segundos = None
+        if limite is not None:
+            # el tiempo que queda se reparte entre los pares que aún pueden ganar
+            pendientes = int(np.count_nonzero(cotas[orden[posicion:]] < tope))
+            segundos = max(limite - time.monotonic(), 0.01) / pendientes
+        origen, destino = pares[p]
+        submatriz = matriz.submatriz([origen] + interiores + [destino])
+        resultado = optimizer.resolver_ruta(submatriz, n, 0, n + 1, max_seconds=segundos)
+        distancias[p] = resultado['distancia_km']
+        if mejor is None or distancias[p] < distancias[mejor]:
+            mejor, mejor_resultado, mejor_matriz = p, resultado, submatriz
+
+    return {
+        'par': int(mejor),
+        'resultado': mejor_resultado,
+        'matriz': mejor_matriz,
+        'cotas': [float(c) for c in cotas],
+        'distancias': distancias,
+        'resueltos': sum(x is not None for x in distancias),
+    }
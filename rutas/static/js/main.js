@@ -1,9 +1,12 @@
 // static/js/main.js
 
 let map;
-let markers = [];
-let directionsService = null;
-let directionsRenderer = null;
+let markers = [];  // origen y destino
+let marcadoresPuntos = new Map();  // id del punto -> marcador
+let routePolylines = [];  // una polilínea por ruta (por vehículo cuando hay varias)
+let puntos_entrega_data = [];  // últimos puntos recibidos de la API
+
+const COLORES_VEHICULOS = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b"];
 
 function initMap() {
     console.log("initMap llamado");
@@ -12,11 +15,6 @@ function initMap() {
 
     if (typeof origen_coords !== "undefined" && origen_coords && origen_coords.lat && origen_coords.lng) {
         center = { lat: origen_coords.lat, lng: origen_coords.lng };
-    } else if (Array.isArray(puntos_entrega_data) && puntos_entrega_data.length > 0) {
-        center = {
-            lat: puntos_entrega_data[0].latitud,
-            lng: puntos_entrega_data[0].longitud
-        };
     }
 
     map = new google.maps.Map(document.getElementById("map"), {
@@ -24,27 +22,68 @@ function initMap() {
         zoom: 12
     });
 
-    directionsService = new google.maps.DirectionsService();
-    directionsRenderer = new google.maps.DirectionsRenderer({
-        suppressMarkers: true
-    });
-    directionsRenderer.setMap(map);
+    // un plan guardado se muestra con sus propias paradas, sin pedir los puntos actuales
+    if (typeof paradas_plan !== "undefined" && Array.isArray(paradas_plan)) {
+        puntos_entrega_data = paradas_plan;
+        renderPuntosEntrega();
+        return;
+    }
+
+    cargarPuntos(puntos_api_url)
+        .then((puntos) => {
+            puntos_entrega_data = puntos;
+            renderPuntosEntrega();
+        })
+        .catch((err) => {
+            console.error("No se pudieron cargar los puntos:", err);
+            renderPuntosEntrega();
+        });
+}
+
+// --- PUNTOS DESDE LA API ---
 
-    renderPuntosEntrega();
+// Pide todas las páginas de la API de puntos. Con cache "no-cache" el navegador
+// revalida con el ETag guardado: si nada cambió la respuesta es un 304 sin cuerpo.
+function cargarPuntos(url, acumulados = []) {
+    return fetch(url, { cache: "no-cache" })
+        .then((response) => {
+            if (!response.ok) {
+                throw new Error(`Error al pedir los puntos. Status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then((data) => {
+            acumulados.push(...data.puntos);
+            return data.siguiente ? cargarPuntos(data.siguiente, acumulados) : acumulados;
+        });
+}
+
+// Puntos en orden de visita (si hay una optimización) y si ese orden existe
+function puntosOrdenados() {
+    const anyOrden = puntos_entrega_data.some(
+        (p) => p.orden_optimo !== null && p.orden_optimo !== undefined
+    );
+
+    const puntos = [...puntos_entrega_data];
+
+    if (anyOrden) {
+        puntos.sort((a, b) => {
+            if (a.orden_optimo == null) return 1;
+            if (b.orden_optimo == null) return -1;
+            return a.orden_optimo - b.orden_optimo;
+        });
+    }
+    return { puntos, anyOrden };
 }
 
 function renderPuntosEntrega() {
     clearMap();
 
     const bounds = new google.maps.LatLngBounds();
-    const path = [];
-
-    let originPos = null;
-    let destPos = null;
 
     // ORIGEN
     if (typeof origen_coords !== "undefined" && origen_coords && origen_coords.lat && origen_coords.lng) {
-        originPos = { lat: origen_coords.lat, lng: origen_coords.lng };
+        const originPos = { lat: origen_coords.lat, lng: origen_coords.lng };
 
         const originMarker = new google.maps.Marker({
             position: originPos,
@@ -54,49 +93,16 @@ function renderPuntosEntrega() {
         });
 
         markers.push(originMarker);
-        path.push(originPos);
         bounds.extend(originPos);
     }
 
     // PUNTOS DE ENTREGA
-    if (Array.isArray(puntos_entrega_data) && puntos_entrega_data.length > 0) {
-        const anyOrden = puntos_entrega_data.some(
-            (p) => p.orden_optimo !== null && p.orden_optimo !== undefined
-        );
-
-        const puntos = [...puntos_entrega_data];
-
-        if (anyOrden) {
-            puntos.sort((a, b) => {
-                if (a.orden_optimo == null) return 1;
-                if (b.orden_optimo == null) return -1;
-                return a.orden_optimo - b.orden_optimo;
-            });
-        }
-
-        puntos.forEach((p, index) => {
-            const position = { lat: p.latitud, lng: p.longitud };
-
-            const labelText = anyOrden && p.orden_optimo
-                ? String(p.orden_optimo)
-                : String(index + 1);
-
-            const marker = new google.maps.Marker({
-                position: position,
-                map: map,
-                label: labelText,
-                title: `${p.nombre} - ${p.direccion}`
-            });
-
-            markers.push(marker);
-            path.push(position);
-            bounds.extend(position);
-        });
-    }
+    actualizarMarcadores();
+    puntos_entrega_data.forEach((p) => bounds.extend({ lat: p.latitud, lng: p.longitud }));
 
     // DESTINO
     if (typeof destino_coords !== "undefined" && destino_coords && destino_coords.lat && destino_coords.lng) {
-        destPos = { lat: destino_coords.lat, lng: destino_coords.lng };
+        const destPos = { lat: destino_coords.lat, lng: destino_coords.lng };
 
         const destMarker = new google.maps.Marker({
             position: destPos,
@@ -106,7 +112,6 @@ function renderPuntosEntrega() {
         });
 
         markers.push(destMarker);
-        path.push(destPos);
         bounds.extend(destPos);
     }
 
@@ -114,50 +119,120 @@ function renderPuntosEntrega() {
         map.fitBounds(bounds);
     }
 
-    if (path.length > 1) {
-        drawRouteWithDirectionsAPI(path);
-    }
+    dibujarRutas();
 }
 
-function drawRouteWithDirectionsAPI(path) {
-    if (!directionsService || !directionsRenderer) return;
-    if (!Array.isArray(path) || path.length < 2) return;
+// Deja un marcador por punto de puntos_entrega_data: crea los nuevos, quita los
+// que ya no están y solo cambia la etiqueta/posición de los demás
+function actualizarMarcadores() {
+    const { puntos, anyOrden } = puntosOrdenados();
+    const vigentes = new Set();
 
-    const origin = path[0];
-    const destination = path[path.length - 1];
+    puntos.forEach((p, index) => {
+        vigentes.add(p.id);
+        const position = { lat: p.latitud, lng: p.longitud };
 
-    const waypoints = path.slice(1, -1).map((pos) => ({
-        location: pos,
-        stopover: true
-    }));
+        const labelText = anyOrden && p.orden_optimo
+            ? String(p.orden_optimo)
+            : String(index + 1);
 
-    const request = {
-        origin: origin,
-        destination: destination,
-        waypoints: waypoints,
-        travelMode: google.maps.TravelMode.DRIVING,
-        optimizeWaypoints: false
-    };
+        const marker = marcadoresPuntos.get(p.id);
+        if (marker) {
+            if (marker.getLabel() !== labelText) {
+                marker.setLabel(labelText);
+            }
+            marker.setPosition(position);
+            return;
+        }
 
-    directionsService.route(request, (result, status) => {
-        console.log("Directions status:", status);
-        if (status === "OK" || status === google.maps.DirectionsStatus.OK) {
-            directionsRenderer.setDirections(result);
-        } else {
-            console.error("Error en Directions API:", status);
+        marcadoresPuntos.set(p.id, new google.maps.Marker({
+            position: position,
+            map: map,
+            label: labelText,
+            title: `${p.nombre} - ${p.direccion}`
+        }));
+    });
+
+    marcadoresPuntos.forEach((marker, id) => {
+        if (!vigentes.has(id)) {
+            marker.setMap(null);
+            marcadoresPuntos.delete(id);
         }
     });
 }
 
+function dibujarRutas() {
+    routePolylines.forEach((p) => p.setMap(null));
+    routePolylines = [];
+
+    // Trazado por las calles calculado en el backend al optimizar (sin llamar a la API)
+    if (typeof geometria_ruta !== "undefined" && geometria_ruta && Array.isArray(geometria_ruta.rutas)) {
+        geometria_ruta.rutas.forEach((ruta, indice) => {
+            if (!ruta.polilinea) return;
+            const path = google.maps.geometry.encoding.decodePath(ruta.polilinea);
+            dibujarPolilinea(path, geometria_ruta.rutas.length > 1 ? indice : null);
+        });
+        return;
+    }
+
+    // Sin optimización guardada: el recorrido en línea recta entre los puntos
+    // (con varios vehículos, cada uno tiene su propio recorrido: grupos por vehiculo_id)
+    const grupos = new Map();
+    puntosOrdenados().puntos.forEach((p) => {
+        const grupo = p.vehiculo_id == null ? "sin_vehiculo" : String(p.vehiculo_id);
+        if (!grupos.has(grupo)) {
+            grupos.set(grupo, []);
+        }
+        grupos.get(grupo).push({ lat: p.latitud, lng: p.longitud });
+    });
+
+    if (grupos.size === 0) {
+        grupos.set("sin_vehiculo", []);
+    }
+
+    const originPos = origen_coords && origen_coords.lat && origen_coords.lng
+        ? { lat: origen_coords.lat, lng: origen_coords.lng } : null;
+    const destPos = destino_coords && destino_coords.lat && destino_coords.lng
+        ? { lat: destino_coords.lat, lng: destino_coords.lng } : null;
+
+    let color = 0;
+    grupos.forEach((posiciones) => {
+        const path = [];
+        if (originPos) path.push(originPos);
+        path.push(...posiciones);
+        if (destPos) path.push(destPos);
+
+        if (path.length > 1) {
+            dibujarPolilinea(path, grupos.size > 1 ? color++ : null);
+        }
+    });
+}
+
+function dibujarPolilinea(path, indiceVehiculo = null) {
+    const polyline = new google.maps.Polyline({
+        path: path,
+        map: map,
+        strokeColor: indiceVehiculo === null
+            ? "#4285f4"
+            : COLORES_VEHICULOS[indiceVehiculo % COLORES_VEHICULOS.length],
+        strokeOpacity: 0.8,
+        strokeWeight: 5
+    });
+    routePolylines.push(polyline);
+    return polyline;
+}
+
 function clearMap() {
     if (markers.length > 0) {
         markers.forEach((m) => m.setMap(null));
         markers = [];
     }
 
-    if (directionsRenderer) {
-        directionsRenderer.set("directions", null);
-    }
+    marcadoresPuntos.forEach((m) => m.setMap(null));
+    marcadoresPuntos.clear();
+
+    routePolylines.forEach((p) => p.setMap(null));
+    routePolylines = [];
 }
 
 function toggleOrigenCustom() {
@@ -186,6 +261,20 @@ function toggleDestinoCustom() {
     }
 }
 
+// --- OPTIMIZAR SOLO LA ZONA VISIBLE ---
+
+// Guarda en el campo oculto "zona" el rectángulo visible del mapa: "sur,oeste,norte,este"
+function llenarZonaVisible(form) {
+    if (!form.solo_zona || !form.solo_zona.checked || !map || !map.getBounds()) {
+        form.zona.value = "";
+        return;
+    }
+    const bounds = map.getBounds();
+    const sw = bounds.getSouthWest();
+    const ne = bounds.getNorthEast();
+    form.zona.value = [sw.lat(), sw.lng(), ne.lat(), ne.lng()].join(",");
+}
+
 // --- BORRAR PUNTO INDIVIDUAL ---
 
 function getCookie(name) {
@@ -203,7 +292,7 @@ function getCookie(name) {
     return cookieValue;
 }
 
-function eliminarPunto(url) {
+function eliminarPunto(url, puntoId) {
     if (!confirm("¿Seguro que quieres eliminar este punto de entrega?")) {
         return;
     }
@@ -225,13 +314,36 @@ function eliminarPunto(url) {
         return response.json();
     })
     .then((data) => {
-        if (data.ok) {
-            // Se borró en backend; recargamos para refrescar lista + mapa
-            location.reload();
-        } else {
+        if (!data.ok) {
             alert("El servidor respondió, pero no confirmó el borrado.");
             console.error("Detalle error:", data.error);
+            return;
+        }
+
+        // Se borró en backend; se actualizan la lista y el mapa sin recargar la página
+        const item = document.querySelector(`#puntos-lista li[data-punto-id="${puntoId}"]`);
+        if (item) item.remove();
+        puntos_entrega_data = puntos_entrega_data.filter((p) => p.id !== puntoId);
+
+        if (!data.ruta_actualizada) {
+            actualizarMarcadores();
+            dibujarRutas();
+            return;
         }
+
+        // la ruta vigente se reparó y quedó como un plan nuevo: nuevo trazado,
+        // totales y orden de los demás puntos
+        geometria_ruta = data.geometria;
+        actualizarTotales(data);
+        const params = new URLSearchParams(location.search);
+        params.set("plan", data.plan_id);
+        history.replaceState(null, "", `${location.pathname}?${params}`);
+        return cargarPuntos(puntos_api_url).then((puntos) => {
+            puntos_entrega_data = puntos;
+            actualizarMarcadores();
+            actualizarOrdenLista();
+            dibujarRutas();
+        });
     })
     .catch((err) => {
         console.error(err);
@@ -239,8 +351,54 @@ function eliminarPunto(url) {
     });
 }
 
+function actualizarTotales(data) {
+    const valores = {
+        "total-distancia": data.total_distance_km,
+        "total-litros": data.fuel_consumed_liters,
+        "total-costo": data.fuel_cost_clp == null ? null : Math.round(data.fuel_cost_clp),
+    };
+    Object.entries(valores).forEach(([id, valor]) => {
+        const elemento = document.getElementById(id);
+        if (elemento && valor != null) elemento.textContent = valor;
+    });
+}
+
+function actualizarOrdenLista() {
+    puntos_entrega_data.forEach((p) => {
+        const orden = document.querySelector(`#puntos-lista li[data-punto-id="${p.id}"] .punto-orden`);
+        if (orden) orden.textContent = p.orden_optimo == null ? "N/A" : p.orden_optimo;
+    });
+}
+
+// --- TRABAJOS DE OPTIMIZACIÓN EN SEGUNDO PLANO ---
+
+function seguirTrabajo(url) {
+    const consultar = () => {
+        fetch(url)
+            .then((response) => response.json())
+            .then((data) => {
+                const progreso = document.getElementById("trabajo-progreso");
+                if (progreso) {
+                    progreso.textContent = `${Math.round(data.progreso * 100)}% - ${data.etapa || data.estado}`;
+                }
+                if (data.estado === "terminado" || data.estado === "error") {
+                    // el mapa muestra el resultado guardado en el trabajo
+                    location.reload();
+                } else {
+                    setTimeout(consultar, 2000);
+                }
+            })
+            .catch((err) => {
+                console.error("Error consultando el trabajo:", err);
+                setTimeout(consultar, 5000);
+            });
+    };
+    consultar();
+}
+
 window.initMap = initMap;
 window.clearMap = clearMap;
 window.toggleOrigenCustom = toggleOrigenCustom;
 window.toggleDestinoCustom = toggleDestinoCustom;
 window.eliminarPunto = eliminarPunto;
+window.seguirTrabajo = seguirTrabajo;
@@ -1,3 +1,1458 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+import requests
+
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    benchmark, cache_distancias, cache_soluciones, descomposicion, escenarios, espacial, geocoding, geometria,
+    importacion, metricas, optimizer, pipeline, proveedores, seleccion_bodegas, trabajos,
+)
+from .matriz import ESCALA_METROS, SIN_RUTA, MatrizDistancias
+from .models import DistanciaCache, EstadoRuta, GeocodificacionCache, PuntoEntrega, RutaPlan, TrabajoOptimizacion, Vehiculo
+from .pipeline import OptimizacionError
+
+
+def _km_stub(origen, destino):
+    """Distancia (asimétrica) que responde el servidor de prueba entre dos "lat,lng"."""
+    (lat_o, lng_o), (lat_d, lng_d) = (map(float, c.split(',')) for c in (origen, destino))
+    return round(abs(lat_o - lat_d) * 100 + abs(lng_o - lng_d) * 50 + (0.5 if lat_o > lat_d else 0), 3)
+
+
+class _DistanceMatrixStub(BaseHTTPRequestHandler):
+    """Distance Matrix API falsa: responde 429 a la primera solicitud y falla con 'latitud_falla'."""
+
+    def do_GET(self):
+        servidor = self.server
+        params = parse_qs(urlparse(self.path).query)
+        origenes = params['origins'][0].split('|')
+        destinos = params['destinations'][0].split('|')
+        with servidor.lock:
+            servidor.solicitudes.append((len(origenes), len(destinos)))
+            limitar = len(servidor.solicitudes) == 1
+        if limitar:
+            self.send_response(429)
+            self.end_headers()
+            return
+        if any(o.startswith(servidor.latitud_falla) for o in origenes):
+            datos = {'status': 'REQUEST_DENIED', 'error_message': 'bloque rechazado'}
+        else:
+            datos = {'status': 'OK', 'rows': [
+                {'elements': [
+                    {'status': 'OK', 'distance': {'value': int(_km_stub(o, d) * 1000)}, 'duration': {'value': 60}}
+                    for d in destinos
+                ]}
+                for o in origenes
+            ]}
+        cuerpo = json.dumps(datos).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(DISTANCIA_CACHE_HABILITADO=True, METRICAS_HABILITADAS=False)
+class DistanceMatrixTests(TestCase):
+    def setUp(self):
+        self.servidor = ThreadingHTTPServer(('127.0.0.1', 0), _DistanceMatrixStub)
+        self.servidor.lock = threading.Lock()
+        self.servidor.solicitudes = []
+        self.servidor.latitud_falla = 'ninguna'
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self.addCleanup(self.servidor.server_close)
+        self.addCleanup(self.servidor.shutdown)
+        self.url = f'http://127.0.0.1:{self.servidor.server_address[1]}/'
+        espera = mock.patch('rutas.google_api.ESPERA_BASE_REINTENTO', 0)
+        espera.start()
+        self.addCleanup(espera.stop)
+
+        self.origen = {'latitud': -36.8, 'longitud': -73.0}
+        self.puntos = [
+            PuntoEntrega(latitud=round(-36.81 - i * 0.003, 6), longitud=round(-73.01 + i * 0.002, 6))
+            for i in range(30)
+        ]
+
+    def _esperada(self):
+        coords = [f"{self.origen['latitud']},{self.origen['longitud']}"] + [
+            f"{p.latitud},{p.longitud}" for p in self.puntos
+        ]
+        return np.array([[_km_stub(a, b) for b in coords] for a in coords])
+
+    def test_bloques_reintento_y_union(self):
+        matriz = optimizer.get_distance_matrix(self.puntos, self.origen, 'clave', url=self.url)
+        np.testing.assert_allclose(np.asarray(matriz), self._esperada(), atol=1e-3)
+
+        # 31 x 31 en bloques que respetan los límites, más el reintento del 429
+        solicitudes = self.servidor.solicitudes
+        self.assertTrue(all(o <= 25 and d <= 25 and o * d <= 100 for o, d in solicitudes))
+        self.assertEqual(sum(o * d for o, d in solicitudes[1:]), 31 * 31)
+        self.assertEqual(DistanciaCache.objects.count(), 31 * 31)
+
+        # la segunda vez todo sale de la cache
+        del solicitudes[:]
+        optimizer.get_distance_matrix(self.puntos, self.origen, 'clave', url=self.url)
+        self.assertEqual(solicitudes, [])
+
+    def test_falla_un_bloque_y_los_demas_quedan_en_cache(self):
+        self.servidor.latitud_falla = str(self.puntos[-1].latitud)
+        self.assertIsNone(optimizer.get_distance_matrix(self.puntos, self.origen, 'clave', url=self.url))
+        guardados = DistanciaCache.objects.count()
+        self.assertGreater(guardados, 0)
+        self.assertLess(guardados, 31 * 31)
+
+        # al reintentar solo se pide lo que faltó (la primera solicitud vuelve a recibir 429)
+        self.servidor.latitud_falla = 'ninguna'
+        del self.servidor.solicitudes[:]
+        matriz = optimizer.get_distance_matrix(self.puntos, self.origen, 'clave', url=self.url)
+        np.testing.assert_allclose(np.asarray(matriz), self._esperada(), atol=1e-3)
+        self.assertEqual(sum(o * d for o, d in self.servidor.solicitudes[1:]), 31 * 31 - guardados)
+
+
+@override_settings(DISTANCIA_CACHE_HABILITADO=True, DISTANCIA_CACHE_TTL_DIAS=30)
+class CacheDistanciasTests(TestCase):
+    def test_clave_redondea_y_busca_tramos_dirigidos(self):
+        a = cache_distancias.clave_coordenadas(-36.8270001, -73.0500004)
+        b = cache_distancias.clave_coordenadas(-36.9, -73.1)
+        self.assertEqual(a, '-36.82700,-73.05000')
+        cache_distancias.guardar({(a, b): (12.5, 900.0)})
+        self.assertEqual(cache_distancias.buscar([a], [b]), {(a, b): (12.5, 900.0)})
+        self.assertEqual(cache_distancias.buscar([b], [a]), {})
+
+        # se actualiza en vez de duplicar
+        cache_distancias.guardar({(a, b): (13.0, 950.0)})
+        self.assertEqual(cache_distancias.buscar([a], [b]), {(a, b): (13.0, 950.0)})
+        self.assertEqual(DistanciaCache.objects.count(), 1)
+
+    def test_vencidos_no_se_usan(self):
+        cache_distancias.guardar({('a', 'b'): (1.0, 60.0)})
+        DistanciaCache.objects.update(creado=timezone.now() - datetime.timedelta(days=31))
+        self.assertEqual(cache_distancias.buscar(['a'], ['b']), {})
+
+    @override_settings(DISTANCIA_CACHE_MAX_ENTRADAS=4, DISTANCIA_CACHE_PURGA_CADA=1)
+    def test_recorte_con_el_mismo_creado_borra_solo_lo_que_sobra(self):
+        cache_distancias.guardar({(f'o{i}', 'd'): (float(i), 60.0) for i in range(10)})
+        # las 10 filas tienen el mismo 'creado': quedan exactamente 4 (las de id mayor)
+        self.assertEqual(DistanciaCache.objects.count(), 4)
+        self.assertEqual(
+            sorted(DistanciaCache.objects.values_list('origen', flat=True)), ['o6', 'o7', 'o8', 'o9']
+        )
+
+    @override_settings(DISTANCIA_CACHE_MAX_ENTRADAS=1, DISTANCIA_CACHE_PURGA_CADA=3)
+    def test_el_recorte_se_hace_cada_tanto(self):
+        with mock.patch('rutas.cache_distancias._escrituras', itertools.count(1)), \
+                mock.patch('rutas.cache_distancias.purgar') as purgar:
+            for i in range(7):
+                cache_distancias.guardar({(f'o{i}', 'd'): (1.0, 60.0)})
+        self.assertEqual(purgar.call_count, 2)
+
+
+def _csv(texto):
+    return io.BytesIO(texto.encode('utf-8'))
+
+
+class ImportacionTests(TestCase):
+    def test_csv_con_punto_y_coma_y_duplicados(self):
+        archivo = _csv(
+            "Nombre;Dirección;Lat;Lng;Demanda;Desde;Hasta\n"
+            "A;Calle 1;-36,8;-73,0;12,5;09:00;12:00\n"
+            "B;Calle 2;-36.9;-73.1;;;\n"
+            ";;;;;;\n"
+            "C;calle  1;-36.7;-73.2;;;\n"
+        )
+        resumen = importacion.importar_puntos(archivo, 'puntos.csv')
+        self.assertEqual(resumen, {'creados': 2, 'duplicados': 1, 'errores': []})
+        a = PuntoEntrega.objects.get(nombre='A')
+        self.assertEqual(float(a.latitud), -36.8)
+        self.assertEqual(a.demanda_kg, 12.5)
+        self.assertEqual(a.ventana_inicio.hour, 9)
+
+    def test_faltan_columnas(self):
+        with self.assertRaises(importacion.ImportacionError):
+            importacion.importar_puntos(_csv("nombre,lat\nA,1\n"), 'puntos.csv')
+
+    def test_filas_invalidas_se_informan_sin_frenar_el_lote(self):
+        archivo = _csv(
+            "nombre,direccion,lat,lng,demanda\n"
+            "A,Calle 1,-36.8,-73.0,\n"
+            "B,Calle 2,95,-73.0,\n"
+            "C,Calle 3,-36.8,-181,\n"
+            f"{'x' * 256},Calle 4,-36.8,-73.0,\n"
+            "E,Calle 5,-36.8,-73.0,-3\n"
+            "F,Calle 6,abc,-73.0,\n"
+            "G,Calle 7,-36.9,-73.1,\n"
+        )
+        resumen = importacion.importar_puntos(archivo, 'puntos.csv', tamano_lote=3)
+        self.assertEqual(resumen['creados'], 2)
+        self.assertEqual([fila for fila, _ in resumen['errores']], [3, 4, 5, 6, 7])
+        self.assertEqual(sorted(PuntoEntrega.objects.values_list('nombre', flat=True)), ['A', 'G'])
+
+    def test_fila_invalida_no_bloquea_otra_con_la_misma_direccion(self):
+        archivo = _csv(
+            "nombre,direccion,lat,lng\n"
+            "A,Calle 1,abc,-73.0\n"
+            "B,Calle 1,-36.8,-73.0\n"
+            "C,Calle 2,,\n"
+            "D,calle 2,-36.9,-73.1\n"
+            "E,Calle 1,-36.7,-73.2\n"
+        )
+        with mock.patch('rutas.importacion.geocodificar_lote', return_value=({}, {'Calle 2': 'sin resultados'})):
+            resumen = importacion.importar_puntos(archivo, 'puntos.csv', tamano_lote=2)
+        self.assertEqual(resumen['creados'], 2)
+        self.assertEqual(resumen['duplicados'], 1)
+        self.assertEqual(resumen['errores'], [(2, 'Latitud o Longitud con formato incorrecto.'), (4, 'sin resultados')])
+        self.assertEqual(sorted(PuntoEntrega.objects.values_list('nombre', flat=True)), ['B', 'D'])
+
+    def test_si_falla_el_lote_se_guarda_fila_a_fila(self):
+        guardar = PuntoEntrega.save
+
+        def save(punto, *args, **kwargs):
+            if punto.nombre == 'B':
+                raise IntegrityError('falla')
+            return guardar(punto, *args, **kwargs)
+
+        archivo = _csv("nombre,direccion,lat,lng\nA,Calle 1,-36.8,-73.0\nB,Calle 2,-36.9,-73.1\nC,Calle 3,-36.7,-73.2\n")
+        with mock.patch.object(PuntoEntrega.objects, 'bulk_create', side_effect=IntegrityError('lote')), \
+                mock.patch.object(PuntoEntrega, 'save', save), \
+                self.assertLogs('rutas.importacion', 'ERROR'):
+            resumen = importacion.importar_puntos(archivo, 'puntos.csv')
+        self.assertEqual(resumen['creados'], 2)
+        self.assertEqual(resumen['errores'], [(3, 'Error al guardar: falla')])
+        self.assertEqual(sorted(PuntoEntrega.objects.values_list('nombre', flat=True)), ['A', 'C'])
+
+    def test_excel(self):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            self.skipTest("openpyxl no está instalado")
+        libro = Workbook()
+        libro.active.append(['nombre', 'direccion', 'latitud', 'longitud', 'desde'])
+        libro.active.append(['A', 'Calle 1', -36.8, -73.0, datetime.time(8, 30)])
+        archivo = io.BytesIO()
+        libro.save(archivo)
+        archivo.seek(0)
+        resumen = importacion.importar_puntos(archivo, 'puntos.xlsx')
+        self.assertEqual(resumen['creados'], 1)
+        self.assertEqual(PuntoEntrega.objects.get().ventana_inicio, datetime.time(8, 30))
+
+
+class _PoolQueFalla:
+    """Reemplazo de ProcessPoolExecutor cuyos workers mueren sin ejecutar nada."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, funcion, *args):
+        futuro = Future()
+        futuro.set_exception(RuntimeError('el worker murió'))
+        return futuro
+
+
+@override_settings(METRICAS_HABILITADAS=False)
+class TrabajosTests(TestCase):
+    def test_ciclo_de_vida(self):
+        trabajo = trabajos.encolar({'x': 1})
+        self.assertEqual(trabajo.estado, TrabajoOptimizacion.PENDIENTE)
+        self.assertEqual(trabajos.reclamar_siguiente(), trabajo.id)
+        self.assertIsNone(trabajos.reclamar_siguiente())
+
+        with mock.patch('rutas.trabajos.ejecutar_optimizacion', return_value={'ok': True}):
+            trabajos.ejecutar_trabajo(trabajo.id)
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.resultado, trabajo.progreso),
+                         (TrabajoOptimizacion.TERMINADO, {'ok': True}, 1.0))
+        self.assertIsNotNone(trabajo.terminado)
+
+    def test_error_de_optimizacion(self):
+        with mock.patch('rutas.trabajos.ejecutar_optimizacion', side_effect=OptimizacionError('sin puntos')):
+            trabajo = trabajos.ejecutar_ahora({})
+        self.assertEqual((trabajo.estado, trabajo.error), (TrabajoOptimizacion.ERROR, 'sin puntos'))
+
+    def test_worker_que_muere_deja_el_trabajo_con_error(self):
+        trabajo = trabajos.encolar({})
+        with mock.patch('rutas.trabajos.ProcessPoolExecutor', _PoolQueFalla):
+            trabajos.procesar_cola(procesos=1, una_vez=True)
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoOptimizacion.ERROR)
+        self.assertIn('el worker murió', trabajo.error)
+
+    def test_no_pisa_un_trabajo_terminado(self):
+        trabajo = TrabajoOptimizacion.objects.create(parametros={}, estado=TrabajoOptimizacion.TERMINADO)
+        self.assertEqual(trabajos.marcar_error(trabajo.id, 'tarde'), 0)
+
+    @override_settings(TRABAJO_TIMEOUT_SEGUNDOS=60)
+    def test_recupera_interrumpidos_al_iniciar(self):
+        ahora = timezone.now()
+        viejo = TrabajoOptimizacion.objects.create(
+            parametros={}, estado=TrabajoOptimizacion.EN_PROCESO, iniciado=ahora - datetime.timedelta(minutes=5))
+        reciente = TrabajoOptimizacion.objects.create(
+            parametros={}, estado=TrabajoOptimizacion.EN_PROCESO, iniciado=ahora)
+        with mock.patch('rutas.trabajos.ProcessPoolExecutor', _PoolQueFalla):
+            trabajos.procesar_cola(una_vez=True)
+        viejo.refresh_from_db()
+        reciente.refresh_from_db()
+        self.assertEqual(viejo.estado, TrabajoOptimizacion.ERROR)
+        self.assertEqual(reciente.estado, TrabajoOptimizacion.EN_PROCESO)
+
+
+def _coordenadas(lat, lng):
+    return {'latitud': lat, 'longitud': lng}
+
+
+class ProveedoresTests(SimpleTestCase):
+    def setUp(self):
+        # cuatro nodos en línea; 1 -> 2 y 3 -> 0 son de un solo sentido
+        temporal = tempfile.TemporaryDirectory()
+        self.addCleanup(temporal.cleanup)
+        self.directorio = temporal.name
+        nodos = [(-33.0, -70.0 + 0.01 * i) for i in range(4)]
+        aristas = [(0, 1, 1.0), (1, 0, 1.0), (1, 2, 1.5), (2, 3, 1.0), (3, 2, 1.0), (3, 0, 4.0)]
+        origenes, destinos, km = zip(*aristas)
+        proveedores.construir_grafo(self.directorio, nodos, origenes, destinos, km)
+        self.coordenadas = [_coordenadas(lat, lng) for lat, lng in nodos]
+
+    @override_settings(DISTANCIA_VELOCIDAD_KMH=30)
+    def test_distancias_punto_del_grafo_igual_a_la_matriz(self):
+        proveedor = proveedores.ProveedorGrafoLocal(self.directorio)
+        distancias, _ = proveedor._matriz_coordenadas(self.coordenadas)
+        for i in range(4):
+            otros = self.coordenadas[:i] + self.coordenadas[i + 1:]
+            desde, hacia = proveedor.distancias_punto(self.coordenadas[i], otros)
+            np.testing.assert_allclose(desde, np.delete(distancias[i], i))
+            np.testing.assert_allclose(hacia, np.delete(distancias[:, i], i))
+        # asimétrica: 1 -> 2 directo, 2 -> 1 da la vuelta por 3 y 0
+        self.assertAlmostEqual(distancias[1, 2], 1.5)
+        self.assertAlmostEqual(distancias[2, 1], 6.0)
+
+    def test_ajuste_al_nodo_mas_cercano_igual_a_revisar_todos(self):
+        rng = np.random.default_rng(11)
+        nodos = np.column_stack((-36.8 + rng.uniform(0, 0.3, 3000), -73.0 + rng.uniform(0, 0.3, 3000)))
+        proveedores.construir_grafo(self.directorio, nodos, [0], [1], [1.0])
+        grafo = proveedores.GrafoVial(self.directorio)
+        consultas = np.radians(np.column_stack((-36.85 + rng.uniform(0, 0.4, 50), -73.05 + rng.uniform(0, 0.4, 50))))
+        indices, distancias = grafo.nodo_mas_cercano(consultas)
+        todas = proveedores.distancias_haversine(consultas, np.radians(nodos))
+        self.assertEqual(indices, todas.argmin(axis=1).tolist())
+        np.testing.assert_allclose(distancias, todas.min(axis=1))
+
+    def test_grafo_inverso_se_calcula_si_no_esta_en_disco(self):
+        for nombre in proveedores.ARCHIVOS_INVERSO:
+            ruta = os.path.join(self.directorio, f'{nombre}.npy')
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        grafo = proveedores.GrafoVial(self.directorio)
+        km, _ = grafo.dijkstra(1, [0, 2, 3], 120, inverso=True)
+        self.assertEqual(km, {1: 0.0, 0: 1.0, 2: 6.0, 3: 5.0})
+
+    @override_settings(DISTANCIA_PROVEEDORES=['google', 'grafo_local', 'haversine'],
+                       GOOGLE_MAPS_API_KEY='', GRAFO_VIAL_DIR='')
+    def test_usa_el_primer_proveedor_disponible(self):
+        self.assertEqual(proveedores.proveedor_preferido(), 'haversine')
+        with self.settings(GRAFO_VIAL_DIR=self.directorio):
+            desde_hacia, nombre = proveedores.distancias_punto(self.coordenadas[0], self.coordenadas[1:])
+        self.assertEqual(nombre, 'grafo_local')
+        self.assertEqual(len(desde_hacia[0]), 3)
+
+    @override_settings(DISTANCIA_PROVEEDORES=['google', 'haversine'], GOOGLE_MAPS_API_KEY='clave')
+    def test_si_un_proveedor_falla_se_usa_el_siguiente(self):
+        puntos = [mock.Mock(latitud=-33.0, longitud=-70.01)]
+        with mock.patch('rutas.optimizer.get_distance_matrix', return_value=None) as google:
+            matriz, nombre = proveedores.matriz_distancias(puntos, self.coordenadas[0], self.coordenadas[2])
+        google.assert_called_once()
+        self.assertEqual(nombre, 'haversine')
+        self.assertEqual(len(matriz), 3)
+
+
+def _matriz_asimetrica(n_nodos, semilla):
+    """Matriz aleatoria asimétrica con diagonal cero."""
+    d = np.random.default_rng(semilla).uniform(1, 20, size=(n_nodos, n_nodos))
+    np.fill_diagonal(d, 0.0)
+    return d
+
+
+def _fuerza_bruta(d, n, inicio, fin):
+    """Menor distancia probando todas las permutaciones de los puntos 1..n."""
+    return min(
+        d[inicio, orden[0]] + sum(d[a, b] for a, b in zip(orden, orden[1:])) + d[orden[-1], fin]
+        for orden in itertools.permutations(range(1, n + 1))
+    )
+
+
+class HeldKarpTests(SimpleTestCase):
+    def test_igual_a_fuerza_bruta(self):
+        for n in range(1, 8):
+            d = _matriz_asimetrica(n + 2, semilla=n)
+            for fin in (0, n + 1):  # ciclo y camino a un destino distinto
+                ruta, total = optimizer.solve_tsp_held_karp(d, n, 0, fin)
+                self.assertAlmostEqual(total, _fuerza_bruta(d, n, 0, fin))
+                self.assertEqual((ruta[0], ruta[-1]), (0, fin))
+                self.assertEqual(sorted(ruta[1:-1]), list(range(1, n + 1)))
+                self.assertAlmostEqual(sum(d[a, b] for a, b in zip(ruta, ruta[1:])), total)
+
+    def test_sin_ruta_posible(self):
+        d = _matriz_asimetrica(4, semilla=0)
+        d[:, 3] = np.inf  # nadie llega al destino
+        self.assertEqual(optimizer.solve_tsp_held_karp(d, 2, 0, 3), ([], float('inf')))
+
+    def test_solve_tsp_usa_held_karp_hasta_el_limite(self):
+        n = optimizer.HELD_KARP_MAX_PUNTOS
+        d = _matriz_asimetrica(n + 1, semilla=1)
+        resultado = optimizer.resolver_ruta(d, n, 0)
+        self.assertEqual(resultado['metodo'], 'held_karp')
+        self.assertTrue(resultado['optimo_probado'])
+
+
+def _costo(d, ruta):
+    return float(sum(d[a, b] for a, b in zip(ruta, ruta[1:])))
+
+
+def _vecinos_2opt(ruta):
+    """Todas las rutas que resultan de invertir ruta[i..j] (sin tocar los extremos)."""
+    for i in range(1, len(ruta) - 2):
+        for j in range(i + 1, len(ruta) - 1):
+            yield i, np.concatenate((ruta[:i], ruta[i:j + 1][::-1], ruta[j + 1:]))
+
+
+class BusquedaLocalTests(SimpleTestCase):
+    def test_2opt_aplica_el_mejor_movimiento_real(self):
+        for semilla in range(20):
+            d = _matriz_asimetrica(12, semilla)
+            ruta = np.random.default_rng(semilla).permutation(np.arange(1, 11))
+            ruta = np.concatenate(([0], ruta, [11]))
+            costo = _costo(d, ruta)
+
+            # el primer i con algún movimiento que mejore, y su mejor j
+            esperada = None
+            for i in range(1, len(ruta) - 2):
+                candidatas = [r for i_r, r in _vecinos_2opt(ruta) if i_r == i]
+                mejor = min(candidatas, key=lambda r: _costo(d, r))
+                if _costo(d, mejor) < costo - 1e-9:
+                    esperada = mejor
+                    break
+
+            mejorada = ruta.copy()
+            self.assertEqual(optimizer._mejorar_2opt(d, mejorada), esperada is not None)
+            if esperada is not None:
+                np.testing.assert_array_equal(mejorada, esperada)
+
+    def test_or_opt_aplica_el_mejor_movimiento_real(self):
+        for semilla in range(20):
+            d = _matriz_asimetrica(10, semilla)
+            ruta = np.concatenate(([0], np.random.default_rng(semilla).permutation(np.arange(1, 9)), [9]))
+            costo = _costo(d, ruta)
+
+            esperada = None
+            for largo in range(1, 4):
+                for i in range(1, len(ruta) - largo):
+                    tramo, resto = ruta[i:i + largo], np.delete(ruta, np.arange(i, i + largo))
+                    candidatas = [np.insert(resto, pos, tramo) for pos in range(1, len(resto))]
+                    candidatas = [r for r in candidatas if not np.array_equal(r, ruta)]
+                    mejor = min(candidatas, key=lambda r: _costo(d, r))
+                    if _costo(d, mejor) < costo - 1e-9:
+                        esperada = mejor
+                        break
+                if esperada is not None:
+                    break
+
+            mejorada, mejoro = optimizer._mejorar_or_opt(d, ruta.copy())
+            self.assertEqual(mejoro, esperada is not None)
+            if esperada is not None:
+                self.assertAlmostEqual(_costo(d, mejorada), _costo(d, esperada))
+
+    def test_con_todos_los_vecinos_evalua_los_mismos_movimientos(self):
+        d = _matriz_asimetrica(12, semilla=9)
+        todos = np.array([[j for j in range(12) if j != i] for i in range(12)])
+        for semilla in range(10):
+            ruta = np.concatenate(([0], np.random.default_rng(semilla).permutation(np.arange(1, 11)), [11]))
+            # con la lista completa se encuentra el mismo mejor movimiento que el 2-opt sin lista
+            completa = min((r for _, r in _vecinos_2opt(ruta)), key=lambda r: _costo(d, r))
+            con_vecinos = ruta.copy()
+            mejoro = optimizer._mejorar_2opt_vecinos(d, con_vecinos, todos)
+            self.assertEqual(mejoro, _costo(d, completa) < _costo(d, ruta) - 1e-9)
+            if mejoro:
+                self.assertAlmostEqual(_costo(d, con_vecinos), _costo(d, completa))
+
+            movida, mejoro = optimizer._mejorar_or_opt_vecinos(d, ruta.copy(), todos)
+            self.assertEqual(sorted(movida), sorted(ruta))
+            if mejoro:
+                self.assertLess(_costo(d, movida), _costo(d, ruta))
+
+    def test_busqueda_con_listas_de_vecinos(self):
+        n = 200
+        rng = np.random.default_rng(10)
+        coordenadas = np.column_stack((-36.8 + rng.uniform(0, 0.2, n + 2), -73.0 + rng.uniform(0, 0.2, n + 2)))
+        indice = espacial.IndiceEspacial(coordenadas)
+        d = np.linalg.norm(indice.xy[:, None] - indice.xy[None, :], axis=2)
+        vecinos = indice.listas_vecinos(optimizer.VECINOS_BUSQUEDA)
+
+        completa = optimizer.resolver_ruta(d, n, 0, n + 1, metodo='heuristico')
+        resultado = optimizer.resolver_ruta(d, n, 0, n + 1, metodo='heuristico', vecinos=vecinos)
+        ruta = resultado['ruta']
+        self.assertEqual((ruta[0], ruta[-1]), (0, n + 1))
+        self.assertEqual(sorted(ruta[1:-1]), list(range(1, n + 1)))
+        self.assertAlmostEqual(resultado['distancia_km'], _costo(d, ruta))
+        self.assertLess(resultado['distancia_km'], completa['distancia_km'] * 1.1)
+
+    def test_heuristico_termina_en_optimo_local(self):
+        n = 60
+        d = _matriz_asimetrica(n + 2, semilla=3)
+        resultado = optimizer.resolver_ruta(d, n, 0, n + 1, metodo='heuristico')
+        ruta = np.array(resultado['ruta'])
+        self.assertEqual(sorted(ruta[1:-1]), list(range(1, n + 1)))
+        self.assertAlmostEqual(resultado['distancia_km'], _costo(d, ruta))
+        vecino = min((r for _, r in _vecinos_2opt(ruta)), key=lambda r: _costo(d, r))
+        self.assertGreaterEqual(_costo(d, vecino), resultado['distancia_km'] - 1e-9)
+
+
+class TiempoLimiteTests(SimpleTestCase):
+    def test_respeta_el_limite_y_solo_mejora(self):
+        n = 150
+        d = _matriz_asimetrica(n + 2, semilla=4)
+        inicio = time.monotonic()
+        resultado = optimizer.resolver_ruta(d, n, 0, n + 1, max_seconds=0.5)
+        self.assertLess(time.monotonic() - inicio, 1.5)
+        self.assertGreater(resultado['iteraciones'], 1)
+        self.assertFalse(resultado['optimo_probado'])
+
+        curva = [km for _, km in resultado['curva_mejora']]
+        self.assertEqual(curva, sorted(curva, reverse=True))
+        self.assertAlmostEqual(curva[-1], resultado['distancia_km'])
+        self.assertAlmostEqual(_costo(d, resultado['ruta']), resultado['distancia_km'])
+
+        sin_limite = optimizer.resolver_ruta(d, n, 0, n + 1, metodo='heuristico')
+        self.assertLessEqual(resultado['distancia_km'], sin_limite['distancia_km'] + 1e-9)
+
+    def test_held_karp_sin_tiempo_devuelve_la_heuristica(self):
+        n = optimizer.HELD_KARP_MAX_PUNTOS
+        d = _matriz_asimetrica(n + 1, semilla=5)
+        resultado = optimizer.resolver_ruta(d, n, 0, max_seconds=0.001)
+        self.assertEqual(resultado['metodo'], 'held_karp')
+        self.assertFalse(resultado['optimo_probado'])
+        self.assertEqual(sorted(resultado['ruta'][1:-1]), list(range(1, n + 1)))
+
+    def test_held_karp_con_tiempo_suficiente_es_optimo(self):
+        d = _matriz_asimetrica(8, semilla=6)
+        resultado = optimizer.resolver_ruta(d, 6, 0, 7, max_seconds=5)
+        self.assertTrue(resultado['optimo_probado'])
+        self.assertAlmostEqual(resultado['distancia_km'], _fuerza_bruta(d, 6, 0, 7))
+
+
+@override_settings(METRICAS_HABILITADAS=False)
+class GeocodificacionTests(TestCase):
+    def setUp(self):
+        geocoding._lru.clear()
+
+    def _api(self, direccion, api_key):
+        if 'inexistente' in direccion:
+            raise geocoding.GeocodingError(f"No se pudo geocodificar la dirección: {direccion}.")
+        return (-36.8, -73.0 - len(direccion) / 100)
+
+    def test_normalizar(self):
+        self.assertEqual(geocoding.normalizar_direccion('  Av.  Prat 100 , Concepción. '), 'av. prat 100, concepción')
+
+    def test_lote_pide_cada_direccion_una_vez_y_separa_errores(self):
+        direcciones = ['Calle 1', 'calle  1', 'Calle 22', 'Calle inexistente', '']
+        with mock.patch('rutas.geocoding._consultar_api', side_effect=self._api) as api:
+            resultados, errores = geocoding.geocodificar_lote(direcciones, api_key='clave')
+        self.assertEqual(api.call_count, 3)
+        self.assertEqual(resultados['Calle 1'], resultados['calle  1'])
+        self.assertIn('Calle 22', resultados)
+        self.assertEqual(set(errores), {'Calle inexistente', ''})
+        self.assertEqual(
+            sorted(GeocodificacionCache.objects.values_list('direccion_normalizada', flat=True)),
+            ['calle 1', 'calle 22'],
+        )
+
+    def test_cache_en_memoria_y_en_bd(self):
+        with mock.patch('rutas.geocoding._consultar_api', side_effect=self._api) as api:
+            primera = geocoding.geocodificar('Calle 1', api_key='clave')
+            self.assertEqual(geocoding.geocodificar('CALLE 1', api_key='clave'), primera)  # LRU
+            geocoding._lru.clear()
+            self.assertEqual(geocoding.geocodificar('Calle 1', api_key='clave'), primera)  # tabla
+        self.assertEqual(api.call_count, 1)
+
+    def test_error_se_propaga(self):
+        with mock.patch('rutas.geocoding._consultar_api', side_effect=self._api):
+            with self.assertRaises(geocoding.GeocodingError):
+                geocoding.geocodificar('Calle inexistente', api_key='clave')
+        self.assertFalse(GeocodificacionCache.objects.exists())
+
+    def _respuestas(self, *respuestas):
+        """Sesión HTTP falsa que contesta (estado, cuerpo) en orden."""
+        def respuesta(estado, cuerpo):
+            r = requests.Response()
+            r.status_code, r._content = estado, cuerpo.encode()
+            return r
+
+        sesion = mock.Mock()
+        sesion.get.side_effect = [respuesta(*r) for r in respuestas]
+        return mock.patch('rutas.google_api.get_session', return_value=sesion)
+
+    def test_api_reintenta_cuota_excedida_y_429(self):
+        ok = json.dumps({'status': 'OK', 'results': [{'geometry': {'location': {'lat': -36.8, 'lng': -73.0}}}]})
+        with self._respuestas((429, ''), (200, '{"status": "OVER_QUERY_LIMIT"}'), (200, ok)), \
+                mock.patch('rutas.google_api.time.sleep') as espera:
+            self.assertEqual(geocoding.geocodificar('Calle 1', api_key='clave'), (-36.8, -73.0))
+        self.assertEqual(espera.call_count, 2)
+
+    def test_api_json_invalido_no_es_error_de_conexion(self):
+        with self._respuestas((200, '<html>')), self.assertRaises(geocoding.GeocodingError) as error:
+            geocoding.geocodificar('Calle 1', api_key='clave')
+        self.assertIn('JSON', str(error.exception))
+        self.assertNotIn('conexión', str(error.exception))
+
+    def test_lru_descarta_el_menos_usado(self):
+        lru = geocoding._LRU(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+
+class GuardarOrdenTests(TestCase):
+    def setUp(self):
+        self.puntos = [
+            PuntoEntrega.objects.create(nombre=f'P{i}', direccion=f'Calle {i}', latitud=-36.8, longitud=-73.0)
+            for i in range(5)
+        ]
+
+    def test_guarda_orden_en_pocas_consultas(self):
+        puntos = self.puntos[:4]  # el quinto no es parte de la optimización
+        PuntoEntrega.objects.filter(id=self.puntos[4].id).update(orden_optimo=7)
+        antes = PuntoEntrega.objects.get(id=puntos[0].id).actualizado
+        # inicio y fin de la transacción, un UPDATE con los 4 puntos y otro para los demás
+        with self.assertNumQueries(4):
+            pipeline.guardar_orden_optimo(puntos, [0, 3, 1, 4, 2, 5])
+        ordenes = dict(PuntoEntrega.objects.values_list('nombre', 'orden_optimo'))
+        self.assertEqual(ordenes, {'P0': 2, 'P1': 4, 'P2': 1, 'P3': 3, 'P4': None})
+        self.assertGreater(PuntoEntrega.objects.get(id=puntos[0].id).actualizado, antes)
+
+    def test_varias_rutas_y_puntos_sin_ruta(self):
+        camion, furgon = (Vehiculo.objects.create(nombre=n, capacidad_kg=100) for n in ('Camión', 'Furgón'))
+        pipeline.guardar_rutas(self.puntos, [(camion, [0, 2, 1, 6]), (furgon, [0, 4, 6])])
+        filas = {
+            nombre: (orden, vehiculo)
+            for nombre, orden, vehiculo in PuntoEntrega.objects.values_list('nombre', 'orden_optimo', 'vehiculo__nombre')
+        }
+        self.assertEqual(filas, {
+            'P0': (2, 'Camión'), 'P1': (1, 'Camión'), 'P2': (None, None),
+            'P3': (1, 'Furgón'), 'P4': (None, None),
+        })
+
+
+def _matriz_plano(n_nodos, semilla):
+    """Distancias euclidianas entre puntos al azar en un cuadrado de 20 km."""
+    xy = np.random.default_rng(semilla).uniform(0, 20, size=(n_nodos, 2))
+    return np.linalg.norm(xy[:, None] - xy[None, :], axis=2)
+
+
+class CvrpTests(SimpleTestCase):
+    def test_rutas_factibles(self):
+        for semilla in range(5):
+            n = 25
+            d = _matriz_plano(n + 1, semilla)
+            demandas = np.random.default_rng(semilla).integers(5, 30, size=n).tolist()
+            vehiculos = [
+                {'capacidad': 200, 'rendimiento_km_por_litro': 8},
+                {'capacidad': 150, 'rendimiento_km_por_litro': 12},
+                {'capacidad': 150, 'rendimiento_km_por_litro': 10},
+                {'capacidad': 100, 'rendimiento_km_por_litro': 15},
+            ]
+            resultado = optimizer.solve_cvrp(d, n, demandas, vehiculos)
+            self.assertIsNotNone(resultado)
+
+            visitados = []
+            for ruta in resultado['rutas']:
+                vehiculo = vehiculos[ruta['vehiculo']]
+                puntos = ruta['ruta'][1:-1]
+                self.assertEqual((ruta['ruta'][0], ruta['ruta'][-1]), (0, 0))
+                self.assertAlmostEqual(ruta['carga'], sum(demandas[i - 1] for i in puntos))
+                self.assertLessEqual(ruta['carga'], vehiculo['capacidad'])
+                self.assertAlmostEqual(ruta['distancia_km'], _costo(d, ruta['ruta']))
+                self.assertAlmostEqual(ruta['litros'], ruta['distancia_km'] / vehiculo['rendimiento_km_por_litro'])
+                visitados.extend(puntos)
+            self.assertEqual(sorted(visitados), list(range(1, n + 1)))
+            self.assertEqual(len({r['vehiculo'] for r in resultado['rutas']}), len(resultado['rutas']))
+            self.assertAlmostEqual(resultado['litros'], sum(r['litros'] for r in resultado['rutas']))
+
+    def test_con_destino_distinto(self):
+        d = _matriz_plano(8, semilla=1)
+        resultado = optimizer.solve_cvrp(d, 6, [10] * 6, [{'capacidad': 30, 'rendimiento_km_por_litro': 10}] * 2,
+                                         start_index=0, end_index=7)
+        self.assertEqual(len(resultado['rutas']), 2)
+        for ruta in resultado['rutas']:
+            self.assertEqual((ruta['ruta'][0], ruta['ruta'][-1]), (0, 7))
+
+    def test_flota_insuficiente(self):
+        d = _matriz_plano(5, semilla=2)
+        vehiculos = [{'capacidad': 50, 'rendimiento_km_por_litro': 10}]
+        self.assertIsNone(optimizer.solve_cvrp(d, 4, [10, 60, 10, 10], vehiculos))  # un punto no cabe
+        self.assertIsNone(optimizer.solve_cvrp(d, 4, [20, 20, 20, 20], vehiculos))  # la suma no cabe
+
+
+class VentanasHorariasTests(SimpleTestCase):
+    def _instancia(self, n, semilla):
+        rng = np.random.default_rng(semilla)
+        d = _matriz_plano(n + 1, semilla)
+        t = d * 120  # 30 km/h
+        inicio = rng.uniform(0, 3000, size=n + 1)
+        fin = inicio + rng.uniform(600, 4000, size=n + 1)
+        inicio[0], fin[0] = 0, np.inf
+        servicio = np.full(n + 1, 300.0)
+        servicio[0] = 0
+        return d, t, inicio, fin, servicio
+
+    def test_holgura_decide_igual_que_simular(self):
+        for semilla in range(10):
+            d, t, inicio, fin, servicio = self._instancia(9, semilla)
+            fin[1:6] += 20000  # la ruta de partida tiene que ser factible
+            ruta = [0, 1, 2, 3, 4, 5, 0]
+            candidatos = [6, 7, 8, 9]
+            _, factible = optimizer._inserciones(d, t, ruta, candidatos, inicio, fin, servicio)
+            for c, u in enumerate(candidatos):
+                for pos in range(len(ruta) - 1):
+                    nueva = np.array(ruta[:pos + 1] + [u] + ruta[pos + 1:])
+                    _, comienzo = optimizer._programar(nueva, t, inicio, servicio)
+                    self.assertEqual(factible[c, pos], bool((comienzo <= fin[nueva] + 1e-9).all()),
+                                     (semilla, u, pos))
+
+    def test_respeta_ventanas_factibles(self):
+        n = 8
+        d = _matriz_plano(n + 1, semilla=3)
+        t = d * 120
+        servicio = np.full(n + 1, 300.0)
+        servicio[0] = 0
+        # ventanas de una hora alrededor del horario de una ruta conocida
+        _, comienzo = optimizer._programar(np.arange(n + 1).tolist() + [0], t, np.zeros(n + 1), servicio)
+        inicio = np.concatenate(([0], comienzo[1:n + 1] - 1800))
+        fin = np.concatenate(([np.inf], comienzo[1:n + 1] + 1800))
+        resultado = optimizer.solve_tsptw(d, t, n, inicio, fin, servicio)
+
+        ruta = resultado['ruta']
+        self.assertEqual(resultado['atrasados'], [])
+        self.assertEqual(sorted(ruta[1:-1]), list(range(1, n + 1)))
+        llegada, comienzo = optimizer._programar(np.array(ruta), t, inicio, servicio)
+        np.testing.assert_allclose(resultado['llegadas'], llegada)
+        self.assertTrue((comienzo <= fin[ruta] + 1e-6).all())
+        self.assertAlmostEqual(resultado['distancia_km'], _costo(d, ruta))
+
+    def test_ventana_imposible_queda_atrasada(self):
+        d, t, inicio, fin, servicio = self._instancia(6, semilla=4)
+        fin[1:] = np.inf
+        inicio[1:] = 0
+        fin[3] = t[0, 3] / 2  # no se alcanza a llegar ni yendo directo
+        resultado = optimizer.solve_tsptw(d, t, 6, inicio, fin, servicio)
+        self.assertEqual(resultado['atrasados'], [3])
+        self.assertEqual(sorted(resultado['ruta'][1:-1]), list(range(1, 7)))
+
+
+class IncrementalTests(SimpleTestCase):
+    def setUp(self):
+        self.n = 30
+        self.d = _matriz_asimetrica(self.n + 3, semilla=7)  # origen, n puntos, destino y el nuevo
+        self.nuevo = self.n + 2
+        self.ruta = optimizer.resolver_ruta(self.d[:-1, :-1], self.n, 0, self.n + 1)['ruta']
+
+    def test_insertar_en_el_tramo_mas_barato(self):
+        resultado = optimizer.insertar_punto(self.d, self.ruta, self.nuevo, vecindario=0)
+        mejor = min(
+            (self.ruta[:k] + [self.nuevo] + self.ruta[k:] for k in range(1, len(self.ruta))),
+            key=lambda r: _costo(self.d, r),
+        )
+        self.assertEqual(resultado['ruta'], mejor)
+        self.assertAlmostEqual(resultado['distancia_km'], _costo(self.d, mejor))
+
+    def test_vecindario_solo_cambia_alrededor_y_no_empeora(self):
+        vecindario = 4
+        simple = optimizer.insertar_punto(self.d, self.ruta, self.nuevo, vecindario=0)['ruta']
+        pos = simple.index(self.nuevo)
+        reparada = optimizer.insertar_punto(self.d, self.ruta, self.nuevo, vecindario=vecindario)['ruta']
+        self.assertLessEqual(_costo(self.d, reparada), _costo(self.d, simple) + 1e-9)
+        self.assertEqual(reparada[:pos - vecindario + 1], simple[:pos - vecindario + 1])
+        self.assertEqual(reparada[pos + vecindario:], simple[pos + vecindario:])
+        self.assertEqual(sorted(reparada), sorted(simple))
+
+    def test_quitar_punto(self):
+        nodo = self.ruta[10]
+        sin_nodo = [i for i in self.ruta if i != nodo]
+        resultado = optimizer.quitar_punto(self.d, self.ruta, nodo, vecindario=3)
+        self.assertNotIn(nodo, resultado['ruta'])
+        self.assertEqual(sorted(resultado['ruta']), sorted(sin_nodo))
+        self.assertEqual((resultado['ruta'][0], resultado['ruta'][-1]), (0, self.n + 1))
+        self.assertLessEqual(resultado['distancia_km'], _costo(self.d, sin_nodo) + 1e-9)
+        self.assertEqual(resultado['ruta'][:7], sin_nodo[:7])  # vecindario: posiciones 6..12
+        self.assertEqual(resultado['ruta'][12:], sin_nodo[12:])
+
+
+class MatrizDistanciasTests(SimpleTestCase):
+    def setUp(self):
+        self.valores = [[0.0, 1.2346, float('inf')], [2.5, 0.0, 3.0004], [0.75, 4.0, 0.0]]
+
+    def test_float32_sin_copias(self):
+        matriz = MatrizDistancias(self.valores)
+        self.assertEqual(matriz.datos.dtype, np.float32)
+        self.assertEqual(matriz.nbytes, 9 * 4)
+        self.assertIs(np.asarray(matriz), matriz.datos)
+        self.assertEqual(len(matriz), 3)
+        self.assertAlmostEqual(float(matriz[0][1]), 1.2346, places=5)
+        with self.assertRaises(ValueError):
+            MatrizDistancias([[0.0, 1.0]])
+
+    def test_int32_en_metros(self):
+        matriz = MatrizDistancias(self.valores, escala=ESCALA_METROS)
+        self.assertEqual(matriz.datos.dtype, np.int32)
+        self.assertEqual(matriz.datos[0, 1], 1235)  # redondeado al metro
+        self.assertEqual(matriz.datos[0, 2], SIN_RUTA)
+        self.assertEqual(matriz[0, 2], float('inf'))
+        self.assertEqual(matriz[1, 2], 3.0)
+        np.testing.assert_allclose(matriz[1], [2.5, 0.0, 3.0])
+        valores = np.asarray(matriz, dtype=float)
+        self.assertTrue(np.isinf(valores[0, 2]))
+        np.testing.assert_allclose(valores[np.isfinite(valores)],
+                                   np.array(self.valores)[np.isfinite(self.valores)], atol=5e-4)
+
+    def test_submatriz_y_vista(self):
+        for escala in (None, ESCALA_METROS):
+            matriz = MatrizDistancias(self.valores, escala=escala)
+            sub = matriz.submatriz([2, 0])
+            self.assertEqual(sub.escala, escala)
+            np.testing.assert_allclose(np.asarray(sub), [[0.0, 0.75], [float('inf'), 0.0]], atol=5e-4)
+
+            vista = matriz.vista(1, 3)
+            self.assertTrue(np.shares_memory(vista.datos, matriz.datos))
+            np.testing.assert_allclose(np.asarray(vista), [[0.0, 3.0], [4.0, 0.0]], atol=5e-4)
+
+    def test_serializacion(self):
+        for escala in (None, ESCALA_METROS):
+            matriz = MatrizDistancias(self.valores, escala=escala)
+            copia = MatrizDistancias.desde_bytes(matriz.a_bytes(), escala=escala)
+            np.testing.assert_array_equal(copia.datos, matriz.datos)
+        with self.assertRaises(ValueError):
+            MatrizDistancias.desde_bytes(MatrizDistancias(self.valores, escala=ESCALA_METROS).a_bytes())
+
+    def test_optimizador_acepta_la_matriz(self):
+        d = _matriz_asimetrica(7, semilla=8)
+        esperado = optimizer.resolver_ruta(d, 5, 0, 6)['distancia_km']
+        matriz = MatrizDistancias(d, escala=ESCALA_METROS)
+        self.assertAlmostEqual(optimizer.resolver_ruta(matriz, 5, 0, 6)['distancia_km'], esperado, places=2)
+
+
+class BenchmarkInstanciasTests(SimpleTestCase):
+
+    def test_misma_semilla_misma_instancia(self):
+        a = benchmark.generar_instancia(30, 'santiago', 'agrupada', 'otra_bodega', semilla=3)
+        b = benchmark.generar_instancia(30, 'santiago', 'agrupada', 'otra_bodega', semilla=3)
+        c = benchmark.generar_instancia(30, 'santiago', 'agrupada', 'otra_bodega', semilla=4)
+        self.assertEqual(a['coordenadas'], b['coordenadas'])
+        self.assertEqual(a['demandas'], b['demandas'])
+        self.assertNotEqual(a['coordenadas'], c['coordenadas'])
+
+    def test_variantes_de_destino(self):
+        mismo = benchmark.generar_instancia(10, destino='mismo_origen')
+        otra = benchmark.generar_instancia(10, destino='otra_bodega')
+        self.assertEqual(len(mismo['coordenadas']), 12)
+        self.assertEqual(mismo['coordenadas'][0], mismo['coordenadas'][-1])
+        self.assertNotEqual(otra['coordenadas'][0], otra['coordenadas'][-1])
+
+    def test_matriz_sin_red(self):
+        instancia = benchmark.generar_instancia(20, 'concepcion', 'uniforme')
+        distancias, duraciones = benchmark.matrices_instancia(instancia)
+        self.assertEqual(len(distancias), 22)
+        self.assertEqual(distancias[0][0], 0)
+        self.assertGreater(duraciones[1][2], 0)
+
+
+class BenchmarkModosTests(SimpleTestCase):
+
+    def test_held_karp_es_la_mejor_conocida(self):
+        filas, _ = benchmark.correr_benchmark(
+            tamanos=(8,), modos=('held_karp', 'heuristico', 'incremental'),
+            ciudades=('concepcion',), distribuciones=('uniforme',), destinos=('mismo_origen',),
+        )
+        por_modo = {fila['modo']: fila for fila in filas}
+        self.assertEqual(por_modo['held_karp']['brecha_pct'], 0.0)
+        self.assertTrue(por_modo['held_karp']['optimo_probado'])
+        for fila in filas:
+            self.assertGreaterEqual(fila['brecha_pct'], 0.0)
+            self.assertAlmostEqual(fila['mejor_conocido_km'], por_modo['held_karp']['distancia_km'], places=3)
+
+    def test_todos_los_modos_reportan_metricas(self):
+        filas, mejores = benchmark.correr_benchmark(
+            tamanos=(12,), ciudades=('santiago',), distribuciones=('agrupada',),
+            destinos=('otra_bodega',), max_seconds=0.2,
+        )
+        self.assertEqual({fila['modo'] for fila in filas}, set(benchmark.MODOS))
+        for fila in filas:
+            self.assertGreater(fila['distancia_km'], 0)
+            self.assertGreater(fila['tiempo_s'], 0)
+            self.assertGreater(fila['memoria_pico_kb'], 0)
+            self.assertIsNotNone(fila['brecha_pct'])
+        self.assertEqual(
+            set(mejores),
+            {f"{filas[0]['instancia']}|{familia}" for familia in ('tsp', 'cvrp', 'ventanas')},
+        )
+
+    def test_held_karp_se_omite_en_instancias_grandes(self):
+        filas, _ = benchmark.correr_benchmark(
+            tamanos=(30,), modos=('held_karp', 'heuristico'), ciudades=('concepcion',),
+            distribuciones=('uniforme',), destinos=('mismo_origen',),
+        )
+        self.assertEqual([fila['modo'] for fila in filas], ['heuristico'])
+
+    def test_mejores_conocidos_anteriores(self):
+        filas, _ = benchmark.correr_benchmark(
+            tamanos=(6,), modos=('heuristico',), ciudades=('concepcion',),
+            distribuciones=('uniforme',), destinos=('mismo_origen',),
+        )
+        clave = f"{filas[0]['instancia']}|tsp"
+        mejores = benchmark.calcular_brechas(filas, {clave: filas[0]['distancia_km'] / 2})
+        self.assertEqual(mejores[clave], filas[0]['distancia_km'] / 2)
+        self.assertAlmostEqual(filas[0]['brecha_pct'], 100.0)
+
+    def test_paralelo_no_empeora_la_heuristica(self):
+        instancia = benchmark.generar_instancia(40, 'santiago', 'agrupada', 'otra_bodega', semilla=2)
+        distancias, _ = benchmark.matrices_instancia(instancia)
+        n = instancia['n']
+        serie = optimizer.resolver_ruta(distancias, n, 0, n + 1, metodo='heuristico')
+        paralelo = optimizer.resolver_ruta_paralelo(distancias, n, 0, n + 1, procesos=2, arranques=3)
+
+        self.assertEqual(paralelo['metodo'], 'paralelo')
+        self.assertEqual(paralelo['arranques'], 3)
+        self.assertEqual(sorted(paralelo['ruta']), list(range(n + 2)))
+        self.assertEqual((paralelo['ruta'][0], paralelo['ruta'][-1]), (0, n + 1))
+        self.assertLessEqual(paralelo['distancia_km'], serie['distancia_km'] + 1e-6)
+
+
+class BenchmarkSalidaTests(SimpleTestCase):
+
+    def _filas(self):
+        filas, _ = benchmark.correr_benchmark(
+            tamanos=(5,), modos=('heuristico', 'anytime'), ciudades=('concepcion',),
+            distribuciones=('uniforme',), destinos=('mismo_origen',), max_seconds=0.05,
+        )
+        return filas
+
+    def test_json_y_csv(self):
+        filas = self._filas()
+        salida_json, salida_csv = io.StringIO(), io.StringIO()
+        benchmark.escribir_json(filas, salida_json)
+        benchmark.escribir_csv(filas, salida_csv)
+
+        self.assertEqual(json.loads(salida_json.getvalue()), filas)
+        leidas = list(csv.DictReader(io.StringIO(salida_csv.getvalue())))
+        self.assertEqual(len(leidas), len(filas))
+        self.assertEqual(tuple(leidas[0]), benchmark.COLUMNAS_CSV)
+
+    def test_comando_benchmark_solver(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            rutas = {nombre: os.path.join(carpeta, nombre) for nombre in ('b.json', 'b.csv', 'mejores.json')}
+            call_command(
+                'benchmark_solver', tamanos='5,8', modos='heuristico,held_karp',
+                ciudades='concepcion', distribuciones='uniforme', destinos='mismo_origen',
+                json=rutas['b.json'], csv=rutas['b.csv'], mejores=rutas['mejores.json'],
+                stdout=io.StringIO(),
+            )
+            with open(rutas['b.json'], encoding='utf-8') as archivo:
+                self.assertEqual(len(json.load(archivo)), 4)
+            with open(rutas['mejores.json'], encoding='utf-8') as archivo:
+                self.assertEqual(len(json.load(archivo)), 2)
+
+
+class MetricasTests(SimpleTestCase):
+
+    def setUp(self):
+        metricas.reiniciar()
+
+    def test_span_alimenta_histograma_y_log(self):
+        with self.assertLogs('rutas.metricas', level='INFO') as logs:
+            with metricas.span('matriz', incremental=True) as datos:
+                datos['proveedor'] = 'haversine'
+        self.assertIn('etapa=matriz', logs.output[0])
+        self.assertIn('proveedor=haversine', logs.output[0])
+
+        texto = metricas.exportar_prometheus()
+        self.assertIn('# TYPE rutas_etapa_segundos histogram', texto)
+        self.assertIn('rutas_etapa_segundos_bucket{etapa="matriz",incremental="True",le="+Inf"} 1', texto)
+        self.assertIn('rutas_etapa_segundos_count{etapa="matriz",incremental="True"} 1', texto)
+
+    def test_span_con_error(self):
+        with self.assertLogs('rutas.metricas', level='INFO'):
+            with self.assertRaises(ValueError):
+                with metricas.span('geocodificacion'):
+                    raise ValueError('sin conexión')
+        self.assertIn('rutas_etapa_errores_total{etapa="geocodificacion"} 1', metricas.exportar_prometheus())
+
+    def test_contadores(self):
+        metricas.incrementar('rutas_api_bytes_total', 100, api='geocoding')
+        metricas.incrementar('rutas_api_bytes_total', 50, api='geocoding')
+        self.assertIn('rutas_api_bytes_total{api="geocoding"} 150', metricas.exportar_prometheus())
+
+    @override_settings(METRICAS_HABILITADAS=False)
+    def test_deshabilitadas(self):
+        with metricas.span('matriz'):
+            metricas.incrementar('rutas_api_solicitudes_total')
+        self.assertEqual(metricas.exportar_prometheus(), '\n')
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_endpoint(self):
+        metricas.incrementar('rutas_api_solicitudes_total', api='distance_matrix')
+        respuesta = self.client.get('/metrics')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'rutas_api_solicitudes_total{api="distance_matrix"} 1', respuesta.content)
+
+
+class CacheSolucionesTests(SimpleTestCase):
+
+    parametros = {
+        'direccion_origen': 'Díaz de Solís 1879, Concepción',
+        'direccion_destino': 'Díaz de Solís 1879, Concepción',
+        'rendimiento_vehiculo': 10,
+        'precio_bencina': 1300,
+        'max_seconds': 5,
+        'hora_salida': '08:00',
+    }
+
+    def _puntos(self, coordenadas):
+        return [
+            PuntoEntrega(nombre=f'P{i}', direccion='', latitud=lat, longitud=lng)
+            for i, (lat, lng) in enumerate(coordenadas)
+        ]
+
+    def test_clave_no_depende_del_orden_ni_del_precio(self):
+        puntos = self._puntos([(-36.8, -73.0), (-36.7, -73.1), (-36.9, -73.2)])
+        clave, orden = cache_soluciones.clave_solicitud(self.parametros, puntos, [])
+        otra, orden_otra = cache_soluciones.clave_solicitud(
+            {**self.parametros, 'precio_bencina': 1500, 'rendimiento_vehiculo': 8},
+            list(reversed(puntos)), [],
+        )
+        self.assertEqual(clave, otra)
+        self.assertEqual([puntos[i] for i in orden], [list(reversed(puntos))[i] for i in orden_otra])
+
+        cambiada = cache_soluciones.clave_solicitud({**self.parametros, 'max_seconds': 10}, puntos, [])[0]
+        self.assertNotEqual(clave, cambiada)
+        puntos[0].demanda_kg = 5
+        self.assertNotEqual(clave, cache_soluciones.clave_solicitud(self.parametros, puntos, [])[0])
+
+    def test_ruta_en_orden_canonico(self):
+        puntos = self._puntos([(-36.7, -73.0), (-36.9, -73.0), (-36.8, -73.0)])
+        _, orden = cache_soluciones.clave_solicitud(self.parametros, puntos, [])
+        self.assertEqual(orden, [0, 2, 1])
+        self.assertEqual(cache_soluciones.indices_canonicos(orden), [0, 1, 3, 2, 4])
+        # ruta origen -> P0 -> P2 -> P1 -> destino: en orden canónico es la identidad
+        self.assertEqual(cache_soluciones.a_canonico([0, 1, 3, 2, 4], orden), [0, 1, 2, 3, 4])
+        self.assertEqual(cache_soluciones.a_canonico([0, 2, 1, 3, 4], orden), [0, 3, 1, 2, 4])
+
+
+@override_settings(DISTANCIA_PROVEEDORES=['haversine'])
+class DescomposicionTests(SimpleTestCase):
+
+    def _puntos(self, n, semilla=0):
+        instancia = benchmark.generar_instancia(n, 'santiago', 'agrupada', 'otra_bodega', semilla=semilla)
+        origen, *coordenadas, destino = instancia['coordenadas']
+        puntos = [PuntoEntrega(nombre=f'P{i}', **c) for i, c in enumerate(coordenadas)]
+        return puntos, origen, destino
+
+    def test_grupos_acotados_y_completos(self):
+        puntos, _, _ = self._puntos(300)
+        coordenadas = np.radians([[float(p.latitud), float(p.longitud)] for p in puntos])
+        grupos = descomposicion.agrupar(coordenadas, 40)
+        self.assertTrue(all(len(g) <= 40 for g in grupos))
+        self.assertEqual(sorted(np.concatenate(grupos).tolist()), list(range(300)))
+
+    def test_ruta_unida_visita_todo_una_vez(self):
+        puntos, origen, destino = self._puntos(120)
+        resultado, proveedor = descomposicion.resolver(puntos, origen, destino, tamano_grupo=25)
+        self.assertEqual(proveedor, 'haversine')
+        self.assertGreaterEqual(resultado['grupos'], 5)
+        self.assertEqual((resultado['ruta'][0], resultado['ruta'][-1]), (0, 121))
+        self.assertEqual(sorted(resultado['ruta'][1:-1]), list(range(1, 121)))
+        # solo las matrices por zona: bastante menos que la completa
+        self.assertLess(resultado['tramos_consultados'], 122 ** 2 / 3)
+
+        # la distancia informada es la de la ruta unida
+        distancias, _ = benchmark.matrices_instancia(benchmark.generar_instancia(
+            120, 'santiago', 'agrupada', 'otra_bodega', semilla=0))
+        real = sum(distancias[a][b] for a, b in zip(resultado['ruta'], resultado['ruta'][1:]))
+        self.assertAlmostEqual(resultado['distancia_km'], real, places=2)
+
+
+class EspacialTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.coordenadas = np.column_stack((-36.9 + rng.random(2000) * 0.2, -73.1 + rng.random(2000) * 0.2))
+        # un barrio denso para que haya celdas muy pobladas
+        self.coordenadas[:200] = self.coordenadas[0] + rng.random((200, 2)) * 0.001
+        self.indice = espacial.IndiceEspacial(self.coordenadas)
+
+    def test_k_cercanos_igual_a_fuerza_bruta(self):
+        km = np.array([self.indice._km_por_grado_lat, self.indice._km_por_grado_lng])
+        for i in range(0, 2000, 37):
+            distancias = np.hypot(*((self.coordenadas - self.coordenadas[i]) * km).T)
+            distancias[i] = np.inf
+            vecinos = self.indice.k_cercanos(*self.coordenadas[i], 8, excluir=i)
+            np.testing.assert_allclose(distancias[vecinos], np.sort(distancias)[:8])
+        # lejos de todos los puntos
+        self.assertEqual(len(self.indice.k_cercanos(0.0, 0.0, 3)), 3)
+
+    def test_rectangulo(self):
+        sur, oeste, norte, este = -36.85, -73.05, -36.8, -73.0
+        lat, lng = self.coordenadas.T
+        esperados = np.flatnonzero((lat >= sur) & (lat <= norte) & (lng >= oeste) & (lng <= este))
+        np.testing.assert_array_equal(self.indice.en_rectangulo(sur, oeste, norte, este), esperados)
+
+    def test_listas_vecinos_y_lectura_de_zona(self):
+        vecinos = espacial.IndiceEspacial([(-36.8, -73.0), (-36.81, -73.0), (-36.9, -73.0)]).listas_vecinos(1)
+        self.assertEqual(vecinos[:, 0].tolist(), [1, 0, 1])
+        self.assertEqual(espacial.leer_rectangulo('-36.9,-73.1,-36.8,-73'), (-36.9, -73.1, -36.8, -73.0))
+        with self.assertRaises(ValueError):
+            espacial.leer_rectangulo('-36.8,-73.1,-36.9,-73')
+
+    def test_insercion_solo_junto_a_los_vecinos(self):
+        coordenadas = self.coordenadas[200:400]
+        indice = espacial.IndiceEspacial(coordenadas[:-1])
+        xy = coordenadas * [indice._km_por_grado_lat, indice._km_por_grado_lng]
+        d = np.hypot(*(xy[:, None] - xy[None]).transpose(2, 0, 1))
+        ruta = optimizer.resolver_ruta(d[:-1, :-1], 197, 0, 198)['ruta']
+        nuevo = 199
+        cercanos = indice.k_cercanos(*coordenadas[nuevo], 8)
+        completo = optimizer.insertar_punto(d, ruta, nuevo, vecindario=0)
+        con_vecinos = optimizer.insertar_punto(d, ruta, nuevo, vecindario=0, candidatos=cercanos)
+        self.assertIn(nuevo, con_vecinos['ruta'])
+        self.assertAlmostEqual(con_vecinos['distancia_km'], completo['distancia_km'], places=6)
+
+
+class GeometriaTests(SimpleTestCase):
+    def test_polilinea_ida_y_vuelta(self):
+        # ejemplo de la documentación de Google
+        coordenadas = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(geometria.codificar_polilinea(coordenadas), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(geometria.decodificar_polilinea('_p~iF~ps|U_ulLnnqC_mqNvxq`@'), coordenadas)
+
+    def test_tramos_comparten_extremos(self):
+        self.assertEqual(geometria.tramos(2), [(0, 1)])
+        self.assertEqual(geometria.tramos(60, max_waypoints=25), [(0, 26), (26, 52), (52, 59)])
+        self.assertEqual(geometria.tramos(1), [])
+
+    def test_sin_clave_api_queda_en_linea_recta(self):
+        paradas = [(-36.8, -73.0), (-36.81, -73.01), (-36.82, -73.02)]
+        trazados, fuente = geometria.trazar_rutas([paradas, paradas[:2]], api_key='')
+        self.assertEqual(fuente, 'linea_recta')
+        self.assertEqual(geometria.decodificar_polilinea(trazados[0]['polilinea']), paradas)
+        self.assertEqual(geometria.decodificar_polilinea(trazados[1]['polilinea']), paradas[:2])
+
+    def test_reintentos_se_cuentan_como_directions(self):
+        metricas.reiniciar()
+        limitada = mock.Mock(status_code=429, content=b'')
+        correcta = mock.Mock(status_code=200, content=b'{}')
+        correcta.json.return_value = {
+            'status': 'OK', 'routes': [{'overview_polyline': {'points': '_p~iF~ps|U_ulLnnqC'}}],
+        }
+        sesion = mock.Mock()
+        sesion.get.side_effect = [limitada, correcta]
+        with mock.patch('rutas.google_api.get_session', return_value=sesion), \
+                mock.patch('rutas.google_api.ESPERA_BASE_REINTENTO', 0):
+            _, fuente = geometria.trazar_rutas([[(38.5, -120.2), (40.7, -120.95)]], api_key='x')
+        self.assertEqual(fuente, 'google')
+        texto = metricas.exportar_prometheus()
+        self.assertIn('rutas_api_reintentos_total{api="directions"} 1', texto)
+        self.assertIn('rutas_api_solicitudes_total{api="directions"} 2', texto)
+        self.assertNotIn('api="distance_matrix"', texto)
+
+    def test_actualizacion_solo_pide_los_tramos_que_cambiaron(self):
+        def por_calles(url, paradas, api_key):
+            # un trazado falso: las paradas con un punto intermedio en cada tramo
+            puntos = []
+            for (a, b), (c, d) in zip(paradas, paradas[1:]):
+                puntos += [(a, b), (round((a + c) / 2, 5), round((b + d) / 2, 5))]
+            return puntos + [paradas[-1]]
+
+        paradas = [(round(-36.8 - i * 0.001, 5), round(-73.0 + i * 0.0007, 5)) for i in range(80)]
+        with mock.patch('rutas.geometria._pedir_tramo', side_effect=por_calles) as pedir:
+            anteriores, _ = geometria.trazar_rutas([paradas], api_key='x')
+            self.assertEqual(pedir.call_count, 4)
+
+            nuevas = paradas[:40] + [(-36.9, -73.1)] + paradas[40:]
+            pedir.reset_mock()
+            trazados, fuente = geometria.trazar_rutas([nuevas], api_key='x', anteriores=anteriores)
+            # solo el tramo con el punto nuevo (28 paradas: no caben en una solicitud)
+            self.assertEqual(pedir.call_count, 2)
+            completo, _ = geometria.trazar_rutas([nuevas], api_key='x')
+
+        self.assertEqual(fuente, 'google')
+        self.assertEqual(trazados[0]['polilinea'], completo[0]['polilinea'])
+        self.assertEqual(len(geometria.decodificar_polilinea(trazados[0]['polilinea'])), 2 * len(nuevas) - 1)
+
+
+class PuntosApiTests(TestCase):
+    def setUp(self):
+        for i in range(5):
+            PuntoEntrega.objects.create(
+                nombre=f'P{i}', direccion=f'd{i}', latitud=-36.80 - i * 0.01, longitud=-73.05
+            )
+        self.url = reverse('puntos_api')
+
+    def test_paginas_con_cursor(self):
+        ids = []
+        url = self.url + '?limite=2'
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['puntos']), 2)
+            ids += [p['id'] for p in data['puntos']]
+            url = data['siguiente']
+        self.assertEqual(ids, sorted(PuntoEntrega.objects.values_list('id', flat=True)))
+
+    def test_zona(self):
+        data = self.client.get(self.url, {'zona': '-36.825,-73.1,-36.795,-73.0'}).json()
+        self.assertEqual([p['nombre'] for p in data['puntos']], ['P0', 'P1', 'P2'])
+        self.assertEqual(self.client.get(self.url, {'zona': 'x'}).status_code, 400)
+
+    def test_etag_y_last_modified(self):
+        respuesta = self.client.get(self.url)
+        etag = respuesta['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=respuesta['Last-Modified']).status_code, 304
+        )
+
+        # borrar o modificar un punto cambia la versión
+        PuntoEntrega.objects.first().delete()
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['total'], 4)
+        etag = respuesta['ETag']
+        punto = PuntoEntrega.objects.first()
+        punto.orden_optimo = 1
+        punto.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(DISTANCIA_PROVEEDORES=['haversine'], GOOGLE_MAPS_API_KEY='', METRICAS_HABILITADAS=False)
+class RutaPlanTests(TestCase):
+    def setUp(self):
+        for i in range(6):
+            PuntoEntrega.objects.create(
+                nombre=f'P{i}', direccion=f'd{i}', latitud=-36.80 - i * 0.01, longitud=-73.05 + i * 0.003
+            )
+        self.datos = {
+            'origen_predefinido': 'Bodega Uno', 'destino_predefinido': 'same_origin',
+            'rendimiento_vehiculo': '10', 'precio_bencina': '1300', 'max_seconds': '1',
+        }
+
+    def test_optimizar_guarda_plan_y_reabrirlo_no_resuelve(self):
+        with mock.patch('rutas.geocoding._consultar_api', return_value=(-36.8, -73.0)):
+            respuesta = self.client.post(reverse('optimizar_ruta'), self.datos)
+        plan = RutaPlan.objects.get()
+        self.assertEqual(respuesta['Location'], f"{reverse('mapa')}?plan={plan.id}")
+        self.assertEqual(plan.bodega, 'Bodega Uno')
+        self.assertEqual([p['orden_optimo'] for p in plan.paradas], list(range(1, 7)))
+        self.assertIn('optimizacion', plan.resultado['duraciones'])
+        self.assertIsNotNone(plan.matriz)
+
+        with mock.patch('rutas.views.ejecutar_optimizacion', side_effect=AssertionError):
+            for _ in range(2):
+                pagina = self.client.get(reverse('mapa'), {'plan': plan.id})
+                self.assertContains(pagina, f'Plan #{plan.id}')
+                self.assertContains(pagina, 'id="total-distancia"')
+
+        historial = self.client.get(reverse('planes'), {'bodega': 'Bodega Uno'})
+        self.assertContains(historial, f'?plan={plan.id}')
+        self.assertContains(self.client.get(reverse('mapa'), {'plan': 999}), 'El plan indicado no existe.')
+
+    def test_borrar_punto_guarda_plan_con_duracion_de_guardado(self):
+        with mock.patch('rutas.geocoding._consultar_api', return_value=(-36.8, -73.0)):
+            self.client.post(reverse('optimizar_ruta'), self.datos)
+        punto = PuntoEntrega.objects.first()
+        respuesta = self.client.post(reverse('borrar_punto', args=[punto.id])).json()
+        self.assertTrue(respuesta['ruta_actualizada'])
+        plan = RutaPlan.objects.get(id=respuesta['plan_id'])
+        self.assertEqual(len(plan.paradas), 5)
+        self.assertIn('guardado', plan.resultado['duraciones'])
+
+    def test_rutas_grandes_usan_listas_de_vecinos(self):
+        for i in range(6, optimizer.HELD_KARP_MAX_PUNTOS + 2):
+            PuntoEntrega.objects.create(
+                nombre=f'P{i}', direccion=f'd{i}', latitud=-36.80 - i * 0.002, longitud=-73.05 + (i % 5) * 0.004
+            )
+        n = PuntoEntrega.objects.count()
+        with mock.patch('rutas.geocoding._consultar_api', return_value=(-36.8, -73.0)), \
+                mock.patch('rutas.optimizer.resolver_ruta', wraps=optimizer.resolver_ruta) as resolver:
+            self.client.post(reverse('optimizar_ruta'), self.datos)
+        self.assertEqual(resolver.call_args.kwargs['vecinos'].shape, (n + 2, optimizer.VECINOS_BUSQUEDA))
+        self.assertEqual(
+            sorted(PuntoEntrega.objects.values_list('orden_optimo', flat=True)), list(range(1, n + 1))
+        )
+
+    def test_si_falla_la_reoptimizacion_el_punto_queda_y_se_descarta_la_ruta(self):
+        with mock.patch('rutas.geocoding._consultar_api', return_value=(-36.8, -73.0)):
+            self.client.post(reverse('optimizar_ruta'), self.datos)
+        self.assertTrue(EstadoRuta.objects.exists())
+
+        punto = PuntoEntrega.objects.first()
+        with mock.patch('rutas.views.reoptimizar_quitado', side_effect=RuntimeError('sin red')), \
+                self.assertLogs('rutas.views', 'ERROR'):
+            respuesta = self.client.post(reverse('borrar_punto', args=[punto.id]))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json(), {'ok': True, 'ruta_actualizada': False})
+        self.assertFalse(PuntoEntrega.objects.filter(id=punto.id).exists())
+        self.assertFalse(EstadoRuta.objects.exists())
+
+        with mock.patch('rutas.views.reoptimizar_agregado', side_effect=RuntimeError('sin red')), \
+                self.assertLogs('rutas.views', 'ERROR'):
+            respuesta = self.client.post(reverse('agregar_punto'), {
+                'nombre': 'Nuevo', 'direccion': 'd9', 'latitud': '-36.83', 'longitud': '-73.04',
+            })
+        self.assertRedirects(respuesta, reverse('mapa'), fetch_redirect_response=False)
+        self.assertTrue(PuntoEntrega.objects.filter(nombre='Nuevo').exists())
+
+    def test_agregar_punto_actualiza_la_ruta_vigente(self):
+        with mock.patch('rutas.geocoding._consultar_api', return_value=(-36.8, -73.0)):
+            self.client.post(reverse('optimizar_ruta'), self.datos)
+        nuevo = PuntoEntrega.objects.create(nombre='Nuevo', direccion='d6', latitud=-36.83, longitud=-73.04)
+        with mock.patch('rutas.optimizer.resolver_ruta', side_effect=AssertionError):  # no se resuelve de nuevo
+            resultado = pipeline.reoptimizar_agregado(nuevo)
+        self.assertIsNotNone(resultado)
+        self.assertEqual(
+            sorted(PuntoEntrega.objects.values_list('orden_optimo', flat=True)), list(range(1, 8))
+        )
+        self.assertEqual(RutaPlan.objects.count(), 2)
+        self.assertEqual(len(RutaPlan.objects.latest('id').paradas), 7)
+
+
+@override_settings(DISTANCIA_PROVEEDORES=['haversine'], GOOGLE_MAPS_API_KEY='', METRICAS_HABILITADAS=False,
+                   ESCENARIOS_PROCESOS=1)
+class EscenariosTests(TestCase):
+    def test_consumo_vectorizado(self):
+        litros = optimizer.calculate_fuel_cost(np.array([[120.0], [60.0]]), np.array([[12.0, 0.0]]))
+        np.testing.assert_array_equal(litros, [[10.0, np.inf], [5.0, np.inf]])
+        self.assertEqual(optimizer.calculate_fuel_cost(120, 12), 10.0)
+
+    def test_grilla(self):
+        for i in range(5):
+            PuntoEntrega.objects.create(
+                nombre=f'P{i}', direccion=f'd{i}', latitud=-36.80 - i * 0.01, longitud=-73.05 + i * 0.003
+            )
+        coordenadas = {'Bodega A': (-36.8, -73.0), 'Bodega B': (-36.9, -73.1)}
+        parametros = {
+            'origenes': ['Bodega A', 'Bodega B'], 'destinos': ['same_origin', 'Bodega A'],
+            'precios': [1250, 1400], 'rendimientos': [10, 12, 14], 'max_seconds': 1,
+        }
+        with mock.patch('rutas.geocoding._consultar_api', side_effect=lambda d, k: coordenadas[d]):
+            resultado = escenarios.evaluar(parametros)
+
+        # (A, A), (B, B) y (B, A): el precio y el rendimiento no cambian la ruta
+        self.assertEqual(len(resultado['problemas']), 3)
+        self.assertEqual(len(resultado['filas']), 3 * 3 * 2)
+        costos = [f['costo_clp'] for f in resultado['filas']]
+        self.assertEqual(costos, sorted(costos))
+        mas_barata = resultado['filas'][0]
+        self.assertEqual((mas_barata['rendimiento'], mas_barata['precio']), (14.0, 1250.0))
+        self.assertFalse(PuntoEntrega.objects.filter(orden_optimo__isnull=False).exists())
+
+
+@override_settings(DISTANCIA_PROVEEDORES=['haversine'], GOOGLE_MAPS_API_KEY='', METRICAS_HABILITADAS=False)
+class SeleccionBodegasTests(TestCase):
+    def setUp(self):
+        geocoding._lru.clear()  # (las bodegas reales tienen coordenadas distintas en cada test)
+
+    def test_cotas_no_superan_el_optimo_y_elige_el_mejor_par(self):
+        rng = np.random.default_rng(3)
+        xy = rng.random((3 + 6, 2)) * 10
+        d = np.hypot(*(xy[:, None] - xy[None]).transpose(2, 0, 1)) * (1 + 0.3 * rng.random((9, 9)))
+        np.fill_diagonal(d, 0)
+        matriz = MatrizDistancias(d)
+        pares = [(o, t) for o in range(3) for t in range(3)]
+        optimos = [
+            optimizer.resolver_ruta(matriz.submatriz([o, 3, 4, 5, 6, 7, 8, t]), 6, 0, 7)['distancia_km']
+            for o, t in pares
+        ]
+        cotas = seleccion_bodegas.cotas_inferiores(matriz, 3, pares)
+        self.assertTrue(np.all(cotas <= np.array(optimos) + 1e-4))
+
+        eleccion = seleccion_bodegas.elegir(matriz, 3, pares)
+        self.assertAlmostEqual(eleccion['resultado']['distancia_km'], min(optimos), places=4)
+        self.assertEqual(eleccion['par'], int(np.argmin(optimos)))
+
+    def test_optimizar_con_la_bodega_mas_conveniente(self):
+        for i in range(5):
+            PuntoEntrega.objects.create(
+                nombre=f'P{i}', direccion=f'd{i}', latitud=-36.80 - i * 0.01, longitud=-73.05 + i * 0.003
+            )
+        coordenadas = {
+            'Avenida Laguna Grande 1120, Casa 36, San Pedro de la Paz': (-37.2, -73.5),
+            'Díaz de Solís 1879, Concepción': (-36.82, -73.045),
+            'Camino Los Carros 1955, Concepción': (-36.5, -72.7),
+        }
+        datos = {
+            'origen_predefinido': 'auto', 'destino_predefinido': 'same_origin',
+            'rendimiento_vehiculo': '10', 'precio_bencina': '1300', 'max_seconds': '1',
+        }
+        with mock.patch('rutas.geocoding._consultar_api', side_effect=lambda d, k: coordenadas[d]):
+            self.client.post(reverse('optimizar_ruta'), datos)
+
+        plan = RutaPlan.objects.get()
+        self.assertEqual((plan.bodega, plan.destino), ('Díaz de Solís 1879, Concepción',) * 2)
+        seleccion = plan.resultado['seleccion_bodegas']
+        # las bodegas lejanas se descartan por su cota, sin resolverlas
+        self.assertEqual((seleccion['resueltos'], seleccion['descartados']), (1, 2))
+        self.assertEqual(len(plan.paradas), 5)
+
+    def test_sin_par_alcanzable(self):
+        d = np.full((5, 5), np.inf)
+        np.fill_diagonal(d, 0)
+        pares = [(0, 0), (0, 1), (1, 1)]
+        self.assertIsNone(seleccion_bodegas.elegir(MatrizDistancias(d), 2, pares))
+
+        puntos = [PuntoEntrega(nombre=f'P{i}', latitud=-36.8, longitud=-73.0) for i in range(3)]
+        parametros = {'pares_bodegas': [['A', 'A'], ['A', 'B'], ['B', 'B']], 'max_seconds': 1}
+        with mock.patch('rutas.pipeline.matriz_con_bodegas', return_value=({}, MatrizDistancias(d), 'haversine')):
+            with self.assertRaisesMessage(OptimizacionError, 'Ningún par de bodegas'):
+                pipeline._elegir_bodegas(puntos, parametros, {}, lambda fraccion, etapa: None)
+
+    def test_cache_por_pares_y_sin_resumen_de_eleccion(self):
+        for i in range(4):
+            PuntoEntrega.objects.create(
+                nombre=f'P{i}', direccion=f'd{i}', latitud=-36.80 - i * 0.01, longitud=-73.05 + i * 0.003
+            )
+        datos = {
+            'origen_predefinido': 'auto', 'destino_predefinido': 'same_origin',
+            'rendimiento_vehiculo': '10', 'precio_bencina': '1300', 'max_seconds': '1',
+        }
+        with mock.patch('rutas.geocoding._consultar_api', return_value=(-36.8, -73.0)):
+            self.client.post(reverse('optimizar_ruta'), datos)
+            # la segunda vez acierta en la cache antes de geocodificar o elegir
+            with mock.patch('rutas.pipeline._elegir_bodegas', side_effect=AssertionError):
+                self.client.post(reverse('optimizar_ruta'), datos)
+        primero, segundo = RutaPlan.objects.order_by('id')
+        self.assertIn('seleccion_bodegas', primero.resultado)
+        self.assertNotIn('seleccion_bodegas', segundo.resultado)
+        self.assertTrue(segundo.resultado['solver_info']['desde_cache'])
+        self.assertEqual(segundo.bodega, primero.bodega)
@@ -0,0 +1,193 @@
+# trabajos.py
+"""
+Cola de trabajos de optimización guardada en la BD (sin broker externo).
+
+La vista encola con encolar(); un proceso aparte (comando procesar_trabajos)
+toma los pendientes y los ejecuta en un pool de procesos. Si un worker muere
+sin guardar el resultado, el trabajo queda con error en vez de 'en proceso'.
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import escenarios
+from . import metricas
+from .models import TrabajoOptimizacion
+from .pipeline import OptimizacionError, ejecutar_optimizacion
+
+logger = logging.getLogger(__name__)
+
+
+def encolar(parametros):
+    """Crea un trabajo pendiente con los parámetros de la optimización."""
+    return TrabajoOptimizacion.objects.create(parametros=parametros)
+
+
+def reclamar_siguiente():
+    """
+    Marca como 'en proceso' el trabajo pendiente más antiguo y devuelve su id
+    (o None si no hay). El UPDATE condicionado al estado evita que dos
+    workers tomen el mismo trabajo.
+    """
+    pendientes = TrabajoOptimizacion.objects.filter(estado=TrabajoOptimizacion.PENDIENTE)
+    for trabajo_id in pendientes.order_by('creado').values_list('id', flat=True)[:10]:
+        with transaction.atomic():
+            tomado = TrabajoOptimizacion.objects.filter(
+                id=trabajo_id, estado=TrabajoOptimizacion.PENDIENTE
+            ).update(estado=TrabajoOptimizacion.EN_PROCESO, iniciado=timezone.now())
+        if tomado:
+            return trabajo_id
+    return None
+
+
+def marcar_error(trabajo_id, mensaje):
+    """Marca con error un trabajo que sigue 'en proceso' (no pisa uno ya terminado)."""
+    return TrabajoOptimizacion.objects.filter(
+        id=trabajo_id, estado=TrabajoOptimizacion.EN_PROCESO
+    ).update(estado=TrabajoOptimizacion.ERROR, error=mensaje, terminado=timezone.now())
+
+
+def recuperar_interrumpidos(timeout=None):
+    """
+    Marca con error los trabajos 'en proceso' iniciados hace más de 'timeout'
+    segundos (por defecto TRABAJO_TIMEOUT_SEGUNDOS): su worker se detuvo sin
+    terminarlos. Devuelve cuántos se marcaron.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'TRABAJO_TIMEOUT_SEGUNDOS', 3600)
+    limite = timezone.now() - timedelta(seconds=timeout)
+    marcados = TrabajoOptimizacion.objects.filter(
+        estado=TrabajoOptimizacion.EN_PROCESO, iniciado__lt=limite
+    ).update(
+        estado=TrabajoOptimizacion.ERROR,
+        error="El trabajo se interrumpió antes de terminar; vuelve a optimizar.",
+        terminado=timezone.now(),
+    )
+    if marcados:
+        logger.warning("%s trabajos interrumpidos marcados con error", marcados)
+    return marcados
+
+
+def ejecutar_trabajo(trabajo_id):
+    """Ejecuta un trabajo ya reclamado y guarda su resultado (corre en el worker)."""
+    try:
+        _ejecutar(trabajo_id)
+    finally:
+        connections.close_all()
+
+
+def ejecutar_ahora(parametros):
+    """Crea un trabajo y lo ejecuta en este mismo proceso (modo sincrónico)."""
+    trabajo = TrabajoOptimizacion.objects.create(
+        parametros=parametros, estado=TrabajoOptimizacion.EN_PROCESO, iniciado=timezone.now(),
+    )
+    _ejecutar(trabajo.id)
+    trabajo.refresh_from_db()
+    return trabajo
+
+
+def _ejecutar(trabajo_id):
+    trabajos = TrabajoOptimizacion.objects.filter(id=trabajo_id)
+
+    def progreso(fraccion, etapa):
+        trabajos.update(progreso=fraccion, etapa=etapa)
+
+    try:
+        trabajo = trabajos.get()
+        # 'tipo': 'escenarios' es una grilla de escenarios; si no, una optimización
+        if trabajo.parametros.get('tipo') == 'escenarios':
+            with metricas.span('escenarios'):
+                resultado = escenarios.evaluar(trabajo.parametros, progreso)
+        else:
+            with metricas.span('optimizar_ruta', modo='asincrono'):
+                resultado = ejecutar_optimizacion(trabajo.parametros, progreso)
+    except OptimizacionError as e:
+        trabajos.update(estado=TrabajoOptimizacion.ERROR, error=str(e), terminado=timezone.now())
+    except Exception as e:
+        logger.exception("Error inesperado en el trabajo %s", trabajo_id)
+        trabajos.update(
+            estado=TrabajoOptimizacion.ERROR,
+            error=f"Error inesperado al optimizar: {e}",
+            terminado=timezone.now(),
+        )
+    else:
+        trabajos.update(
+            estado=TrabajoOptimizacion.TERMINADO,
+            resultado=resultado,
+            progreso=1.0,
+            terminado=timezone.now(),
+        )
+
+
+def _iniciar_worker():
+    # necesario cuando los procesos se crean con 'spawn' (no heredan Django)
+    django.setup()
+
+
+def procesar_cola(procesos=2, intervalo=1.0, una_vez=False):
+    """
+    Toma trabajos pendientes y los ejecuta, como máximo 'procesos' a la vez.
+    Con una_vez=True termina cuando la cola queda vacía. Si el pool de procesos
+    se rompe (un worker murió), se crea uno nuevo.
+    """
+    recuperar_interrumpidos()
+    while not _procesar_con_pool(procesos, intervalo, una_vez):
+        logger.warning("El pool de procesos se rompió; se crea uno nuevo")
+
+
+def _revisar_terminados(terminados, en_curso):
+    """
+    Marca con error los trabajos cuyo worker lanzó una excepción (p. ej. el
+    proceso murió). Devuelve True si el pool quedó roto.
+    """
+    roto = False
+    for futuro in terminados:
+        trabajo_id = en_curso.pop(futuro)
+        error = futuro.exception()
+        if error is None:
+            continue
+        logger.error("El worker del trabajo %s falló: %r", trabajo_id, error)
+        marcar_error(trabajo_id, f"Error inesperado al optimizar: {error!r}")
+        roto = roto or isinstance(error, BrokenProcessPool)
+    return roto
+
+
+def _procesar_con_pool(procesos, intervalo, una_vez):
+    """Devuelve True si terminó (cola vacía con una_vez) y False si el pool se rompió."""
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_worker) as pool:
+        en_curso = {}  # futuro -> id del trabajo
+        while True:
+            while len(en_curso) < procesos:
+                trabajo_id = reclamar_siguiente()
+                if trabajo_id is None:
+                    break
+                # los procesos hijos no deben heredar la conexión abierta a la BD
+                connections.close_all()
+                try:
+                    en_curso[pool.submit(ejecutar_trabajo, trabajo_id)] = trabajo_id
+                except BrokenProcessPool:
+                    # no llegó a ejecutarse: vuelve a la cola para el pool nuevo
+                    TrabajoOptimizacion.objects.filter(id=trabajo_id).update(
+                        estado=TrabajoOptimizacion.PENDIENTE, iniciado=None
+                    )
+                    _revisar_terminados(list(en_curso), en_curso)
+                    return False
+
+            if not en_curso:
+                if una_vez:
+                    return True
+                time.sleep(intervalo)
+                continue
+            terminados, _ = wait(en_curso, timeout=intervalo, return_when=FIRST_COMPLETED)
+            if _revisar_terminados(terminados, en_curso):
+                # los demás trabajos del pool roto también fallaron
+                _revisar_terminados(wait(en_curso)[0], en_curso)
+                return False
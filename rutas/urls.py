@@ -4,7 +4,13 @@ from . import views
 urlpatterns = [
     path('', views.mapa_view, name='mapa'),
     path('agregar_punto/', views.agregar_punto, name='agregar_punto'),
+    path('importar_puntos/', views.importar_puntos, name='importar_puntos'),
     path('optimizar_ruta/', views.optimizar_ruta, name='optimizar_ruta'),
+    path('trabajos/<int:trabajo_id>/', views.estado_trabajo, name='estado_trabajo'),
+    path('planes/', views.planes_view, name='planes'),
+    path('escenarios/', views.escenarios_view, name='escenarios'),
+    path('api/puntos/', views.puntos_api, name='puntos_api'),
+    path('metrics', views.metricas_view, name='metricas'),
     path('borrar_puntos/', views.borrar_puntos, name='borrar_puntos'),
     path('borrar_punto/<int:punto_id>/', views.borrar_punto, name='borrar_punto'),
 ]
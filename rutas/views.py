@@ -1,15 +1,32 @@
 # views.py
 
 import json
-import requests
+import logging
+from datetime import datetime
+from urllib.parse import urlencode
 
 from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
-
-from .models import PuntoEntrega
+from django.urls import reverse
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET, require_POST
+
+from .models import EstadoRuta, PuntoEntrega, RutaPlan, TrabajoOptimizacion, Vehiculo
 from . import optimizer  # módulo de optimización
+from . import escenarios
+from . import espacial
+from . import geocoding
+from . import metricas
+from . import trabajos
+from .pipeline import (
+    OptimizacionError, ejecutar_optimizacion, reoptimizar_agregado, reoptimizar_quitado,
+)
+from .importacion import ImportacionError, importar_puntos as importar_puntos_archivo
+
+logger = logging.getLogger(__name__)
 
 # Precio por defecto de la bencina (CLP/L)
 DEFAULT_FUEL_PRICE = 1250
@@ -17,52 +34,113 @@ DEFAULT_FUEL_PRICE = 1250
 # Rendimiento por defecto del vehículo (km/L)
 DEFAULT_RENDIMIENTO = getattr(optimizer, 'AUTO_RENDIMIENTO_KM_POR_LITRO', 12)
 
+# Tiempo máximo por defecto del optimizador (segundos) y tope duro
+DEFAULT_MAX_SECONDS = getattr(settings, 'OPTIMIZER_MAX_SECONDS', 10)
+MAX_SECONDS_LIMITE = getattr(settings, 'OPTIMIZER_MAX_SECONDS_LIMITE', 60)
+
+# Hora de salida por defecto desde el origen (para las ventanas horarias)
+DEFAULT_HORA_SALIDA = '08:00'
+
+# Si es True, toda optimización se encola como trabajo en segundo plano
+OPTIMIZACION_ASINCRONA = getattr(settings, 'OPTIMIZACION_ASINCRONA', False)
+
+# Planes que muestra el historial
+PLANES_POR_PAGINA = 50
+
+# Bodegas habituales: (nombre, dirección) para los formularios de origen/destino
+BODEGAS = [
+    ('Bodega Laguna Grande', 'Avenida Laguna Grande 1120, Casa 36, San Pedro de la Paz'),
+    ('Bodega Díaz de Solís', 'Díaz de Solís 1879, Concepción'),
+    ('Bodega Camino Los Carros', 'Camino Los Carros 1955, Concepción'),
+]
+
+# Opción del formulario: elegir la bodega más conveniente entre las BODEGAS
+BODEGA_AUTOMATICA = 'auto'
+
+# Puntos por página de la API de puntos (por defecto y máximo)
+PUNTOS_POR_PAGINA = getattr(settings, 'PUNTOS_API_POR_PAGINA', 500)
+PUNTOS_POR_PAGINA_MAX = getattr(settings, 'PUNTOS_API_POR_PAGINA_MAX', 2000)
+
 
 def mapa_view(request):
     """
     Muestra el mapa, la lista de puntos, el formulario de origen/destino
-    y los resultados de la última optimización.
+    y, con ?plan=<id>, los resultados de un plan guardado (sin resolver de nuevo).
     """
-    puntos_entrega = PuntoEntrega.objects.all().order_by('orden_optimo', 'id')
-
-    # JSON que usará el JS para dibujar los puntos en el mapa
-    puntos_json = json.dumps([
-        {
-            'id': p.id,
-            'nombre': p.nombre,
-            'direccion': p.direccion,
-            'latitud': float(p.latitud),
-            'longitud': float(p.longitud),
-            'orden_optimo': p.orden_optimo,
-        }
-        for p in puntos_entrega
-    ])
+    puntos_entrega = PuntoEntrega.objects.select_related('vehiculo').order_by('vehiculo_id', 'orden_optimo', 'id')
+
+    # ?zona=sur,oeste,norte,este muestra solo los puntos de ese rectángulo
+    zona = None
+    if request.GET.get('zona'):
+        try:
+            zona = espacial.leer_rectangulo(request.GET['zona'])
+        except ValueError:
+            request.session['error_message'] = 'La zona indicada no es válida; se muestran todos los puntos.'
+        else:
+            puntos_entrega = espacial.en_rectangulo(puntos_entrega, *zona)
+
+    # el JS pide los puntos del mapa a la API (paginada y con ETag), no van en el HTML
+    puntos_api_url = reverse('puntos_api')
+    if zona:
+        puntos_api_url += '?' + urlencode({'zona': request.GET['zona']})
 
     context = {
         'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY,
-        'puntos_entrega_json': puntos_json,
+        'puntos_api_url': puntos_api_url,
         'puntos_entrega': puntos_entrega,
+        'zona': zona,
+
+        # valores del formulario (un plan abierto los reemplaza por los que usó)
+        'total_distance_km': None,
+        'precio_bencina': DEFAULT_FUEL_PRICE,
+        'rendimiento_vehiculo': DEFAULT_RENDIMIENTO,
+        'max_seconds': DEFAULT_MAX_SECONDS,
+        'hora_salida': DEFAULT_HORA_SALIDA,
+        'geometria': None,
+        'vehiculos': Vehiculo.objects.filter(activo=True).order_by('id'),
+        'bodegas': BODEGAS,
 
-        'total_distance_km': request.session.pop('total_distance_km', None),
-        'fuel_consumed_liters': request.session.pop('fuel_consumed_liters', None),
-        'fuel_cost_clp': request.session.pop('fuel_cost_clp', None),
-        'precio_bencina': request.session.pop('precio_bencina', DEFAULT_FUEL_PRICE),
+        'error_message': request.session.pop('error_message', None),
+        'import_resumen': request.session.pop('import_resumen', None),
+    }
 
-        # NUEVO: mantener el rendimiento que se usó en la última optimización
-        'rendimiento_vehiculo': request.session.pop('rendimiento_vehiculo', DEFAULT_RENDIMIENTO),
+    # resultado de un trabajo en segundo plano (?trabajo=<id>): al terminar queda como plan
+    trabajo_id = request.GET.get('trabajo', '')
+    if trabajo_id.isdigit():
+        trabajo = TrabajoOptimizacion.objects.filter(id=trabajo_id).first()
+        context['trabajo'] = trabajo
+        if trabajo is not None and trabajo.parametros.get('tipo') == 'escenarios':
+            return redirect(f"{reverse('escenarios')}?trabajo={trabajo.id}")
+        if trabajo is not None and trabajo.estado == TrabajoOptimizacion.TERMINADO:
+            if 'plan_id' in trabajo.resultado:
+                return redirect(f"{reverse('mapa')}?plan={trabajo.resultado['plan_id']}")
+            context.update(trabajo.resultado)
+        elif trabajo is not None and trabajo.estado == TrabajoOptimizacion.ERROR:
+            context['error_message'] = trabajo.error
+
+    # plan guardado (?plan=<id>): se muestra tal como quedó, con sus paradas
+    paradas_plan = None
+    plan_id = request.GET.get('plan', '')
+    if plan_id:
+        plan = RutaPlan.objects.filter(id=plan_id).first() if plan_id.isdigit() else None
+        if plan is None:
+            context['error_message'] = 'El plan indicado no existe.'
+        else:
+            context.update(plan.resultado)
+            context['plan'] = plan
+            paradas_plan = plan.paradas
 
-        'direccion_origen': request.session.pop('direccion_origen', ''),
-        'direccion_destino': request.session.pop('direccion_destino', ''),
+    # trazado de la ruta ya calculado en el backend (el mapa no llama a la Directions API)
+    context['geometria_json'] = json.dumps(context['geometria'])
+    context['paradas_plan_json'] = json.dumps(paradas_plan)
 
-        'origen_lat': request.session.pop('origen_lat', None),
-        'origen_lng': request.session.pop('origen_lng', None),
-        'destino_lat': request.session.pop('destino_lat', None),
-        'destino_lng': request.session.pop('destino_lng', None),
+    return render(request, 'rutas/mapa.html', context)
 
-        'error_message': request.session.pop('error_message', None),
-    }
 
-    return render(request, 'rutas/mapa.html', context)
+def _leer_hora(texto):
+    """Convierte "HH:MM" en datetime.time (None si viene vacío). Lanza ValueError."""
+    texto = (texto or '').strip()
+    return datetime.strptime(texto, '%H:%M').time() if texto else None
 
 
 def agregar_punto(request):
@@ -82,31 +160,12 @@ def agregar_punto(request):
     latitud = request.POST.get('latitud')
     longitud = request.POST.get('longitud')
 
-    # Geocodificación si no se proporcionan lat/lng
+    # Geocodificación si no se proporcionan lat/lng (con cache)
     if not latitud or not longitud:
         try:
-            geocode_url = "https://maps.googleapis.com/maps/api/geocode/json"
-            params = {
-                "address": direccion,
-                "key": settings.GOOGLE_MAPS_API_KEY
-            }
-            response = requests.get(geocode_url, params=params)
-            data = response.json()
-            if data['status'] == 'OK' and data['results']:
-                location = data['results'][0]['geometry']['location']
-                latitud = location['lat']
-                longitud = location['lng']
-            else:
-                request.session['error_message'] = (
-                    f"No se pudo geocodificar la dirección: {direccion}. "
-                    f"Estado: {data.get('status')}"
-                )
-                return redirect('mapa')
-        except requests.exceptions.RequestException as e:
-            request.session['error_message'] = f"Error de conexión con la API de geocodificación: {e}"
-            return redirect('mapa')
-        except Exception as e:
-            request.session['error_message'] = f"Error inesperado al geocodificar: {e}"
+            latitud, longitud = geocoding.geocodificar(direccion)
+        except geocoding.GeocodingError as e:
+            request.session['error_message'] = str(e)
             return redirect('mapa')
 
     # Convertir a float (el modelo ya se encargará del Decimal si corresponde)
@@ -117,50 +176,114 @@ def agregar_punto(request):
         request.session['error_message'] = 'Latitud o Longitud con formato incorrecto.'
         return redirect('mapa')
 
-    PuntoEntrega.objects.create(
+    demanda_str = request.POST.get('demanda_kg', '').strip()
+    try:
+        demanda_kg = float(demanda_str) if demanda_str else 0.0
+    except ValueError:
+        request.session['error_message'] = 'La demanda (kg) tiene formato incorrecto.'
+        return redirect('mapa')
+
+    # ventana horaria y tiempo de servicio (opcionales)
+    try:
+        ventana_inicio = _leer_hora(request.POST.get('ventana_inicio', ''))
+        ventana_fin = _leer_hora(request.POST.get('ventana_fin', ''))
+        servicio_str = request.POST.get('tiempo_servicio_min', '').strip()
+        tiempo_servicio_min = float(servicio_str) if servicio_str else 0.0
+    except ValueError:
+        request.session['error_message'] = 'La ventana horaria o el tiempo de servicio tienen formato incorrecto.'
+        return redirect('mapa')
+
+    punto = PuntoEntrega.objects.create(
         nombre=nombre,
         direccion=direccion,
         latitud=latitud,
         longitud=longitud,
+        demanda_kg=demanda_kg,
+        ventana_inicio=ventana_inicio,
+        ventana_fin=ventana_fin,
+        tiempo_servicio_min=tiempo_servicio_min,
     )
+
+    # si hay una ruta optimizada vigente, se actualiza solo alrededor del punto nuevo
+    resultado = _reoptimizar_o_descartar(reoptimizar_agregado, punto)
+    if resultado is not None:
+        return redirect(f"{reverse('mapa')}?plan={resultado['plan_id']}")
     return redirect('mapa')
 
 
-def optimizar_ruta(request):
+def _reoptimizar_o_descartar(reoptimizar, *args):
     """
-    Toma los puntos de entrega, el origen/destino, construye la matriz de distancias,
-    resuelve el TSP y guarda el orden óptimo + métricas de consumo/costo en sesión.
+    Actualiza la ruta vigente de forma incremental. Si falla, el punto ya quedó
+    creado o borrado: se registra el error y se descarta la ruta vigente (la
+    próxima optimización parte de cero). Devuelve el resultado o None.
+    """
+    try:
+        return reoptimizar(*args)
+    except Exception:
+        logger.exception("Falló la reoptimización incremental; se descarta la ruta vigente")
+        EstadoRuta.objects.all().delete()
+        return None
+
+
+def importar_puntos(request):
+    """
+    Carga masiva de puntos desde un archivo CSV o Excel subido en el formulario.
+    El resumen (creados, duplicados y errores por fila) se muestra en el mapa.
     """
     if request.method != 'POST':
         return redirect('mapa')
 
-    puntos_entrega_db = list(PuntoEntrega.objects.all())
-    if not puntos_entrega_db:
-        request.session['error_message'] = 'No hay puntos de entrega para optimizar.'
+    archivo = request.FILES.get('archivo')
+    if archivo is None:
+        request.session['error_message'] = 'Debes seleccionar un archivo CSV o Excel.'
+        return redirect('mapa')
+
+    try:
+        resumen = importar_puntos_archivo(archivo, archivo.name)
+    except ImportacionError as e:
+        request.session['error_message'] = f"No se pudo importar el archivo: {e}"
         return redirect('mapa')
 
+    # solo los primeros errores, para no llenar la sesión
+    request.session['import_resumen'] = {
+        'creados': resumen['creados'],
+        'duplicados': resumen['duplicados'],
+        'total_errores': len(resumen['errores']),
+        'errores': resumen['errores'][:50],
+    }
+    return redirect('mapa')
+
+
+def _leer_parametros_optimizacion(post):
+    """
+    Lee del formulario el origen/destino (o los pares de bodegas candidatos
+    si se pide la más conveniente), el rendimiento, el precio de la bencina,
+    el tiempo máximo, la hora de salida, si se usa la flota y la zona. Lanza OptimizacionError si falta algo obligatorio.
+    """
     # 1) ORIGEN
-    origen_predef = request.POST.get('origen_predefinido', '').strip()
-    origen_custom = request.POST.get('origen_custom', '').strip()
+    origen_predef = post.get('origen_predefinido', '').strip()
+    origen_custom = post.get('origen_custom', '').strip()
 
     if origen_predef == 'custom':
         direccion_origen = origen_custom
+    elif origen_predef == BODEGA_AUTOMATICA:
+        direccion_origen = [direccion for _, direccion in BODEGAS]
     elif origen_predef:
         direccion_origen = origen_predef
     else:
-        request.session['error_message'] = 'Debes seleccionar o escribir una dirección de origen.'
-        return redirect('mapa')
+        raise OptimizacionError('Debes seleccionar o escribir una dirección de origen.')
 
     if not direccion_origen:
-        request.session['error_message'] = 'La dirección de origen no puede estar vacía.'
-        return redirect('mapa')
+        raise OptimizacionError('La dirección de origen no puede estar vacía.')
 
     # 2) DESTINO (puede ser igual al origen, una bodega o una dirección personalizada)
-    destino_predef = request.POST.get('destino_predefinido', '').strip()
-    destino_custom = request.POST.get('destino_custom', '').strip()
+    destino_predef = post.get('destino_predefinido', '').strip()
+    destino_custom = post.get('destino_custom', '').strip()
 
     if destino_predef == 'custom':
         direccion_destino = destino_custom
+    elif destino_predef == BODEGA_AUTOMATICA:
+        direccion_destino = [direccion for _, direccion in BODEGAS]
     elif destino_predef == 'same_origin' or not destino_predef:
         # Por defecto, si no elige nada, volvemos al origen
         direccion_destino = direccion_origen
@@ -168,140 +291,304 @@ def optimizar_ruta(request):
         direccion_destino = destino_predef
 
     if not direccion_destino:
-        request.session['error_message'] = 'La dirección de destino no puede estar vacía.'
-        return redirect('mapa')
+        raise OptimizacionError('La dirección de destino no puede estar vacía.')
+
+    # con la bodega más conveniente, el pipeline prueba los pares candidatos
+    pares_bodegas = None
+    if isinstance(direccion_origen, list) or isinstance(direccion_destino, list):
+        if post.get('multi_vehiculo'):
+            raise OptimizacionError('La bodega más conveniente solo se elige para un vehículo.')
+        if destino_predef == 'same_origin' or not destino_predef:
+            pares_bodegas = [[origen, origen] for origen in direccion_origen]
+        else:
+            origenes = direccion_origen if isinstance(direccion_origen, list) else [direccion_origen]
+            destinos = direccion_destino if isinstance(direccion_destino, list) else [direccion_destino]
+            pares_bodegas = [[origen, destino] for origen in origenes for destino in destinos]
+        direccion_origen = direccion_destino = None
 
-    # 3) GEOCODIFICAR ORIGEN
-    geocode_url = "https://maps.googleapis.com/maps/api/geocode/json"
+    # tiempo máximo del optimizador (se devuelve la mejor ruta encontrada)
+    max_seconds_str = post.get('max_seconds', '').strip()
     try:
-        params_origen = {
-            "address": direccion_origen,
-            "key": settings.GOOGLE_MAPS_API_KEY
-        }
-        resp_o = requests.get(geocode_url, params=params_origen)
-        data_o = resp_o.json()
-
-        if data_o['status'] == 'OK' and data_o['results']:
-            loc_o = data_o['results'][0]['geometry']['location']
-            lat_inicio = float(loc_o['lat'])
-            lng_inicio = float(loc_o['lng'])
-            punto_inicio_coords = {'latitud': lat_inicio, 'longitud': lng_inicio}
-            request.session['origen_lat'] = lat_inicio
-            request.session['origen_lng'] = lng_inicio
-        else:
-            request.session['error_message'] = (
-                f"No se pudo geocodificar la dirección de origen: {direccion_origen} "
-                f"(estado: {data_o.get('status')})."
-            )
-            return redirect('mapa')
-    except Exception as e:
-        request.session['error_message'] = f"Error al geocodificar la dirección de origen: {e}"
-        return redirect('mapa')
+        max_seconds = float(max_seconds_str) if max_seconds_str else DEFAULT_MAX_SECONDS
+    except ValueError:
+        max_seconds = DEFAULT_MAX_SECONDS
+    if max_seconds <= 0 or max_seconds > MAX_SECONDS_LIMITE:
+        max_seconds = MAX_SECONDS_LIMITE
 
-    # 4) GEOCODIFICAR DESTINO
-    destino_coords = None
+    # rendimiento del vehículo
+    rendimiento_str = post.get('rendimiento_vehiculo', '').strip()
     try:
-        if direccion_destino == direccion_origen:
-            destino_coords = {'latitud': lat_inicio, 'longitud': lng_inicio}
-            request.session['destino_lat'] = lat_inicio
-            request.session['destino_lng'] = lng_inicio
+        if rendimiento_str:
+            rendimiento_vehiculo = float(rendimiento_str)
         else:
-            params_dest = {
-                "address": direccion_destino,
-                "key": settings.GOOGLE_MAPS_API_KEY
-            }
-            resp_d = requests.get(geocode_url, params=params_dest)
-            data_d = resp_d.json()
-            if data_d['status'] == 'OK' and data_d['results']:
-                loc_d = data_d['results'][0]['geometry']['location']
-                lat_dest = float(loc_d['lat'])
-                lng_dest = float(loc_d['lng'])
-                destino_coords = {'latitud': lat_dest, 'longitud': lng_dest}
-                request.session['destino_lat'] = lat_dest
-                request.session['destino_lng'] = lng_dest
-            else:
-                request.session['error_message'] = (
-                    f"No se pudo geocodificar la dirección destino: {direccion_destino} "
-                    f"(estado: {data_d.get('status')})."
-                )
-                return redirect('mapa')
-    except Exception as e:
-        request.session['error_message'] = f"Error al geocodificar la dirección destino: {e}"
-        return redirect('mapa')
+            rendimiento_vehiculo = DEFAULT_RENDIMIENTO
+    except ValueError:
+        rendimiento_vehiculo = DEFAULT_RENDIMIENTO
 
-    # 5) MATRIZ DE DISTANCIAS
-    distance_matrix = optimizer.get_distance_matrix(
-        puntos_entrega_db,
-        punto_inicio_coords,
-        settings.GOOGLE_MAPS_API_KEY,
-        dest_coords=destino_coords,
-    )
+    # precio bencina
+    precio_bencina_str = post.get('precio_bencina', '').strip()
+    try:
+        precio_bencina = float(precio_bencina_str) if precio_bencina_str else DEFAULT_FUEL_PRICE
+    except ValueError:
+        precio_bencina = DEFAULT_FUEL_PRICE
 
-    if distance_matrix is None:
-        request.session['error_message'] = (
-            'No se pudo obtener la matriz de distancias. '
-            'Revisa la clave API o la conexión.'
-        )
-        return redirect('mapa')
+    # hora de salida (para programar las ventanas horarias)
+    try:
+        hora_salida = _leer_hora(post.get('hora_salida', '')) or _leer_hora(DEFAULT_HORA_SALIDA)
+    except ValueError:
+        raise OptimizacionError('La hora de salida debe tener formato HH:MM.')
+
+    # zona: optimizar solo los puntos dentro del rectángulo visible del mapa
+    zona = None
+    if post.get('solo_zona'):
+        try:
+            zona = list(espacial.leer_rectangulo(post.get('zona', '')))
+        except ValueError:
+            raise OptimizacionError('No se pudo leer la zona visible del mapa.')
+
+    return {
+        'direccion_origen': direccion_origen,
+        'direccion_destino': direccion_destino,
+        'max_seconds': max_seconds,
+        'rendimiento_vehiculo': rendimiento_vehiculo,
+        'precio_bencina': precio_bencina,
+        'multi_vehiculo': bool(post.get('multi_vehiculo')),
+        'hora_salida': hora_salida.strftime('%H:%M'),
+        'zona': zona,
+        'pares_bodegas': pares_bodegas,
+    }
 
-    num_delivery_points = len(puntos_entrega_db)
-    end_index = num_delivery_points + 1 if destino_coords is not None else None
 
-    # 6) OPTIMIZAR RUTA
-    optimized_route_indices, total_distance_km = optimizer.solve_tsp(
-        distance_matrix,
-        num_delivery_points,
-        start_index=0,
-        end_index=end_index,
-    )
+def optimizar_ruta(request):
+    """
+    Toma los puntos de entrega, el origen/destino, construye la matriz de distancias,
+    resuelve el TSP, guarda el orden óptimo y guarda el resultado (consumo, costo,
+    trazado) como RutaPlan; redirige al mapa con ?plan=<id> para mostrarlo.
+
+    Si se pide en segundo plano (checkbox 'asincrono' o OPTIMIZACION_ASINCRONA),
+    solo encola un trabajo y el mapa consulta su estado hasta que termina.
+    """
+    if request.method != 'POST':
+        return redirect('mapa')
 
-    if not optimized_route_indices:
-        request.session['error_message'] = (
-            'No se pudo optimizar la ruta. Verifica los puntos o el algoritmo.'
-        )
+    if not PuntoEntrega.objects.exists():
+        request.session['error_message'] = 'No hay puntos de entrega para optimizar.'
         return redirect('mapa')
 
-    # 7) GUARDAR ORDEN ÓPTIMO (índices 1..n en la matriz)
-    for i, matrix_idx in enumerate(optimized_route_indices[1:-1]):  # saltamos start y end
-        if 1 <= matrix_idx <= num_delivery_points:
-            punto = puntos_entrega_db[matrix_idx - 1]  # lista empieza en 0
-            punto.orden_optimo = i + 1
-            punto.save()
+    try:
+        parametros = _leer_parametros_optimizacion(request.POST)
+    except OptimizacionError as e:
+        request.session['error_message'] = str(e)
+        return redirect('mapa')
 
-    # 8) CONSUMO Y COSTO
+    if request.POST.get('asincrono') or OPTIMIZACION_ASINCRONA:
+        trabajo = trabajos.encolar(parametros)
+        metricas.incrementar('rutas_trabajos_encolados_total')
+        return redirect(f"{reverse('mapa')}?trabajo={trabajo.id}")
 
-    # NUEVO: leer rendimiento del formulario
-    rendimiento_str = request.POST.get('rendimiento_vehiculo', '').strip()
     try:
-        if rendimiento_str:
-            rendimiento_vehiculo = float(rendimiento_str)
-        else:
-            rendimiento_vehiculo = DEFAULT_RENDIMIENTO
-    except ValueError:
-        rendimiento_vehiculo = DEFAULT_RENDIMIENTO
+        with metricas.span('optimizar_ruta', modo='sincrono'):
+            resultado = ejecutar_optimizacion(parametros)
+    except OptimizacionError as e:
+        request.session['error_message'] = str(e)
+        return redirect('mapa')
 
-    # calcular litros consumidos usando el rendimiento
-    fuel_consumed = optimizer.calculate_fuel_cost(total_distance_km, rendimiento_vehiculo)
+    return redirect(f"{reverse('mapa')}?plan={resultado['plan_id']}")
 
-    # precio bencina
-    precio_bencina_str = request.POST.get('precio_bencina', '').strip()
+
+def _leer_numeros(texto, nombre):
+    """
+    "1250; 1300; 12,5" -> [1250.0, 1300.0, 12.5] (separados por punto y coma o
+    espacios; se acepta la coma decimal). Lanza OptimizacionError.
+    """
     try:
-        precio_bencina = float(precio_bencina_str) if precio_bencina_str else DEFAULT_FUEL_PRICE
+        valores = [float(x.replace(',', '.')) for x in texto.replace(';', ' ').split()]
     except ValueError:
-        precio_bencina = DEFAULT_FUEL_PRICE
+        raise OptimizacionError(f'Los valores de {nombre} deben ser números separados por punto y coma.')
+    if not valores or any(v <= 0 for v in valores):
+        raise OptimizacionError(f'Indica al menos un valor positivo de {nombre}.')
+    if len(valores) > escenarios.MAX_VALORES:
+        raise OptimizacionError(f'Indica a lo más {escenarios.MAX_VALORES} valores de {nombre}.')
+    return list(dict.fromkeys(valores))
+
+
+def _leer_parametros_escenarios(post):
+    """Lee la grilla de escenarios del formulario. Lanza OptimizacionError si falta algo."""
+    direcciones = {direccion for _, direccion in BODEGAS}
+    origenes = [o for o in post.getlist('origenes') if o in direcciones]
+    destinos = [d for d in post.getlist('destinos') if d in direcciones or d == 'same_origin']
+    if not origenes:
+        raise OptimizacionError('Selecciona al menos una bodega de origen.')
+    if not destinos:
+        raise OptimizacionError('Selecciona al menos un destino.')
+
+    max_seconds_str = post.get('max_seconds', '').strip()
+    try:
+        max_seconds = float(max_seconds_str) if max_seconds_str else DEFAULT_MAX_SECONDS
+    except ValueError:
+        max_seconds = DEFAULT_MAX_SECONDS
+    if max_seconds <= 0 or max_seconds > MAX_SECONDS_LIMITE:
+        max_seconds = MAX_SECONDS_LIMITE
+
+    return {
+        'tipo': 'escenarios',
+        'origenes': origenes,
+        'destinos': destinos,
+        'precios': _leer_numeros(post.get('precios', ''), 'precio de la bencina'),
+        'rendimientos': _leer_numeros(post.get('rendimientos', ''), 'rendimiento'),
+        'max_seconds': max_seconds,
+    }
+
 
-    fuel_cost = fuel_consumed * precio_bencina
+def escenarios_view(request):
+    """
+    Comparación de escenarios: el formulario toma una grilla de bodegas de
+    origen/destino, precios y rendimientos y la evalúa en un solo trabajo (ver
+    escenarios.py); con ?trabajo=<id> muestra su avance o la tabla resultante.
+    """
+    if request.method == 'POST':
+        if not PuntoEntrega.objects.exists():
+            request.session['error_message'] = 'No hay puntos de entrega para evaluar escenarios.'
+            return redirect('escenarios')
+        try:
+            parametros = _leer_parametros_escenarios(request.POST)
+        except OptimizacionError as e:
+            request.session['error_message'] = str(e)
+            return redirect('escenarios')
+
+        if request.POST.get('asincrono') or OPTIMIZACION_ASINCRONA:
+            trabajo = trabajos.encolar(parametros)
+            metricas.incrementar('rutas_trabajos_encolados_total')
+        else:
+            trabajo = trabajos.ejecutar_ahora(parametros)
+        return redirect(f"{reverse('escenarios')}?trabajo={trabajo.id}")
 
-    # guardar en sesión para mostrar en el template
-    request.session['total_distance_km'] = round(total_distance_km, 2)
-    request.session['fuel_consumed_liters'] = round(fuel_consumed, 2)
-    request.session['fuel_cost_clp'] = round(fuel_cost, 0)
-    request.session['precio_bencina'] = precio_bencina
-    request.session['rendimiento_vehiculo'] = rendimiento_vehiculo
-    request.session['direccion_origen'] = direccion_origen
-    request.session['direccion_destino'] = direccion_destino
+    context = {
+        'bodegas': BODEGAS,
+        'precio_bencina': DEFAULT_FUEL_PRICE,
+        'rendimiento_vehiculo': DEFAULT_RENDIMIENTO,
+        'max_seconds': DEFAULT_MAX_SECONDS,
+        'error_message': request.session.pop('error_message', None),
+    }
+    trabajo_id = request.GET.get('trabajo', '')
+    if trabajo_id.isdigit():
+        trabajo = TrabajoOptimizacion.objects.filter(id=trabajo_id).first()
+        context['trabajo'] = trabajo
+        if trabajo is not None and trabajo.estado == TrabajoOptimizacion.TERMINADO:
+            context['resultado'] = trabajo.resultado
+        elif trabajo is not None and trabajo.estado == TrabajoOptimizacion.ERROR:
+            context['error_message'] = trabajo.error
+    return render(request, 'rutas/escenarios.html', context)
+
+
+def planes_view(request):
+    """
+    Historial de planes de ruta, del más reciente al más antiguo (?bodega=
+    filtra por dirección de origen). Abrir uno no vuelve a resolver la ruta.
+    """
+    planes = RutaPlan.objects.defer('matriz', 'resultado', 'paradas', 'rutas').order_by('-creado')
+    bodega = request.GET.get('bodega', '')
+    if bodega:
+        planes = planes.filter(bodega=bodega)
 
-    return redirect('mapa')
+    return render(request, 'rutas/planes.html', {
+        'planes': planes[:PLANES_POR_PAGINA],
+        'bodega': bodega,
+        'bodegas': RutaPlan.objects.order_by('bodega').values_list('bodega', flat=True).distinct(),
+    })
+
+
+def estado_trabajo(request, trabajo_id):
+    """
+    Estado, progreso y resultado de un trabajo de optimización (JSON, lo consulta
+    el mapa mientras el trabajo está pendiente o en proceso).
+    """
+    trabajo = get_object_or_404(TrabajoOptimizacion, id=trabajo_id)
+    return JsonResponse({
+        'id': trabajo.id,
+        'estado': trabajo.estado,
+        'progreso': trabajo.progreso,
+        'etapa': trabajo.etapa,
+        'resultado': trabajo.resultado,
+        'error': trabajo.error,
+    })
+
+
+def _punto_json(p):
+    return {
+        'id': p.id,
+        'nombre': p.nombre,
+        'direccion': p.direccion,
+        'latitud': float(p.latitud),
+        'longitud': float(p.longitud),
+        'orden_optimo': p.orden_optimo,
+        'vehiculo_id': p.vehiculo_id,
+    }
+
+
+@require_GET
+def puntos_api(request):
+    """
+    Puntos de entrega en JSON para el mapa, por páginas ordenadas por id:
+
+    - ?zona=sur,oeste,norte,este: solo los puntos del rectángulo (zona visible).
+    - ?despues=<id>: cursor; la respuesta trae en 'siguiente' la URL de la
+      página que sigue (o null si es la última).
+    - ?limite=<n>: puntos por página (máximo PUNTOS_POR_PAGINA_MAX).
+
+    La versión del conjunto (cantidad, último id y última modificación) va en
+    ETag y Last-Modified: si el cliente ya la tiene se responde 304 sin cuerpo.
+    Borrar un punto no cambia Last-Modified pero sí el ETag (cambia la
+    cantidad), que es el que manda cuando el cliente envía ambos.
+    """
+    puntos = PuntoEntrega.objects.all()
+    try:
+        if request.GET.get('zona'):
+            puntos = espacial.en_rectangulo(puntos, *espacial.leer_rectangulo(request.GET['zona']))
+        despues = int(request.GET.get('despues', 0))
+        limite = int(request.GET.get('limite', PUNTOS_POR_PAGINA))
+    except ValueError as e:
+        return JsonResponse({'error': f"Parámetros inválidos: {e}"}, status=400)
+    limite = max(1, min(limite, PUNTOS_POR_PAGINA_MAX))
+
+    version = puntos.aggregate(total=Count('id'), ultimo_id=Max('id'), actualizado=Max('actualizado'))
+    modificado = version['actualizado'].timestamp() if version['actualizado'] else None
+    etag = quote_etag(f"{version['total']}-{version['ultimo_id'] or 0}-{modificado or 0}")
+
+    respuesta = get_conditional_response(request, etag=etag, last_modified=modificado and int(modificado))
+    if respuesta is None:
+        pagina = list(puntos.filter(id__gt=despues).order_by('id')[:limite + 1])
+        siguiente = None
+        if len(pagina) > limite:
+            pagina = pagina[:limite]
+            parametros = request.GET.copy()
+            parametros['despues'] = pagina[-1].id
+            siguiente = f"{request.path}?{parametros.urlencode()}"
+        respuesta = JsonResponse({
+            'puntos': [_punto_json(p) for p in pagina],
+            'siguiente': siguiente,
+            'total': version['total'],
+        })
+
+    respuesta['ETag'] = etag
+    if modificado:
+        respuesta['Last-Modified'] = http_date(modificado)
+    # el navegador puede guardarla, pero debe revalidarla (barato: 304) cada vez
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
+
+
+def metricas_view(request):
+    """
+    Métricas del proceso (latencia por etapa, llamadas a las APIs, cache, solver)
+    en formato de texto de Prometheus.
+    """
+    if not metricas.habilitadas():
+        raise Http404("Métricas deshabilitadas")
+    return HttpResponse(
+        metricas.exportar_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
 
 
 def borrar_puntos(request):
@@ -310,6 +597,7 @@ def borrar_puntos(request):
     """
     if request.method == "POST":
         PuntoEntrega.objects.all().delete()
+        EstadoRuta.objects.all().delete()
     return redirect('mapa')
 
 
@@ -317,12 +605,26 @@ def borrar_puntos(request):
 def borrar_punto(request, punto_id):
     """
     Borra un solo punto de entrega (usado por el fetch JS).
-    Devuelve JSON para que el frontend sepa si fue OK.
+    Devuelve JSON para que el frontend sepa si fue OK y, si la ruta vigente se
+    actualizó, los nuevos totales y el trazado (el mapa se actualiza sin recargar).
     """
+    punto = get_object_or_404(PuntoEntrega, id=punto_id)
     try:
-        punto = get_object_or_404(PuntoEntrega, id=punto_id)
         punto.delete()
-        return JsonResponse({"ok": True})
     except Exception as e:
         # Útil para depurar si algo raro pasa en producción
         return JsonResponse({"ok": False, "error": str(e)}, status=500)
+
+    # la ruta vigente se repara solo alrededor del punto borrado
+    resultado = _reoptimizar_o_descartar(reoptimizar_quitado, punto_id)
+    if resultado is not None:
+        return JsonResponse({
+            "ok": True,
+            "ruta_actualizada": True,
+            "plan_id": resultado['plan_id'],
+            "total_distance_km": resultado['total_distance_km'],
+            "fuel_consumed_liters": resultado['fuel_consumed_liters'],
+            "fuel_cost_clp": resultado['fuel_cost_clp'],
+            "geometria": resultado['geometria'],
+        })
+    return JsonResponse({"ok": True, "ruta_actualizada": False})